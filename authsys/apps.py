@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AuthsysConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authsys'
+
+    # connect the signal handlers in authsys/signals.py
+    def ready(self):
+        from . import signals
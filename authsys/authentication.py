@@ -0,0 +1,85 @@
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .models import User
+
+
+# alias in settings.CACHES of the cache holding authenticated users
+AUTH_USER_CACHE_ALIAS = getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'auth')
+
+
+def get_user_cache():
+    return caches[AUTH_USER_CACHE_ALIAS]
+
+
+def get_version_key(user_id):
+    return f'auth:user:{user_id}:version'
+
+
+# return the cache version of a user. Saving the user moves it to a new version, so an entry written by a request that read
+# the user just before the save is never served afterwards.
+def get_user_version(user_id):
+    cache = get_user_cache()
+    key = get_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns())
+        version = cache.get(key)
+    return version
+
+
+# drop every cached copy of a user, called when the user or its customer profile is saved or deleted
+def invalidate_user(user_id):
+    cache = get_user_cache()
+    try:
+        cache.incr(get_version_key(user_id))
+    except ValueError:
+        cache.add(get_version_key(user_id), time.time_ns())
+
+
+# return the user with the given id (with its customer profile when AUTH_USER_CACHE_CUSTOMER is on), or None when there is none.
+# Users are read from the cache first; a miss loads the user with a single query and caches it.
+def get_cached_user(user_id):
+    cache = get_user_cache()
+    key = f'auth:user:{user_id}:{get_user_version(user_id)}'
+    user = cache.get(key)
+    if user is not None:
+        return user
+
+    users = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+    if getattr(settings, 'AUTH_USER_CACHE_CUSTOMER', True):
+        users = users.select_related('customer')
+    user = users.first()
+    if user is not None:
+        cache.set(key, user)
+    return user
+
+
+# CachedJWTAuthentication class, a drop-in replacement for simplejwt's JWTAuthentication that resolves the user of a token
+# from the in-process user cache instead of querying the user table on every request. The customer profile is loaded in the
+# same query, so request.user.customer costs no query either.
+class CachedJWTAuthentication(JWTAuthentication):
+    # override the get_user() method to read the user from the cache, keeping the checks of JWTAuthentication.get_user()
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
@@ -0,0 +1,14 @@
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .authentication import invalidate_user
+from .models import User
+
+
+# drop the cached copy of a user when it is saved (e.g. deactivated, or its password changed) or deleted, once the change is
+# committed: dropped earlier, a concurrent request could cache the old user again
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_user, instance.pk))
@@ -0,0 +1,167 @@
+# Async endpoint benchmark: the same catalog reads served by the sync views behind a pool of WSGI workers, and by the async
+# views of store/async_views.py under the ASGI handler, with every client taking --latency seconds to receive its response.
+#
+#   python -m benchmarks.async_endpoints --clients 64 --workers 4 --latency 0.05 --requests 400
+#
+# A sync worker stays busy while its slow client reads the response (as a sync gunicorn worker does), so the WSGI throughput
+# is capped at about workers / latency. The ASGI event loop serves other requests while it waits for a slow client.
+# Both stacks run in this process, against the same seeded SQLite database.
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.utils import setup_django
+
+
+def get_paths(data, rng, count):
+    paths = []
+    for _ in range(count):
+        paths.append(rng.choice([
+            '/store/{}products/',
+            f'/store/{{}}products/?ordering=-price&category_id={rng.choice(data["category_ids"])}',
+            f'/store/{{}}products/{rng.choice(data["product_ids"])}/',
+            '/store/{}categories/',
+            f'/store/{{}}carts/{rng.choice(data["cart_ids"])}/',
+        ]))
+    return paths
+
+
+def run_wsgi(paths, args):
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.db import connection
+    handler = WSGIHandler()
+
+    def request(path):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80', 'HTTP_HOST': 'testserver', 'HTTP_ACCEPT': 'application/json',
+            'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': io.StringIO(),
+        }
+        statuses = []
+        started = time.perf_counter()
+        body = handler(environ, lambda status, headers: statuses.append(status))
+        content = b''.join(body)
+        body.close()
+        # the worker is busy until the slow client has read the response
+        time.sleep(args.latency)
+        return int(statuses[0].split()[0]), len(content), time.perf_counter() - started
+
+    def worker(paths):
+        results = [request(path) for path in paths]
+        connection.close()
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        chunks = executor.map(worker, [paths[i::args.workers] for i in range(args.workers)])
+        results = [result for chunk in chunks for result in chunk]
+    return results, time.perf_counter() - started
+
+
+def run_asgi(paths, args):
+    from django.core.handlers.asgi import ASGIHandler
+    handler = ASGIHandler()
+
+    async def request(path):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'accept', b'application/json')],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        done = asyncio.Event()
+        received = []
+        response = {}
+
+        async def receive():
+            if not received:
+                received.append(True)
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['size'] = response.get('size', 0) + len(message.get('body', b''))
+                if not message.get('more_body'):
+                    # the slow client reads the response; the event loop serves other requests meanwhile
+                    await asyncio.sleep(args.latency)
+
+        started = time.perf_counter()
+        await handler(scope, receive, send)
+        done.set()
+        return response['status'], response['size'], time.perf_counter() - started
+
+    async def main():
+        semaphore = asyncio.Semaphore(args.clients)
+
+        async def client(path):
+            async with semaphore:
+                return await request(path)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[client(path) for path in paths])
+        return results, time.perf_counter() - started
+
+    return asyncio.run(main())
+
+
+def summarize(results, wall):
+    from benchmarks.endpoints import percentile
+    latencies = sorted(elapsed for _, _, elapsed in results)
+    return {
+        'requests': len(results),
+        'errors': sum(1 for status, _, _ in results if status >= 400),
+        'seconds': round(wall, 3),
+        'requests_per_second': round(len(results) / wall, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'bytes': sum(size for _, size, _ in results),
+    }
+
+
+def run(args):
+    # the ASGI stack of e_commerce/asgi.py: without the sync-only middleware
+    os.environ['DJANGO_ASGI'] = '1'
+    setup_django()
+    from benchmarks.endpoints import seed
+
+    rng = random.Random(args.seed)
+    data = seed(argparse.Namespace(
+        products=args.products, categories=20, customers=10, reviews=args.products, carts=100, items_per_cart=5
+    ), rng)
+    paths = get_paths(data, rng, args.requests)
+
+    wsgi = summarize(*run_wsgi([path.format('') for path in paths], args))
+    asgi = summarize(*run_asgi([path.format('async/') for path in paths], args))
+    report = {
+        'clients': args.clients, 'workers': args.workers, 'latency_ms': args.latency * 1000, 'products': args.products,
+        'wsgi_sync_views': wsgi, 'asgi_async_views': asgi,
+        'speedup': round(asgi['requests_per_second'] / wsgi['requests_per_second'], 2),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+    assert wsgi['errors'] == 0 and asgi['errors'] == 0, 'some requests failed'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the sync (WSGI) and async (ASGI) catalog endpoints with slow clients')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the dataset and request generators')
+    parser.add_argument('--products', type=int, default=2000, help='Number of products')
+    parser.add_argument('--requests', type=int, default=400, help='Number of requests per stack')
+    parser.add_argument('--clients', type=int, default=64, help='Number of concurrent clients')
+    parser.add_argument('--workers', type=int, default=4, help='Number of sync workers (threads) of the WSGI stack')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds every client takes to read its response')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    run(parser.parse_args())
@@ -0,0 +1,110 @@
+# Checkout benchmark: converts pre-built carts into orders through POST /store/orders/ on SQLite.
+#
+#   python -m benchmarks.checkout --orders 500 --threads 4
+#
+# Every cart also contains one unit of a "hot" product whose stock is smaller than the number of carts, so
+# concurrent checkouts compete for it. The run fails if that product is oversold or if any unit goes missing.
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.utils import setup_django
+
+
+def seed(orders, products, items_per_cart, hot_stock):
+    from authsys.models import User
+    from store.models import Cart, CartItem, Category, Customer, Product
+
+    category = Category.objects.create(title='Benchmark')
+    Product.objects.bulk_create([
+        Product(name=f'Product {i}', price=10 + i % 50, stock_quantity=orders * items_per_cart, category=category)
+        for i in range(products)
+    ])
+    hot = Product.objects.create(name='Hot product', price=99, stock_quantity=hot_stock, category=category)
+    product_ids = list(Product.objects.exclude(pk=hot.pk).values_list('id', flat=True))
+
+    users = User.objects.bulk_create([
+        User(username=f'bench{i}', email=f'bench{i}@example.com', first_name='Bench', last_name=str(i))
+        for i in range(orders)
+    ])
+    Customer.objects.bulk_create([Customer(user=user) for user in users])
+
+    carts = Cart.objects.bulk_create([Cart() for _ in range(orders)])
+    items = []
+    for i, cart in enumerate(carts):
+        items.append(CartItem(cart=cart, product=hot, quantity=1))
+        for j in range(items_per_cart - 1):
+            items.append(CartItem(cart=cart, product_id=product_ids[(i + j) % len(product_ids)], quantity=1 + j % 3))
+    CartItem.objects.bulk_create(items)
+    return hot.pk, list(zip(users, carts))
+
+
+def run(args):
+    setup_django()
+    from django.db import connection
+    from django.db.models import Sum
+    from rest_framework.test import APIClient
+    from store.models import Order, OrderItem, Product
+
+    hot_id, checkouts = seed(args.orders, args.products, args.items_per_cart, args.hot_stock)
+    stock_before = Product.objects.aggregate(total=Sum('stock_quantity'))['total']
+    connection.close()
+
+    # each client thread checks out every n-th cart over its own database connection
+    def client_thread(pairs):
+        client = APIClient()
+        results = []
+        for user, cart in pairs:
+            client.force_authenticate(user)
+            started = time.perf_counter()
+            response = client.post('/store/orders/', {'cart_id': str(cart.pk)}, format='json')
+            results.append((response.status_code, time.perf_counter() - started))
+        connection.close()
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        chunks = executor.map(client_thread, [checkouts[i::args.threads] for i in range(args.threads)])
+        results = [result for chunk in chunks for result in chunk]
+    wall = time.perf_counter() - started
+
+    created = sum(1 for status, _ in results if status == 201)
+    rejected = sum(1 for status, _ in results if status == 400)
+    errors = len(results) - created - rejected
+    hot_stock = Product.objects.get(pk=hot_id).stock_quantity
+    ordered = OrderItem.objects.aggregate(total=Sum('quantity'))['total'] or 0
+    stock_after = Product.objects.aggregate(total=Sum('stock_quantity'))['total']
+
+    report = {
+        'orders': args.orders,
+        'threads': args.threads,
+        'items_per_cart': args.items_per_cart,
+        'created': created,
+        'rejected_out_of_stock': rejected,
+        'errors': errors,
+        'seconds': round(wall, 3),
+        'orders_per_second': round(created / wall, 1),
+        'checkouts_per_second': round(len(results) / wall, 1),
+        'mean_latency_ms': round(sum(elapsed for _, elapsed in results) / len(results) * 1000, 2),
+        'hot_product_stock_left': hot_stock,
+        'orders_in_db': Order.objects.count(),
+    }
+    print(json.dumps(report, indent=2))
+
+    assert hot_stock >= 0, 'hot product was oversold'
+    assert created == min(args.orders, args.hot_stock), 'unexpected number of successful checkouts'
+    assert stock_before - stock_after == ordered, 'stock and ordered quantities do not add up'
+    assert errors == 0, 'some checkouts failed with an unexpected status'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark POST /store/orders/ (cart checkout) on SQLite')
+    parser.add_argument('--orders', type=int, default=300, help='Number of carts to check out')
+    parser.add_argument('--threads', type=int, default=4, help='Number of concurrent clients')
+    parser.add_argument('--products', type=int, default=200, help='Number of products in the catalog')
+    parser.add_argument('--items-per-cart', type=int, default=5, help='Number of distinct products per cart')
+    parser.add_argument('--hot-stock', type=int, default=None, help='Stock of the contended product (default: half the orders)')
+    args = parser.parse_args()
+    if args.hot_stock is None:
+        args.hot_stock = args.orders // 2
+    run(args)
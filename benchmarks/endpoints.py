@@ -0,0 +1,224 @@
+# Endpoint benchmark: seeds a deterministic catalog on SQLite and drives the hot endpoints in-process.
+#
+#   python -m benchmarks.endpoints --products 5000 --requests 200 --output before.json
+#   python -m benchmarks.endpoints --products 5000 --requests 200 --output after.json --compare before.json
+#
+# Every scenario sends --requests requests (after --warmup untimed ones) built from a random generator seeded with --seed,
+# so two runs with the same arguments send the same requests against the same data. The catalog response cache is
+# cleared before every request unless --cache is given, so the numbers measure the views rather than cache hits.
+# The report (latency percentiles, queries per request, throughput) is printed and written as JSON to --output.
+import argparse
+import json
+import platform
+import random
+import subprocess
+import time
+from benchmarks.utils import setup_django
+
+
+WORDS = [
+    'laptop', 'phone', 'chair', 'desk', 'lamp', 'camera', 'speaker', 'watch', 'keyboard', 'monitor',
+    'kettle', 'blender', 'jacket', 'shoes', 'backpack', 'bottle', 'headphones', 'router', 'printer', 'mouse',
+]
+ADJECTIVES = ['wireless', 'compact', 'classic', 'premium', 'portable', 'smart', 'steel', 'leather', 'ergonomic', 'mini']
+PASSWORD = 'bench-password'
+
+
+def seed(args, rng):
+    from django.core.management import call_command
+    from authsys.models import User
+    from store.models import Cart, CartItem, Category, Customer, Product, Review
+
+    categories = Category.objects.bulk_create([Category(title=f'Category {i}') for i in range(args.categories)])
+    Product.objects.bulk_create([
+        Product(
+            name=f'{rng.choice(ADJECTIVES).title()} {rng.choice(WORDS)} {i}',
+            description=' '.join(rng.choice(WORDS + ADJECTIVES) for _ in range(12)),
+            price=rng.randint(100, 99999) / 100,
+            stock_quantity=rng.randint(0, 500),
+            category=categories[i % len(categories)],
+        )
+        for i in range(args.products)
+    ], batch_size=1000)
+    product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+
+    # hash the password once: every benchmark user shares it
+    password = User(username='template')
+    password.set_password(PASSWORD)
+    users = User.objects.bulk_create([
+        User(username=f'bench{i}', email=f'bench{i}@example.com', first_name='Bench', last_name=str(i), password=password.password)
+        for i in range(args.customers)
+    ], batch_size=1000)
+    customers = Customer.objects.bulk_create([Customer(user=user) for user in users], batch_size=1000)
+
+    Review.objects.bulk_create([
+        Review(customer=rng.choice(customers), product_id=rng.choice(product_ids), summary='Benchmark review', rating=rng.randint(1, 5))
+        for _ in range(args.reviews)
+    ], batch_size=1000)
+
+    carts = Cart.objects.bulk_create([Cart() for _ in range(args.carts)])
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product_id=product_id, quantity=rng.randint(1, 3))
+        for cart in carts
+        for product_id in rng.sample(product_ids, min(args.items_per_cart, len(product_ids)))
+    ], batch_size=1000)
+
+    # bulk_create skips the signals: fill the search index and the denormalized counters like a bulk import does
+    call_command('rebuild_search_index', verbosity=0)
+    call_command('reconcile_category_counts', verbosity=0)
+    call_command('recompute_ratings', verbosity=0)
+
+    return {
+        'category_ids': [category.id for category in categories],
+        'product_ids': product_ids,
+        'usernames': [user.username for user in users],
+        'cart_ids': [str(cart.id) for cart in carts],
+    }
+
+
+# each scenario returns a function building the next request as (method, url, data) from the random generator
+def get_scenarios(data):
+    category_ids, product_ids = data['category_ids'], data['product_ids']
+    return {
+        'product_list': lambda rng: ('get', '/store/products/', {}),
+        'product_search': lambda rng: ('get', '/store/products/', {'search': rng.choice(WORDS)}),
+        'product_filter': lambda rng: ('get', '/store/products/', {
+            'category_id': rng.choice(category_ids), 'price__gte': rng.randint(1, 200), 'price__lte': rng.randint(300, 999)
+        }),
+        'product_order': lambda rng: ('get', '/store/products/', {'ordering': rng.choice(['price', '-price', '-rating_avg', 'stock_quantity'])}),
+        'product_detail': lambda rng: ('get', f'/store/products/{rng.choice(product_ids)}/', {}),
+        'category_list': lambda rng: ('get', '/store/categories/', {}),
+        'cart_get': lambda rng: ('get', f'/store/carts/{rng.choice(data["cart_ids"])}/', {}),
+        'cart_add': lambda rng: ('post', f'/store/carts/{rng.choice(data["cart_ids"])}/items/', {
+            'product_id': rng.choice(product_ids), 'quantity': rng.randint(1, 3)
+        }),
+        'login': lambda rng: ('post', '/auth/login', {'username': rng.choice(data['usernames']), 'password': PASSWORD}),
+    }
+
+
+# value below which `fraction` of the sorted samples fall (nearest rank)
+def percentile(samples, fraction):
+    index = max(int(round(fraction * len(samples) + 0.5)) - 1, 0)
+    return samples[min(index, len(samples) - 1)]
+
+
+def run_scenario(build_request, args, rng):
+    from django.core.cache import caches
+    from rest_framework.test import APIClient
+    from store.querybudget import count_queries
+
+    client = APIClient()
+    latencies = []
+    queries = []
+    errors = 0
+    for number in range(args.warmup + args.requests):
+        method, url, data = build_request(rng)
+        if not args.cache:
+            caches['catalog'].clear()
+        with count_queries() as log:
+            started = time.perf_counter()
+            response = client.post(url, data, format='json') if method == 'post' else client.get(url, data)
+            elapsed = time.perf_counter() - started
+        if number < args.warmup:
+            continue
+        latencies.append(elapsed)
+        queries.append(len(log))
+        if response.status_code >= 400:
+            errors += 1
+
+    total = sum(latencies)
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_ms': round(total / len(latencies) * 1000, 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'max_queries': max(queries),
+        'requests_per_second': round(len(latencies) / total, 1),
+    }
+
+
+def get_environment():
+    import django
+    from django.db import connection
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+    }
+
+
+# print the change of every scenario's p50/p95 and throughput against an earlier report
+def compare(report, baseline):
+    print(f'\nCompared with {baseline["environment"].get("commit")}:')
+    for name, result in report['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        changes = ', '.join(
+            f'{key} {before[key]} -> {result[key]} ({(result[key] - before[key]) / before[key] * 100:+.1f}%)'
+            for key in ('p50_ms', 'p95_ms', 'requests_per_second', 'queries_per_request') if before[key]
+        )
+        print(f'  {name}: {changes}')
+
+
+def run(args):
+    setup_django()
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    data = seed(args, rng)
+    seconds = time.perf_counter() - started
+
+    scenarios = get_scenarios(data)
+    selected = args.scenarios or list(scenarios)
+    unknown = set(selected) - set(scenarios)
+    if unknown:
+        raise SystemExit(f'Unknown scenarios: {", ".join(sorted(unknown))} (choose from {", ".join(scenarios)})')
+
+    report = {
+        'environment': get_environment(),
+        'dataset': {
+            'seed': args.seed, 'products': args.products, 'categories': args.categories, 'customers': args.customers,
+            'reviews': args.reviews, 'carts': args.carts, 'items_per_cart': args.items_per_cart, 'seed_seconds': round(seconds, 2),
+        },
+        'settings': {'requests': args.requests, 'warmup': args.warmup, 'cache': args.cache},
+        'scenarios': {},
+    }
+    for name in selected:
+        # every scenario gets its own generator, so selecting a subset does not change the requests of the others
+        report['scenarios'][name] = run_scenario(scenarios[name], args, random.Random(f'{args.seed}:{name}'))
+        print(f'{name:16} {json.dumps(report["scenarios"][name])}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f'\nWrote {args.output}')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            compare(report, json.load(file))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the hot API endpoints on a seeded SQLite dataset')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the dataset and request generators')
+    parser.add_argument('--products', type=int, default=2000, help='Number of products')
+    parser.add_argument('--categories', type=int, default=20, help='Number of categories')
+    parser.add_argument('--customers', type=int, default=200, help='Number of customers (login users)')
+    parser.add_argument('--reviews', type=int, default=5000, help='Number of reviews')
+    parser.add_argument('--carts', type=int, default=100, help='Number of carts')
+    parser.add_argument('--items-per-cart', type=int, default=5, help='Number of distinct products per cart')
+    parser.add_argument('--requests', type=int, default=200, help='Number of timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='Number of untimed requests per scenario')
+    parser.add_argument('--cache', action='store_true', help='Keep the catalog response cache between requests')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--compare', help='Compare with the JSON report of an earlier run')
+    parser.add_argument('scenarios', nargs='*', help='Scenarios to run (default: all)')
+    run(parser.parse_args())
@@ -0,0 +1,121 @@
+# Pricing benchmark: the cheapest page of products within a price range for every membership tier, computed in Python from
+# the loaded rows (as Product.discounted_price was used) and by the effective_price annotation of store/pricing.py, on SQLite.
+#
+#   python -m benchmarks.pricing --products 50000 --repeat 5
+#
+# The run fails if a single SQL price of the catalog differs from the Decimal reference of get_effective_price(), or if the
+# two paths return different pages. The float arithmetic of the former discounted_price is reported for comparison.
+import argparse
+import json
+import random
+import time
+from decimal import Decimal
+from benchmarks.endpoints import percentile
+from benchmarks.utils import setup_django
+
+PAGE_SIZE = 15
+
+
+def seed(products, rng):
+    from store.models import Category, Product
+
+    categories = Category.objects.bulk_create([Category(title=f'Category {i}') for i in range(20)])
+    Product.objects.bulk_create([
+        Product(
+            name=f'Product {i}', price=Decimal(rng.randint(1, 999999)) / 100, stock_quantity=rng.randint(0, 500),
+            discount=rng.choice([None, 0, Decimal(rng.randint(0, 10000)) / 100, Decimal(rng.choice([5, 10, 12.5, 15, 33.33, 50]))]),
+            category=categories[i % len(categories)],
+        )
+        for i in range(products)
+    ], batch_size=1000)
+
+
+# the float arithmetic of the former Product.discounted_price (which multiplied the Decimal price by a float factor directly)
+def get_float_price(price, discount):
+    if discount:
+        return round(price * Decimal((100 - float(discount)) / 100), 2)
+    return price
+
+
+def python_page(membership, low, high):
+    from store.models import Product
+    from store.pricing import get_effective_price
+    rows = []
+    for product_id, price, discount in Product.objects.values_list('id', 'price', 'discount').iterator(chunk_size=2000):
+        effective_price = get_effective_price(price, discount, membership)
+        if low <= effective_price <= high:
+            rows.append((effective_price, product_id))
+    return sorted(rows)[:PAGE_SIZE]
+
+
+def sql_page(membership, low, high):
+    from store.models import Product
+    from store.pricing import get_effective_price_expression
+    products = Product.objects.annotate(effective_price=get_effective_price_expression(membership))\
+        .filter(effective_price__gte=low, effective_price__lte=high)\
+        .order_by('effective_price', 'id')\
+        .values_list('effective_price', 'id')
+    return list(products[:PAGE_SIZE])
+
+
+def measure(function, repeat, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return result, timings
+
+
+# compare every SQL price of the catalog with the Decimal reference and with the former float arithmetic
+def check_prices(membership):
+    from store.models import Product
+    from store.pricing import get_effective_price, get_effective_price_expression
+    rows = Product.objects.annotate(effective_price=get_effective_price_expression(membership))\
+        .values_list('price', 'discount', 'effective_price')
+    mismatches = float_mismatches = 0
+    for price, discount, effective_price in rows.iterator(chunk_size=2000):
+        expected = get_effective_price(price, discount, membership)
+        mismatches += effective_price != expected
+        float_mismatches += membership is None and get_float_price(price, discount) != expected
+    return mismatches, float_mismatches
+
+
+def run(args):
+    setup_django()
+    from store.models import Customer
+
+    seed(args.products, random.Random(args.seed))
+    low, high = Decimal(args.low), Decimal(args.high)
+    report = {'products': args.products, 'range': [args.low, args.high], 'tiers': {}}
+    for membership in [None, *dict(Customer.MEMBERSHIP_CHOICES)]:
+        python_result, python_timings = measure(python_page, args.repeat, membership, low, high)
+        sql_result, sql_timings = measure(sql_page, args.repeat, membership, low, high)
+        assert python_result == sql_result, f'the pages of the two paths differ for the tier {membership}'
+        mismatches, float_mismatches = check_prices(membership)
+        assert mismatches == 0, f'{mismatches} SQL prices differ from the reference for the tier {membership}'
+
+        report['tiers'][membership or 'public'] = result = {
+            'python_p50_ms': round(percentile(sorted(python_timings), 0.5) * 1000, 2),
+            'sql_p50_ms': round(percentile(sorted(sql_timings), 0.5) * 1000, 2),
+            'sql_mismatches': mismatches,
+        }
+        result['speedup'] = round(result['python_p50_ms'] / result['sql_p50_ms'], 2)
+        if membership is None:
+            result['float_discounted_price_mismatches'] = float_mismatches
+        print(f'{membership or "public":6}: {json.dumps(result)}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the effective price annotation against pricing the rows in Python')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the dataset generator')
+    parser.add_argument('--products', type=int, default=50000, help='Number of products')
+    parser.add_argument('--low', default='100', help='Lowest effective price of the page')
+    parser.add_argument('--high', default='500', help='Highest effective price of the page')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs per path and tier')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    run(parser.parse_args())
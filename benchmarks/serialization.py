@@ -0,0 +1,98 @@
+# Product list serialization benchmark: GET /store/products/ rendered by ProductSerializer and by the values() fast path
+# of store/valueserializers.py, at several page sizes, on SQLite.
+#
+#   python -m benchmarks.serialization --products 3000 --page-sizes 15 100 1000
+#
+# Both paths answer the same requests with the catalog cache cleared; the run fails if their responses differ by a byte.
+import argparse
+import json
+import random
+import time
+from unittest import mock
+from benchmarks.endpoints import percentile
+from benchmarks.utils import setup_django
+
+
+def seed(products, images_per_product, rng):
+    from store.models import Category, Product, ProductImage
+
+    categories = Category.objects.bulk_create([Category(title=f'Category {i}') for i in range(20)])
+    Product.objects.bulk_create([
+        Product(
+            name=f'Product {i}', description=f'Description of product {i}', price=rng.randint(100, 99999) / 100,
+            stock_quantity=rng.randint(0, 500), category=categories[i % len(categories)],
+            rating_avg=rng.randint(100, 500) / 100, rating_count=rng.randint(0, 50),
+        )
+        for i in range(products)
+    ], batch_size=1000)
+    ProductImage.objects.bulk_create([
+        ProductImage(
+            product_id=product_id, image=f'store/images/product_{product_id}_{n}.jpg', width=1200, height=900,
+            variants={
+                image_format: {str(width): f'store/images/variants/product_{product_id}_{n}_{width}w.{image_format}' for width in (160, 320, 640)}
+                for image_format in ('webp', 'jpeg')
+            },
+        )
+        for product_id in Product.objects.values_list('id', flat=True)
+        for n in range(images_per_product)
+    ], batch_size=1000)
+
+
+def measure(client, url, fast, requests):
+    from django.core.cache import caches
+    from store.views import ProductViewSet
+
+    values_serializer_class = ProductViewSet.values_serializer_class if fast else None
+    latencies = []
+    with mock.patch.object(ProductViewSet, 'values_serializer_class', values_serializer_class):
+        for _ in range(requests):
+            caches['catalog'].clear()
+            started = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - started)
+    assert response.status_code == 200, response.status_code
+    latencies.sort()
+    return response.content, latencies
+
+
+def run(args):
+    setup_django()
+    from rest_framework.test import APIClient
+    from store.views import ProductViewSet
+
+    seed(args.products, args.images_per_product, random.Random(args.seed))
+    client = APIClient()
+    report = {'products': args.products, 'images_per_product': args.images_per_product, 'page_sizes': {}}
+    for page_size in args.page_sizes:
+        with mock.patch.object(ProductViewSet.pagination_class, 'page_size', page_size):
+            # fewer requests for bigger pages, so every page size takes about as long
+            requests = max(args.requests * 15 // page_size, 5)
+            serializer_content, serializer = measure(client, '/store/products/?ordering=-price', False, requests)
+            values_content, values = measure(client, '/store/products/?ordering=-price', True, requests)
+        assert serializer_content == values_content, f'the responses of the two paths differ at page size {page_size}'
+
+        report['page_sizes'][page_size] = result = {
+            'requests': requests,
+            'response_bytes': len(values_content),
+            'serializer_p50_ms': round(percentile(serializer, 0.5) * 1000, 2),
+            'values_p50_ms': round(percentile(values, 0.5) * 1000, 2),
+            'serializer_p95_ms': round(percentile(serializer, 0.95) * 1000, 2),
+            'values_p95_ms': round(percentile(values, 0.95) * 1000, 2),
+        }
+        result['speedup'] = round(result['serializer_p50_ms'] / result['values_p50_ms'], 2)
+        print(f'page size {page_size:5}: {json.dumps(result)}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ProductSerializer against the values() fast path of the product list')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the dataset generator')
+    parser.add_argument('--products', type=int, default=3000, help='Number of products')
+    parser.add_argument('--images-per-product', type=int, default=2, help='Number of images per product')
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[15, 100, 1000], help='Page sizes to measure')
+    parser.add_argument('--requests', type=int, default=200, help='Number of requests per path at a page size of 15')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    run(parser.parse_args())
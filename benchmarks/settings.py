@@ -0,0 +1,31 @@
+import os
+import tempfile
+from e_commerce.settings import *
+
+
+# Benchmarks run in-process against a throwaway SQLite database, never the configured MySQL one.
+DEBUG = False
+
+ALLOWED_HOSTS = ['*']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCH_DATABASE', os.path.join(tempfile.gettempdir(), 'e_commerce_bench.sqlite3')),
+        'OPTIONS': {
+            # take the write lock when a transaction starts, so concurrent writers queue instead of failing
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 30,
+        },
+    }
+}
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+}
+
+# the benchmarks report the queries of every request themselves
+QUERY_BUDGET_LOGGING = False
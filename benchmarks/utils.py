@@ -0,0 +1,15 @@
+import os
+import django
+
+
+# point django at benchmarks/settings.py, set it up and create a fresh database
+def setup_django(fresh=True):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    django.setup()
+
+    from django.conf import settings
+    from django.core.management import call_command
+    database = settings.DATABASES['default']['NAME']
+    if fresh and os.path.exists(database):
+        os.remove(database)
+    call_command('migrate', verbosity=0)
@@ -44,7 +44,7 @@ values
 	(41, 'Lettuce - California Mix', 'condimentum neque sapien placerat ante nulla justo aliquam quis turpis eget elit sodales scelerisque mauris sit', 11.23, '6', 19, '2022-01-31'),
 	(42, 'Dr. Pepper - 355ml', 'nisl nunc nisl duis bibendum felis sed interdum venenatis turpis enim', 58.22, '7', 30, '2022-12-07'),
 	(43, 'Wine - Chateau Bonnet', 'donec posuere metus vitae ipsum aliquam non mauris morbi non lectus aliquam sit amet diam in magna bibendum imperdiet', 80.14, '5', 37, '2020-02-05'),
-	(44, 'Wine - Segura Viudas Aria Brut', 'curae nulla dapibus dolor vel est donec odio justo sollicitudin ut suscipit a feugiat et eros vestibulum ac est', 71.74, '1', 2, '2024-07-10');,
+	(44, 'Wine - Segura Viudas Aria Brut', 'curae nulla dapibus dolor vel est donec odio justo sollicitudin ut suscipit a feugiat et eros vestibulum ac est', 71.74, '1', 2, '2024-07-10'),
 	(45, 'Scampi Tail', 'molestie lorem quisque ut erat curabitur gravida nisi at nibh in hac habitasse platea dictumst aliquam augue quam', 19.96, '2', 25, '2022-07-25'),
 	(46, 'Soup - Campbells, Butternut', 'ultrices posuere cubilia curae nulla dapibus dolor vel est donec odio justo sollicitudin ut', 59.54, '1', 33, '2024-05-23'),
 	(47, 'Coffee - Decaffeinato Coffee', 'ac nulla sed vel enim sit amet nunc viverra dapibus nulla suscipit ligula', 28.0, '4', 32, '2022-12-29'),
@@ -56,7 +56,7 @@ values
 	(53, 'Gherkin - Sour', 'ut rhoncus aliquet pulvinar sed nisl nunc rhoncus dui vel sem sed sagittis nam congue risus', 32.65, '3', 16, '2021-01-14'),
 	(54, 'Beef - Short Ribs', 'ullamcorper augue a suscipit nulla elit ac nulla sed vel enim sit', 55.77, '6', 5, '2020-02-25'),
 	(55, 'Cake - Box Window 10x10x2.5', 'suspendisse potenti nullam porttitor lacus at turpis donec posuere metus vitae ipsum aliquam non mauris morbi', 13.4, '8', 32, '2022-06-10'),
-	56, 'Apple - Fuji', 'vulputate nonummy maecenas tincidunt lacus at velit vivamus vel nulla eget eros', 38.55, '2', 10, '2022-07-10'),
+	(56, 'Apple - Fuji', 'vulputate nonummy maecenas tincidunt lacus at velit vivamus vel nulla eget eros', 38.55, '2', 10, '2022-07-10'),
 	(57, 'Pork - Inside', 'proin at turpis a pede posuere nonummy integer non velit donec diam neque vestibulum eget', 6.81, '9', 31, '2021-11-22'),
 	(58, 'Ice Cream Bar - Oreo Cone', 'augue quam sollicitudin vitae consectetuer eget rutrum at lorem integer', 48.59, '10', 43, '2023-10-12'),
 	(59, 'Berry Brulee', 'orci pede venenatis non sodales sed tincidunt eu felis fusce posuere felis sed lacus morbi sem mauris laoreet ut rhoncus', 27.84, '5', 37, '2020-07-18'),
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'e_commerce.settings')
+# leave out the sync-only middleware (see SYNC_ONLY_MIDDLEWARE in settings.py)
+os.environ.setdefault('DJANGO_ASGI', '1')
 
 application = get_asgi_application()
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -52,6 +53,8 @@ INTERNAL_IPS = [
 ]
 
 MIDDLEWARE = [
+    'store.middleware.RequestMetricsMiddleware',
+    'store.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -63,6 +66,30 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Under ASGI a single sync-only middleware makes Django handle every request in a worker thread, which takes away the point of
+# the async views (store/async_views.py). The ASGI application (e_commerce/asgi.py sets DJANGO_ASGI) runs next to the sync
+# one and leaves these out: static files and the debug toolbar stay on the sync stack.
+SYNC_ONLY_MIDDLEWARE = [
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'debug_toolbar.middleware.DebugToolbarMiddleware',
+]
+if os.environ.get('DJANGO_ASGI'):
+    MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in SYNC_ONLY_MIDDLEWARE]
+
+# Log (as warnings of the store.querybudget logger) every request running more queries than the budget of its endpoint
+# in store/querybudget.py
+QUERY_BUDGET_LOGGING = DEBUG
+
+# Per-request Server-Timing headers and per-view metrics served in the Prometheus format at /metrics (see store/metrics.py).
+# Every process writes its metrics to its own file in METRICS_DIR every METRICS_FLUSH_INTERVAL seconds; give all the
+# gunicorn workers of a deployment the same directory and empty it when the deployment starts. /metrics exposes the traffic
+# and errors of every endpoint: when METRICS_TOKEN is set it requires an "Authorization: Bearer <token>" header, otherwise
+# it only answers clients in INTERNAL_IPS (behind a proxy, REMOTE_ADDR is the proxy, so set a token).
+METRICS_ENABLED = True
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'e_commerce_metrics'))
+METRICS_FLUSH_INTERVAL = 1.0
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 ROOT_URLCONF = 'e_commerce.urls'
 
 TEMPLATES = [
@@ -99,6 +126,44 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# The 'catalog' cache holds product and category responses (see store/caching.py), under a version kept in the database:
+# a write made by any process (web, async and job workers, management commands) moves it for every process, so a
+# per-process cache never serves stale responses. To also share the entries between workers, swap the backend for
+# 'django.core.cache.backends.redis.RedisCache' (LOCATION = 'redis://...', maxmemory-policy allkeys-lru).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'catalog': {
+        'BACKEND': 'store.caching.LRUMemoryCache',
+        'LOCATION': 'catalog',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
+CATALOG_CACHE_ALIAS = 'catalog'
+
+# Users of JWT authenticated requests are cached per process (see authsys/authentication.py) for at most TIMEOUT seconds;
+# saving a user or its customer profile invalidates its entry. The customer profile is cached with the user.
+AUTH_USER_CACHE_ALIAS = 'auth'
+AUTH_USER_CACHE_CUSTOMER = True
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -145,6 +210,28 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Resized variants generated for every uploaded product image by a background job (see store/images.py)
+PRODUCT_IMAGE_VARIANT_WIDTHS = [160, 320, 640, 1280]
+PRODUCT_IMAGE_VARIANT_FORMATS = ['webp', 'jpeg']
+
+# Background jobs (see store/jobs.py), run by `python manage.py run_workers` on JOBS_WORKERS threads. A failed job is
+# retried up to JOBS_MAX_ATTEMPTS times after JOBS_RETRY_BACKOFF seconds, doubling up to JOBS_RETRY_BACKOFF_MAX; a job
+# still running after JOBS_LOCK_TIMEOUT is taken over by another worker. Successful jobs are deleted after JOBS_KEEP_DONE.
+JOBS_WORKERS = 4
+JOBS_POLL_INTERVAL = 1.0
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_BACKOFF = 10
+JOBS_RETRY_BACKOFF_MAX = 3600
+JOBS_LOCK_TIMEOUT = timedelta(minutes=10)
+JOBS_KEEP_DONE = timedelta(days=7)
+
+# Discount of every Customer.membership tier, in percent, applied on top of the product discount (see store/pricing.py)
+MEMBERSHIP_DISCOUNTS = {'B': 0, 'S': 5, 'G': 10}
+
+# Largest feed accepted by PATCH /store/products/bulk/, and the number of products written per UPDATE statement
+PRODUCT_BULK_UPDATE_MAX_ROWS = 50000
+PRODUCT_BULK_UPDATE_BATCH_SIZE = 1000
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -153,7 +240,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authsys.authentication.CachedJWTAuthentication',
     ],
 }
 
@@ -162,6 +249,15 @@ SIMPLE_JWT = {
    "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
 }
 
+# Anonymous carts expire after CART_IDLE_TTL without activity, or CART_MAX_AGE after creation (None to disable).
+# Expired carts are deleted by `python manage.py purge_carts`.
+CART_IDLE_TTL = timedelta(days=7)
+CART_MAX_AGE = timedelta(days=30)
+
+# Adding an item to a cart reserves its stock for STOCK_RESERVATION_TTL (see store/reservations.py). Expired reservations
+# are released by `python manage.py release_reservations`, which should run every minute or so.
+STOCK_RESERVATION_TTL = timedelta(minutes=15)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -21,12 +21,14 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
 import debug_toolbar
+from store import views as store_views
 
 urlpatterns = [
     path('', TemplateView.as_view(template_name='store/index.html')),
     path('admin/', admin.site.urls),
     path('store/', include('store.urls')),
     path('auth/', include('authsys.urls')),
+    path('metrics', store_views.metrics, name='metrics'),
     path('__debug__', include(debug_toolbar.urls)),
 ]
 
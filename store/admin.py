@@ -1,12 +1,12 @@
 from typing import Any
 from django.contrib import admin
-from django.db.models import F
-from django.db.models.aggregates import Count, Sum
+from django.db.models.aggregates import Count
 from django.db.models.query import QuerySet
 from django.http import HttpRequest
 from django.utils.html import format_html
 from django.urls import reverse
 from . import models
+from .jobs import retry_failed_jobs
 
 admin.site.site_header = 'Store Admin'
 admin.site.index_title = 'Admin'
@@ -35,17 +35,13 @@ class ProductAdmin(admin.ModelAdmin):
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ['title', 'products_count']
     list_per_page = 15
+    readonly_fields = ['products_count']
     search_fields = ['title']
 
     def products_count(self, category):
         url = reverse('admin:store_product_changelist') + f'?category__id__exact={category.id}'
         return format_html('<a href="{}">{}</a>', url, category.products_count)
 
-    def get_queryset(self, request: HttpRequest) -> QuerySet:
-        return super().get_queryset(request).annotate(
-            products_count=Count('products')
-        ).prefetch_related('products')
-
 
 @admin.register(models.Customer)
 class CustomerAdmin(admin.ModelAdmin):
@@ -81,14 +77,25 @@ class OrderAdmin(admin.ModelAdmin):
     list_per_page = 10
 
     def total_amount(self, order):
-        return order.total_amount
+        return order.total_price
     
     def get_queryset(self, request: HttpRequest) -> QuerySet:
-        return super().get_queryset(request)\
-            .annotate(
-                total_amount=Sum(
-                   F('items__quantity') * F('items__unit_price') 
-                )
-            )
+        return super().get_queryset(request).with_totals()
+
+
+
 
+@admin.register(models.Job)
+class JobAdmin(admin.ModelAdmin):
+    actions = ['retry']
+    list_display = ['id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'finished_at']
+    list_filter = ['status', 'name']
+    list_per_page = 50
+    ordering = ['-id']
+    readonly_fields = ['attempts', 'locked_by', 'locked_until', 'last_error', 'created_at', 'started_at', 'finished_at']
+    search_fields = ['name', 'key']
 
+    @admin.action(description='Retry the selected failed jobs')
+    def retry(self, request, queryset):
+        count = retry_failed_jobs(list(queryset.values_list('id', flat=True)))
+        self.message_user(request, f'{count} failed jobs queued again.')
@@ -0,0 +1,48 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .caching import invalidate_catalog
+from .models import Category, Product
+
+
+RATING_STARS = range(1, 6)
+RATING_FIELDS = ['rating_avg', 'rating_count'] + [f'rating_{star}' for star in RATING_STARS]
+
+
+# compute the rating columns of a product from a per-star histogram, e.g. {1: 0, 2: 1, 3: 0, 4: 4, 5: 10}
+def get_rating_values(histogram):
+    count = sum(histogram.values())
+    total = sum(star * histogram[star] for star in RATING_STARS)
+    average = (Decimal(total) / count).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) if count else Decimal('0')
+
+    values = {'rating_avg': average, 'rating_count': count}
+    for star in RATING_STARS:
+        values[f'rating_{star}'] = histogram[star]
+    return values
+
+
+# apply a single review change to the rating columns of a product: pass old_rating when a review is deleted,
+# new_rating when one is created, and both when a review's rating is edited.
+# The product row is locked for the read-modify-write, so concurrent reviews never lose an update.
+def update_product_rating(product_id, old_rating=None, new_rating=None):
+    if old_rating == new_rating:
+        return
+
+    with transaction.atomic():
+        product = Product.objects.select_for_update()\
+            .only(*RATING_FIELDS)\
+            .get(pk=product_id)
+        histogram = {star: getattr(product, f'rating_{star}') for star in RATING_STARS}
+        if old_rating is not None:
+            histogram[old_rating] = max(histogram[old_rating] - 1, 0)
+        if new_rating is not None:
+            histogram[new_rating] += 1
+        Product.objects.filter(pk=product_id).update(updated_at=timezone.now(), **get_rating_values(histogram))
+        transaction.on_commit(invalidate_catalog)
+
+
+# add delta (+1/-1) to the maintained products_count of a category
+def adjust_products_count(category_id, delta):
+    if category_id is not None and delta:
+        Category.objects.filter(pk=category_id).update(products_count=F('products_count') + delta, updated_at=timezone.now())
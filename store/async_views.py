@@ -0,0 +1,88 @@
+from functools import wraps
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from .models import Cart
+from .valueserializers import CartValuesSerializer
+from .views import CategoryViewSet, ProductViewSet
+
+
+# Native async read endpoints for the catalog and carts, served with the async ORM so that a slow client holds no worker
+# thread while it waits. They answer with the same JSON as their sync counterparts (the values serializers of
+# store/valueserializers.py render both), without the browsable API, the catalog cache and the ETag/Last-Modified
+# validators of the sync endpoints. Deploy them under an ASGI server (e_commerce/asgi.py) next to the sync stack.
+
+
+def render(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+# decorator of the async views: GET only, with DRF errors (validation, invalid cursor, not found) rendered like DRF does
+def async_api_view(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return render({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        try:
+            return await view(Request(request), *args, **kwargs)
+        except APIException as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return render(data, status=exc.status_code)
+    return wrapper
+
+
+# build the sync viewset for the request: its filters, fieldsets and pagination only build querysets, with no query,
+# so they are shared with the async views
+def get_view(viewset_class, request, action, **kwargs):
+    view = viewset_class(request=request, args=(), kwargs=kwargs, action=action, format_kwarg=None, basename=None)
+    if hasattr(view, 'get_fieldset_serializer'):
+        # reject unknown fields and expansions like the sync viewset does
+        view.get_fieldset_serializer()
+    return view
+
+
+def get_values_serializer(view):
+    serializer = view.get_values_serializer()
+    if serializer is None:
+        raise ValidationError('Nested fields and ?expand= are only available on the sync endpoints.')
+    return serializer
+
+
+async def list_values(viewset_class, request):
+    view = get_view(viewset_class, request, 'list')
+    serializer = get_values_serializer(view)
+    page = await view.paginator.apaginate_queryset(view.get_values_queryset(serializer), request, view=view)
+    data = await serializer.ato_representation(page)
+    return render(view.paginator.get_paginated_response(data).data)
+
+
+@async_api_view
+async def product_list(request):
+    return await list_values(ProductViewSet, request)
+
+
+@async_api_view
+async def product_detail(request, pk):
+    view = get_view(ProductViewSet, request, 'retrieve', pk=pk)
+    serializer = get_values_serializer(view)
+    row = await view.get_values_queryset(serializer).filter(pk=pk).afirst()
+    if row is None:
+        raise NotFound('No Product matches the given query.')
+    data = await serializer.ato_representation([row])
+    return render(data[0])
+
+
+@async_api_view
+async def category_list(request):
+    return await list_values(CategoryViewSet, request)
+
+
+@async_api_view
+async def cart_detail(request, pk):
+    serializer = CartValuesSerializer(context={'request': request})
+    row = await Cart.objects.filter(pk=pk).values(*serializer.get_columns()).afirst()
+    if row is None:
+        raise NotFound('No Cart matches the given query.')
+    data = await serializer.ato_representation([row])
+    return render(data[0])
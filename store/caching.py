@@ -0,0 +1,163 @@
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import F
+from rest_framework.response import Response
+from .models import CatalogVersion
+
+
+# alias in settings.CACHES of the cache holding catalog responses
+CATALOG_CACHE_ALIAS = getattr(settings, 'CATALOG_CACHE_ALIAS', 'catalog')
+# primary key of the CatalogVersion row
+CATALOG_VERSION_ID = 1
+
+
+# CacheStats class, that counts hits, misses and evictions of the catalog cache in this process
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def record(self, hits=0, misses=0, evictions=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+stats = CacheStats()
+
+
+# LRUMemoryCache class, django's local-memory cache with its least-recently-used culling counted in `stats`.
+# When MAX_ENTRIES is reached, the least recently used 1/CULL_FREQUENCY of the entries are evicted.
+class LRUMemoryCache(LocMemCache):
+    def _cull(self):
+        entries = len(self._cache)
+        super()._cull()
+        stats.record(evictions=entries - len(self._cache))
+
+    def entry_count(self):
+        return len(self._cache)
+
+
+def get_catalog_cache():
+    return caches[CATALOG_CACHE_ALIAS]
+
+
+# create the version row when it is missing (e.g. a flushed database), from the clock, so entries written under an
+# older version can never be read again
+def create_catalog_version():
+    CatalogVersion.objects.bulk_create([CatalogVersion(pk=CATALOG_VERSION_ID, version=time.time_ns())], ignore_conflicts=True)
+
+
+# return the current catalog version, read once per request when a request is given. The version is a database row:
+# the catalog cache is per process, but a write made by any process moves the version every process reads.
+def get_catalog_version(request=None):
+    version = getattr(request, '_catalog_version', None)
+    if version is None:
+        version = CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).values_list('version', flat=True).first()
+        if version is None:
+            create_catalog_version()
+            version = CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).values_list('version', flat=True).get()
+        if request is not None:
+            request._catalog_version = version
+    return version
+
+
+# invalidate every cached catalog response, in every process, by moving to a new version; stale entries age out
+# through TTL/LRU
+def invalidate_catalog():
+    if not CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).update(version=F('version') + 1):
+        create_catalog_version()
+
+
+# the objects of a list or detail response: the results of a page, the items of a list, or the object itself
+def get_response_items(data):
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return data['results']
+    return data if isinstance(data, list) else [data]
+
+
+# CachedResponseMixin class, that serves list() and retrieve() of a viewset from the catalog cache.
+# The key covers the catalog version, the route, the url kwargs, the host and every query param (page, cursor,
+# filters, search, ordering). Only successful responses are stored; the rendering still happens per request.
+# Fields that change without moving the catalog version (`live_fields`, e.g. the available stock) are refreshed on every
+# cache hit by refresh_live_fields(items), with one query for the whole page.
+class CachedResponseMixin:
+    cache_timeout = None
+    live_fields = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_key(self, request):
+        params = sorted((key, request.query_params.getlist(key)) for key in request.query_params)
+        parts = [
+            get_catalog_version(request), self.basename, self.action,
+            sorted(self.kwargs.items()), request.build_absolute_uri('/'), params,
+        ]
+        digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+        return f'catalog:{self.basename}:{self.action}:{digest}'
+
+    # the live fields rendered by the request
+    def get_live_fields(self):
+        return [name for name in self.live_fields if not hasattr(self, 'is_requested') or self.is_requested(name)]
+
+    # set the current value of the live fields on the items of a cached response
+    def refresh_live_fields(self, items):
+        raise NotImplementedError('a viewset with live_fields must implement refresh_live_fields(items)')
+
+    def get_cached_response(self, view_method, request, *args, **kwargs):
+        # live fields are matched with their rows by id: without it, the response is not cached
+        if self.get_live_fields() and hasattr(self, 'is_requested') and not self.is_requested('id'):
+            return view_method(request, *args, **kwargs)
+        cache = get_catalog_cache()
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            stats.record(hits=1)
+            if self.get_live_fields():
+                self.refresh_live_fields(get_response_items(data))
+            return Response(data)
+
+        stats.record(misses=1)
+        response = view_method(request, *args, **kwargs)
+        if response.status_code == 200:
+            if self.cache_timeout is None:
+                cache.set(key, response.data)
+            else:
+                cache.set(key, response.data, self.cache_timeout)
+        return response
+
+
+# return the stats of this process together with the size of the catalog cache, when the backend can tell
+def get_cache_stats():
+    cache = get_catalog_cache()
+    data = stats.snapshot()
+    data['backend'] = f'{type(cache).__module__}.{type(cache).__name__}'
+    data['entries'] = cache.entry_count() if hasattr(cache, 'entry_count') else None
+    data['max_entries'] = getattr(cache, '_max_entries', None)
+    data['default_timeout'] = cache.default_timeout
+    return data
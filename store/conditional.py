@@ -0,0 +1,64 @@
+import hashlib
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from .caching import get_catalog_version, get_response_items
+
+
+# ConditionalGetMixin class, that answers list() and retrieve() of a viewset with an ETag, and returns 304 Not Modified for
+# a matching If-None-Match (or If-Modified-Since on details) before the response is built.
+# The list validator is the catalog version (see store/caching.py), which every change of the catalog moves, in any process:
+# it is read from its database row by primary key, so a 304 is answered with that one query, before the catalog cache is
+# looked up. Details use one cheap query on the object's own `updated_at` column, which also gives their Last-Modified header.
+# When the response renders live fields (see CachedResponseMixin), which change without moving the catalog version, the
+# ETag also covers their values: it is computed once the data is built, and no Last-Modified is sent.
+class ConditionalGetMixin:
+    last_modified_field = 'updated_at'
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, [get_catalog_version(request)], None, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.get_rendered_live_fields():
+            return self.get_conditional_response(super().retrieve, [get_catalog_version(request)], None, request, *args, **kwargs)
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        last_modified = self.get_queryset()\
+            .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})\
+            .values_list(self.last_modified_field, flat=True)\
+            .first()
+        if last_modified is None:
+            return super().retrieve(request, *args, **kwargs)
+        return self.get_conditional_response(super().retrieve, [last_modified.isoformat()], last_modified, request, *args, **kwargs)
+
+    def get_rendered_live_fields(self):
+        return self.get_live_fields() if hasattr(self, 'get_live_fields') else []
+
+    # the ETag of the request's representation, from the validators of its data (the catalog version, or updated_at)
+    def get_etag(self, request, *validators):
+        validator = '|'.join([request.get_full_path(), str(request.accepted_media_type), *map(str, validators)])
+        return quote_etag(hashlib.md5(validator.encode('utf-8')).hexdigest())
+
+    def get_conditional_response(self, view_method, validators, last_modified, request, *args, **kwargs):
+        live_fields = self.get_rendered_live_fields()
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        if not live_fields:
+            etag = self.get_etag(request, *validators)
+            not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if not_modified is not None:
+                not_modified['ETag'] = etag
+                return not_modified
+
+        response = view_method(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        if live_fields:
+            values = [[item.get(name) for name in ['id', *live_fields]] for item in get_response_items(response.data)]
+            etag = self.get_etag(request, *validators, values)
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                not_modified['ETag'] = etag
+                return not_modified
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
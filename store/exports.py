@@ -0,0 +1,111 @@
+import csv
+import json
+import re
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+# rows fetched from the database per round trip, and bytes of output collected before a piece is sent (and compressed)
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_PIECE_SIZE = 64 * 1024
+
+accepts_gzip = re.compile(r'\bgzip\b')
+
+
+# file-like object whose write() returns the line instead of storing it, so csv.writer can format one row at a time
+class Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(records, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for record in records:
+        yield writer.writerow([record.get(column) for column in columns])
+
+
+def jsonl_lines(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+# yield the rows of a values() queryset ordered by its unique `key` column in lists of up to `chunk_size` rows, each one
+# read with its own "WHERE key > last key LIMIT chunk_size" query. Unlike iterator(), this streams on every backend: the
+# default cursor of mysqlclient buffers the whole result set on the client.
+def get_batches(queryset, key='id', chunk_size=None):
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    last = None
+    while True:
+        batch = list((queryset if last is None else queryset.filter(**{f'{key}__gt': last}))[:chunk_size])
+        if batch:
+            yield batch
+        if len(batch) < chunk_size:
+            return
+        last = batch[-1][key]
+
+
+def iterate_in_batches(queryset, key='id', chunk_size=None):
+    for batch in get_batches(queryset, key, chunk_size):
+        yield from batch
+
+
+# group the encoded lines into pieces of about EXPORT_PIECE_SIZE bytes, so the response is not written one row at a time
+def join_pieces(lines):
+    piece = []
+    size = 0
+    for line in lines:
+        line = line.encode('utf-8')
+        piece.append(line)
+        size += len(line)
+        if size >= EXPORT_PIECE_SIZE:
+            yield b''.join(piece)
+            piece = []
+            size = 0
+    if piece:
+        yield b''.join(piece)
+
+
+# ExportView class, the base of the admin export endpoints. The queryset (values() ordered by id) is read in keyset batches
+# of EXPORT_CHUNK_SIZE rows and every record is encoded as it is read, so neither the rows nor the output are ever held in
+# memory as a whole. The output is gzip-compressed on the fly when the client accepts it.
+# Subclasses set `filename` and `columns` (the CSV header) and implement get_queryset() and get_records().
+class ExportView(APIView):
+    permission_classes = [IsAdminUser]
+    filename = None
+    columns = []
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    # yield one dict per exported record from the queryset
+    def get_records(self, queryset):
+        return iterate_in_batches(queryset)
+
+    # yield the records of CSV exports; by default the same as get_records()
+    def get_csv_records(self, queryset):
+        return self.get_records(queryset)
+
+    def get(self, request, file_format):
+        queryset = self.get_queryset()
+        if file_format == 'csv':
+            lines = csv_lines(self.get_csv_records(queryset), self.columns)
+        else:
+            lines = jsonl_lines(self.get_records(queryset))
+        content = join_pieces(lines)
+
+        compress = accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        response = StreamingHttpResponse(
+            compress_sequence(content) if compress else content,
+            content_type=f'{EXPORT_FORMATS[file_format]}; charset=utf-8'
+        )
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        response.headers['Content-Disposition'] = f'attachment; filename="{self.filename}.{file_format}"'
+        return response
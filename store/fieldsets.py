@@ -0,0 +1,128 @@
+from rest_framework import serializers
+
+
+# parse a ?fields= or ?expand= value into a tree: 'id,items.quantity,items.product.name' -> {'id': {}, 'items': {'quantity': {}, 'product': {'name': {}}}}
+# An empty subtree stands for the whole field.
+def parse_fieldset(value):
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+# keep only the fields of `tree` in a (nested) serializer instance, recursing into nested serializers for dotted paths
+def restrict_fields(serializer, tree, path=''):
+    serializer = getattr(serializer, 'child', serializer)
+    unknown = sorted(set(tree) - set(serializer.fields))
+    if unknown:
+        raise serializers.ValidationError({'fields': [f'Unknown fields: {", ".join(path + name for name in unknown)}. Choose from: {", ".join(path + name for name in serializer.fields)}.']})
+    for name in list(serializer.fields):
+        if name not in tree:
+            serializer.fields.pop(name)
+        elif tree[name]:
+            field = serializer.fields[name]
+            if not isinstance(getattr(field, 'child', field), serializers.BaseSerializer):
+                raise serializers.ValidationError({'fields': [f'{path + name} has no fields to choose from.']})
+            restrict_fields(field, tree[name], f'{path}{name}.')
+
+
+# FieldsetSerializerMixin class, that gives a serializer `fields` and `expand` arguments (trees of parse_fieldset()):
+# `fields` keeps only the named fields, `expand` renders the fields of Meta.expandable_fields = {'field': SerializerClass}
+# with their serializer, as nested objects, instead of their default (primary key) representation. Expanded fields are
+# always included, and Meta.field_sources = {'field': ['column', ...]} names the model columns read by fields that are
+# not model columns themselves (properties and method fields), so unrequested columns can be deferred.
+class FieldsetSerializerMixin:
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = expand or {}
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        unknown = sorted(set(expand) - set(expandable))
+        if unknown:
+            raise serializers.ValidationError({'expand': [f'Unknown expansions: {", ".join(unknown)}. Choose from: {", ".join(expandable) or "none"}.']})
+        for name in expand:
+            self.fields[name] = expandable[name](read_only=True)
+
+        if fields is not None:
+            restrict_fields(self, {**fields, **{name: fields.get(name, {}) for name in expand}})
+
+    # the model columns read by the remaining fields
+    def get_read_columns(self):
+        model = self.Meta.model
+        columns = {field.name for field in model._meta.concrete_fields}
+        sources = getattr(self.Meta, 'field_sources', {})
+        read = set()
+        for name, field in self.fields.items():
+            if name in sources:
+                read.update(sources[name])
+            elif field.source in columns:
+                read.add(field.source)
+        return read
+
+
+# FieldsetMixin class, that adds ?fields= and ?expand= to the GET requests of a viewset, e.g. ?fields=id,name,price&expand=category.
+# The trees are passed to the serializer (a FieldsetSerializerMixin), get_queryset() asks is_requested() before prefetching
+# or joining a relation, and the columns of Meta.fields that no requested field reads are deferred, except ordering columns.
+class FieldsetMixin:
+    fieldset_methods = ['GET', 'HEAD']
+
+    def get_fieldset(self):
+        if not hasattr(self, '_fieldset'):
+            fields = expand = None
+            if self.request is not None and self.request.method in self.fieldset_methods:
+                params = self.request.query_params
+                fields = parse_fieldset(params['fields']) if params.get('fields') else None
+                expand = parse_fieldset(params['expand']) if params.get('expand') else None
+            self._fieldset = (fields, expand or {})
+        return self._fieldset
+
+    # whether the response renders the field `name`: a default field when ?fields= is absent, or a requested or expanded one
+    def is_requested(self, name):
+        fields, expand = self.get_fieldset()
+        return fields is None or name in fields or name in expand
+
+    def is_expanded(self, name):
+        return name in self.get_fieldset()[1]
+
+    # an unbound serializer with the requested fields, or None when the request has no fieldset
+    def get_fieldset_serializer(self):
+        if not hasattr(self, '_fieldset_serializer'):
+            fields, expand = self.get_fieldset()
+            self._fieldset_serializer = None
+            if fields is not None or expand:
+                self._fieldset_serializer = self.get_serializer_class()(fields=fields, expand=expand)
+        return self._fieldset_serializer
+
+    # override the initial() method to reject unknown fields and expansions before any query runs
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.get_fieldset_serializer()
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = self.get_fieldset()
+        if fields is not None or expand:
+            kwargs.setdefault('fields', fields)
+            kwargs.setdefault('expand', expand)
+        return super().get_serializer(*args, **kwargs)
+
+    # override the filter_queryset() method to defer the columns no requested field reads, once the ordering is known
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields, expand = self.get_fieldset()
+        if fields is None:
+            return queryset
+
+        serializer_class = self.get_serializer_class()
+        read = self.get_fieldset_serializer().get_read_columns()
+        ordering = {name.lstrip('-') for name in [*queryset.query.order_by, *queryset.model._meta.ordering] if isinstance(name, str)}
+        model_fields = {field.name: field for field in queryset.model._meta.concrete_fields}
+        deferred = [
+            name for name in serializer_class.Meta.fields
+            if name in model_fields and name not in read and name not in ordering
+            and not model_fields[name].primary_key and not model_fields[name].is_relation
+        ]
+        for columns in getattr(serializer_class.Meta, 'field_sources', {}).values():
+            deferred += [column for column in columns if column not in read and column not in ordering]
+        return queryset.defer(*deferred) if deferred else queryset
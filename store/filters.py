@@ -1,12 +1,21 @@
-from django_filters import FilterSet
+from django_filters import FilterSet, NumberFilter
 from .models import Product
 
 class ProductFilter(FilterSet):
+    # a plain number filter: a model choice filter would look the category up before filtering, which costs a query
+    # (one per evaluation of the filterset) and can not run inside the async views
+    category_id = NumberFilter(field_name='category_id')
+    # the effective_price annotation of ProductViewSet: the price for the caller's membership tier
+    effective_price__gte = NumberFilter(field_name='effective_price', lookup_expr='gte')
+    effective_price__lte = NumberFilter(field_name='effective_price', lookup_expr='lte')
+
     class Meta:
         model = Product
         fields = {
             'category_id': ['exact'],
             'price': ['gte', 'lte'],
-            'stock_quantity': ['gt', 'lt']
+            'stock_quantity': ['gt', 'lt'],
+            'rating_avg': ['gte', 'lte'],
+            'rating_count': ['gte']
         }
         
\ No newline at end of file
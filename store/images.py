@@ -0,0 +1,139 @@
+import hashlib
+import io
+import os
+import re
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .caching import invalidate_catalog
+from .jobs import job
+from .models import Product, ProductImage
+
+
+VARIANTS_DIRECTORY = 'store/images/variants'
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+# storage names made of these characters only are their own URL path, with nothing to quote or resolve
+plain_name = re.compile(r'[A-Za-z0-9_-][A-Za-z0-9_./-]*')
+
+
+# resize the stored image `name` of the product image `image_id` to every configured width (never upscaling) and format,
+# save the variants and return (width, height, variants). The variant names start with the image id, so images sharing a
+# file name (a.png and a.jpg, or the same upload on two products) never overwrite each other's variants.
+# Only touches the storage, never the database, so it is safe to run in another process.
+def render_variants(name, image_id):
+    with default_storage.open(name) as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original.load()
+    width, height = original.size
+    stem = os.path.splitext(os.path.basename(name))[0]
+
+    variants = {}
+    for image_format in settings.PRODUCT_IMAGE_VARIANT_FORMATS:
+        variants[image_format] = {}
+        for variant_width in sorted(set(min(w, width) for w in settings.PRODUCT_IMAGE_VARIANT_WIDTHS)):
+            variant = original.copy()
+            variant.thumbnail((variant_width, height), Image.Resampling.LANCZOS)
+            if image_format == 'jpeg' and variant.mode not in ('RGB', 'L'):
+                variant = variant.convert('RGB')
+
+            buffer = io.BytesIO()
+            variant.save(buffer, **SAVE_OPTIONS[image_format])
+            variant_name = f'{VARIANTS_DIRECTORY}/{image_id}_{stem}_{variant_width}w.{image_format}'
+            if default_storage.exists(variant_name):
+                default_storage.delete(variant_name)
+            variants[image_format][str(variant_width)] = default_storage.save(variant_name, ContentFile(buffer.getvalue()))
+    return width, height, variants
+
+
+# store the result of render_variants() on the image row, as long as it still holds the file `name` the variants were
+# made from, and delete the variant files it no longer references; queryset updates skip the save signals, so the
+# product's updated_at and the catalog cache are refreshed here
+def save_variants(image_id, name, width, height, variants):
+    image = ProductImage.objects.filter(pk=image_id, image=name).values('product_id', 'variants').first()
+    if image is None:
+        # the image was deleted or replaced while its variants were made: they are not used
+        delete_files(get_variant_names(variants))
+        return
+    now = timezone.now()
+    ProductImage.objects.filter(pk=image_id, image=name).update(width=width, height=height, variants=variants, updated_at=now)
+    Product.objects.filter(pk=image['product_id']).update(updated_at=now)
+    delete_files(set(get_variant_names(image['variants'])) - set(get_variant_names(variants)))
+    invalidate_catalog()
+
+
+# generate the variants of the file `name` of a product image; a job, so a failure (e.g. storage hiccup) is retried by the
+# workers. A job queued for a file the image no longer holds does nothing.
+@job(max_attempts=3)
+def process_product_image(image_id, name=None):
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is None or (name is not None and image.image.name != name):
+        return
+    name = image.image.name
+    save_variants(image_id, name, *render_variants(name, image_id))
+
+
+# queue the generation of the variants of a new or replaced product image file for the job workers; the job is keyed by
+# the image and its file, so it is queued once per upload however often this is called
+def enqueue_product_image(image_id, name):
+    version = hashlib.md5(name.encode('utf-8')).hexdigest()[:12]
+    process_product_image.enqueue([image_id, name], key=f'product-image:{image_id}:{version}')
+
+
+# the storage names of the variants of an image (its `variants` column)
+def get_variant_names(variants):
+    return [name for names in (variants or {}).values() for name in names.values()]
+
+
+# delete stored files, e.g. the original and the variants of a deleted or replaced product image
+@job(max_attempts=3)
+def delete_files(names):
+    for name in names:
+        default_storage.delete(name)
+
+
+# queue the deletion of the files of a product image for the job workers: the queued job commits or rolls back with the
+# change of the image row
+def enqueue_image_files_deletion(name, variants):
+    names = [name, *get_variant_names(variants)] if name else get_variant_names(variants)
+    if names:
+        delete_files.delay(names)
+
+
+# return a function turning the storage names of `storage` into (absolute, with a request) URLs. On the file system storage
+# the prefix is built once and plain names are appended to it, which gives the same URL as storage.url() and
+# request.build_absolute_uri() for a fraction of the cost; any other name or storage goes through them.
+def get_url_builder(storage, request=None):
+    def build_url(name):
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    if not isinstance(storage, FileSystemStorage):
+        return build_url
+    prefix = build_url('')
+
+    def build_plain_url(name):
+        if plain_name.fullmatch(name) and '//' not in name and '/./' not in name and '/../' not in name and not name.endswith(('/.', '/..')):
+            return prefix + name
+        return build_url(name)
+    return build_plain_url
+
+
+# build the srcset-style structure of an image: {'webp': [{'url': ..., 'width': 160}, ...], 'jpeg': [...]}
+def get_srcset(image, request=None):
+    return get_variants_srcset(image.variants, get_url_builder(default_storage, request))
+
+
+# same as get_srcset(), from the `variants` column alone (e.g. a row of ProductImage.objects.values()) and a get_url_builder() function
+def get_variants_srcset(variants, build_url):
+    srcset = {}
+    for image_format, names in (variants or {}).items():
+        srcset[image_format] = []
+        for variant_width, name in sorted(names.items(), key=lambda item: int(item[0])):
+            srcset[image_format].append({'url': build_url(name), 'width': int(variant_width)})
+    return srcset
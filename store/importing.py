@@ -0,0 +1,365 @@
+import csv
+import gzip
+import json
+import os
+import re
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.exceptions import ValidationError
+from django.db import models
+from authsys.models import User
+from .models import Category, Customer, Product
+
+
+# ImportSpec class, that describes how source rows of one model are validated and written by the import_catalog command.
+# `fields` are the columns that can be written, `natural_key` (a field, or a tuple of fields) identifies existing rows that
+# come without an id, and `aliases` maps source column names onto model attribute names. A re-import only overwrites the
+# columns present in its source rows.
+class ImportSpec:
+    def __init__(self, model, tables, fields, natural_key=None, aliases=None):
+        self.model = model
+        self.tables = tables
+        self.fields = fields
+        self.natural_key = (natural_key,) if isinstance(natural_key, str) else natural_key
+        self.aliases = aliases or {}
+
+    # the natural key of an instance, or None when the instance lacks one of its fields
+    def get_natural_key(self, instance):
+        if self.natural_key is None or not set(self.natural_key) <= instance._import_fields:
+            return None
+        return tuple(getattr(instance, self.model._meta.get_field(name).attname) for name in self.natural_key)
+
+    # the columns an upsert overwrites on existing rows: the given fields (those of the source rows), in spec order
+    def get_update_fields(self, names):
+        fields = [self.model._meta.get_field(name).attname for name in self.fields if name in names]
+        if fields and any(field.name == 'updated_at' for field in self.model._meta.fields):
+            fields.append('updated_at')
+        return fields
+
+    @property
+    def foreign_keys(self):
+        return [name for name in self.fields if self.model._meta.get_field(name).is_relation]
+
+
+IMPORT_SPECS = {
+    'category': ImportSpec(Category, ['store_category'], ['title'], natural_key='title'),
+    'product': ImportSpec(
+        Product, ['store_product'], ['name', 'description', 'price', 'category', 'stock_quantity', 'discount'],
+        natural_key=('name', 'category'), aliases={'category_id': 'category', 'category_title': 'category'}
+    ),
+    'user': ImportSpec(
+        User, ['store_user', 'authsys_user'],
+        ['username', 'email', 'first_name', 'last_name', 'password', 'is_staff', 'is_superuser', 'is_active', 'date_joined'],
+        natural_key='username'
+    ),
+    'customer': ImportSpec(
+        Customer, ['store_customer'], ['user', 'phone', 'birth_date', 'membership'],
+        natural_key='user', aliases={'user_id': 'user'}
+    ),
+}
+
+
+# return the spec of a file named after its model or table, e.g. products.csv, store_product.sql or product.jsonl.gz
+def get_spec_for_path(path):
+    name = os.path.basename(path).split('.')[0].lower()
+    for key, spec in IMPORT_SPECS.items():
+        if name in spec.tables or name.rstrip('s') == key:
+            return key
+    return None
+
+
+def get_format_for_path(path):
+    extensions = os.path.basename(path).lower().split('.')[1:]
+    extensions = [extension for extension in extensions if extension != 'gz']
+    return extensions[-1] if extensions else None
+
+
+def open_source(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+# yield the rows of a CSV file with a header line as dicts
+def read_csv(file):
+    yield from csv.DictReader(file)
+
+
+# yield the rows of a JSON lines file, one object per line
+def read_jsonl(file):
+    for line_number, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            raise ValueError(f'line {line_number}: {error}')
+        if not isinstance(row, dict):
+            raise ValueError(f'line {line_number}: expected a JSON object')
+        yield row
+
+
+SQL_TOKEN = re.compile(r"""
+      (?P<space>\s+|--[^\n]*)
+    | (?P<string>'(?:[^'\\]|\\.|'')*')
+    | (?P<quoted>`[^`]*`|"[^"]*")
+    | (?P<punctuation>[(),;])
+    | (?P<word>[^\s(),;'`"]+)
+""", re.VERBOSE | re.DOTALL)
+SQL_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0', 'Z': '\x1a'}
+
+
+# split a SQL script into (kind, value) tokens, reading it in chunks so scripts of any size stream in constant memory
+def tokenize_sql(file, chunk_size=1 << 16):
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        match = SQL_TOKEN.match(buffer, position)
+        # a token touching the end of the buffer may continue in the next chunk
+        if not eof and (match is None or match.end() == len(buffer)):
+            chunk = file.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+            eof = not chunk
+            continue
+        if match is None:
+            if position < len(buffer):
+                raise ValueError(f'unexpected SQL near {buffer[position:position + 30]!r}')
+            return
+        position = match.end()
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        value = match.group()
+        if kind == 'string':
+            value = re.sub(r"\\(.)", lambda escape: SQL_ESCAPES.get(escape.group(1), escape.group(1)), value[1:-1].replace("''", "'"))
+        elif kind == 'quoted':
+            kind, value = 'word', value[1:-1]
+        yield kind, value
+
+
+# yield (table, row) for every tuple of the INSERT INTO ... VALUES statements of a SQL script, e.g. the seed files in data/
+def read_sql(file):
+    tokens = tokenize_sql(file)
+
+    def expect(*expected):
+        kind, value = next(tokens, (None, None))
+        if kind is None or (expected and value.lower() not in expected):
+            raise ValueError(f'expected {" or ".join(expected) or "a value"}, found {value!r}')
+        return kind, value
+
+    def read_list(read_item):
+        items = []
+        while True:
+            items.append(read_item())
+            if expect(',', ')')[1] == ')':
+                return items
+
+    def read_value():
+        kind, value = expect()
+        if kind == 'string':
+            return value
+        if kind != 'word':
+            raise ValueError(f'unexpected {value!r} in VALUES')
+        return {'null': None, 'true': True, 'false': False}.get(value.lower(), value)
+
+    for kind, value in tokens:
+        if value.lower() != 'insert':
+            raise ValueError(f'only INSERT statements are supported, found {value!r}')
+        expect('into')
+        _, table = expect()
+        table = table.split('.')[-1]
+        kind, value = expect('(', 'values')
+        columns = None
+        if value == '(':
+            columns = read_list(lambda: expect()[1])
+            expect('values')
+        while True:
+            expect('(')
+            values = read_list(read_value)
+            if columns is None:
+                raise ValueError(f'INSERT INTO {table} must list its columns')
+            if len(values) != len(columns):
+                raise ValueError(f'INSERT INTO {table}: {len(columns)} columns but {len(values)} values')
+            yield table, dict(zip(columns, values))
+            if expect(',', ';')[1] == ';':
+                break
+
+
+# yield the rows of a CSV, JSON lines or SQL source as dicts; rows of SQL scripts are checked against the spec's tables
+def read_rows(file, source_format, spec):
+    if source_format == 'csv':
+        yield from read_csv(file)
+    elif source_format in ('jsonl', 'ndjson'):
+        yield from read_jsonl(file)
+    elif source_format == 'sql':
+        for table, row in read_sql(file):
+            if table not in spec.tables:
+                raise ValueError(f'table {table} does not belong to {spec.model._meta.label}')
+            yield row
+    else:
+        raise ValueError(f'unsupported format {source_format!r}')
+
+
+# RowValidator class, that turns raw source rows into unsaved model instances with the model's own field validators.
+# Foreign keys are checked against in-memory maps instead of one query per row: categories may be given by id or by
+# title (missing titles are created once), and users are looked up once per batch.
+class RowValidator:
+    def __init__(self, spec):
+        self.spec = spec
+        self.categories_by_title = {}
+        self.category_ids = set()
+        if 'category' in spec.fields:
+            for category_id, title in Category.objects.values_list('id', 'title'):
+                self.categories_by_title.setdefault(title, category_id)
+                self.category_ids.add(category_id)
+
+    # build and validate the instance of one source row; raise ValidationError for a row that must be skipped. Only the
+    # fields present in the row are set and validated, and they are kept in `_import_fields`: the fields missing from a
+    # row keep their current value on existing rows, and are checked by check_new() on new ones.
+    def build(self, row):
+        spec = self.spec
+        values = {}
+        for column, value in row.items():
+            if column is None:
+                raise ValidationError('row has more values than the header')
+            name = spec.aliases.get(column, column)
+            if name in spec.fields or name == 'id':
+                values[name] = value
+
+        instance = spec.model()
+        if values.get('id') not in (None, ''):
+            instance.pk = spec.model._meta.pk.to_python(values['id'])
+        present = [name for name in spec.fields if name in values]
+        for name in present:
+            field = spec.model._meta.get_field(name)
+            value = values[name]
+            if isinstance(value, str) and value == '' and field.null:
+                value = None
+            if isinstance(field, models.BooleanField) and isinstance(value, str):
+                value = value.strip().lower() in ('1', 't', 'true', 'y', 'yes')
+            if field.is_relation:
+                setattr(instance, field.attname, value)
+            elif value is not None or field.null:
+                setattr(instance, name, value)
+
+        if 'password' in present:
+            self.hash_password(instance)
+        instance.clean_fields(exclude=spec.foreign_keys + [name for name in spec.fields if name not in values])
+        instance.clean()
+        if 'category' in present:
+            instance.category_id = self.resolve_category(instance.category_id, values['category'])
+        instance._import_fields = frozenset(present)
+        return instance
+
+    # passwords already stored with a Django hasher are kept as they are, plain text ones are hashed
+    def hash_password(self, instance):
+        if not instance.password:
+            instance.set_unusable_password()
+            return
+        try:
+            identify_hasher(instance.password)
+        except ValueError:
+            instance.password = make_password(instance.password)
+
+    def resolve_category(self, category_id, raw_value):
+        if raw_value in (None, ''):
+            raise ValidationError({'category': 'This field cannot be blank.'})
+        value = str(raw_value).strip()
+        if value.isdigit():
+            if int(value) not in self.category_ids:
+                raise ValidationError({'category': f'Category {value} does not exist.'})
+            return int(value)
+        if value not in self.categories_by_title:
+            category = Category.objects.create(title=value)
+            self.categories_by_title[value] = category.id
+            self.category_ids.add(category.id)
+        return self.categories_by_title[value]
+
+    # validate the foreign keys of a batch with one query per related model; return the rejected instances with their errors
+    def check_batch(self, instances):
+        rejected = []
+        if 'user' in self.spec.fields:
+            user_ids = {instance.user_id for instance in instances}
+            existing = set(User.objects.filter(pk__in=[pk for pk in user_ids if str(pk).isdigit()]).values_list('pk', flat=True))
+            for instance in instances:
+                if not str(instance.user_id).isdigit() or int(instance.user_id) not in existing:
+                    rejected.append((instance, ValidationError({'user': f'User {instance.user_id} does not exist.'})))
+                else:
+                    instance.user_id = int(instance.user_id)
+        return rejected
+
+    # validate the fields missing from the new rows of a batch (rows that do not update an existing one) with their default
+    # values, in one query; return the rejected instances with their errors. New users without a password get an unusable one.
+    def check_new(self, instances):
+        spec = self.spec
+        partial = [instance for instance in instances if len(instance._import_fields) < len(spec.fields)]
+        if not partial:
+            return []
+        existing = set(spec.model.objects.filter(pk__in=[instance.pk for instance in partial if instance.pk is not None]).values_list('pk', flat=True))
+        rejected = []
+        for instance in partial:
+            if instance.pk in existing:
+                continue
+            missing = [name for name in spec.fields if name not in instance._import_fields]
+            try:
+                if 'password' in missing:
+                    instance.set_unusable_password()
+                instance.clean_fields(exclude=[name for name in spec.fields if name not in missing or name in spec.foreign_keys])
+                for name in missing:
+                    if name in spec.foreign_keys:
+                        raise ValidationError({name: 'This field cannot be blank.'})
+            except ValidationError as error:
+                rejected.append((instance, error))
+                continue
+            # a new row sets every column
+            instance._import_fields = frozenset(spec.fields)
+        return rejected
+
+    # give rows without an id the id of the existing row with the same natural key, so re-imports update instead of duplicating
+    def match_existing(self, instances):
+        spec = self.spec
+        missing = [instance for instance in instances if instance.pk is None and spec.get_natural_key(instance) is not None]
+        if not missing:
+            return
+        attnames = [spec.model._meta.get_field(name).attname for name in spec.natural_key]
+        rows = spec.model.objects.filter(**{f'{attnames[0]}__in': {spec.get_natural_key(instance)[0] for instance in missing}})\
+            .values_list(*attnames, 'pk')
+        existing = {tuple(row[:-1]): row[-1] for row in rows}
+        for instance in missing:
+            instance.pk = existing.get(spec.get_natural_key(instance))
+
+
+# format the messages of a ValidationError on one line
+def format_error(error):
+    if hasattr(error, 'message_dict'):
+        return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+# the checkpoint of an import: the number of source rows already committed, tied to the file it was taken from
+class Checkpoint:
+    def __init__(self, path, source):
+        self.path = path
+        stat = os.stat(source)
+        self.source = {'path': os.path.abspath(source), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return 0
+        return data.get('rows', 0) if data.get('source') == self.source else 0
+
+    # write to a temporary file and rename it, so a crash never leaves a half written checkpoint
+    def save(self, rows):
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({'source': self.source, 'rows': rows}, file)
+        os.replace(temporary, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
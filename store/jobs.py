@@ -0,0 +1,202 @@
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import update_wrapper
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# how often an idle worker deletes the old finished jobs
+PURGE_INTERVAL = timedelta(hours=1)
+
+
+# Task class, a function that can be deferred to the job workers: task.delay(*args, **kwargs) stores a Job row and returns
+# at once, and a worker of `python manage.py run_workers` calls the function later. The row is written in the current
+# transaction, so a job is only seen by the workers once the request that enqueued it has committed, and never if it
+# rolled back. Arguments must be JSON serializable, and the function should be safe to run more than once: a failed or
+# interrupted job is retried up to max_attempts times, with an exponential backoff.
+class Task:
+    def __init__(self, func, max_attempts=None, backoff=None):
+        update_wrapper(self, func)
+        self.func = func
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        return self.enqueue(args, kwargs)
+
+    # queue a call of the task. A job enqueued with the `key` of an existing job is not added again (idempotency key),
+    # and `run_at` postpones the job.
+    def enqueue(self, args=(), kwargs=None, key=None, run_at=None):
+        values = {
+            'name': self.name, 'args': list(args), 'kwargs': kwargs or {},
+            'max_attempts': self.max_attempts or settings.JOBS_MAX_ATTEMPTS, 'run_at': run_at or timezone.now(),
+        }
+        if key is None:
+            return Job.objects.create(**values)
+        job, _ = Job.objects.get_or_create(key=key, defaults=values)
+        return job
+
+    # the delay before the next attempt: the backoff doubles with every failed attempt, with jitter, up to JOBS_RETRY_BACKOFF_MAX
+    def get_retry_delay(self, attempts):
+        delay = min((self.backoff or settings.JOBS_RETRY_BACKOFF) * 2 ** (attempts - 1), settings.JOBS_RETRY_BACKOFF_MAX)
+        return timedelta(seconds=delay * random.uniform(0.75, 1))
+
+
+# decorator turning a function into a Task, e.g. @job or @job(max_attempts=3, backoff=60)
+def job(func=None, *, max_attempts=None, backoff=None):
+    def decorate(func):
+        return Task(func, max_attempts=max_attempts, backoff=backoff)
+    return decorate if func is None else decorate(func)
+
+
+# jobs a worker may run now: pending ones that are due, and running ones whose worker died (their lock expired)
+def get_ready_condition(now):
+    return Q(status=Job.STATUS_PENDING, run_at__lte=now) | Q(status=Job.STATUS_RUNNING, locked_until__lt=now)
+
+
+# claim up to `limit` ready jobs for `worker_id`, oldest first, and return their ids. The claim is a conditional UPDATE, so
+# a job selected by several workers at once is claimed by one of them only, on every database.
+def claim_jobs(worker_id, limit):
+    now = timezone.now()
+    ready = get_ready_condition(now)
+    claimed = []
+    for job_id in Job.objects.filter(ready).order_by('run_at', 'id').values_list('id', flat=True)[:limit]:
+        updated = Job.objects.filter(ready, pk=job_id).update(
+            status=Job.STATUS_RUNNING, attempts=F('attempts') + 1, locked_by=worker_id,
+            locked_until=now + settings.JOBS_LOCK_TIMEOUT, started_at=now,
+        )
+        if updated:
+            claimed.append(job_id)
+    return claimed
+
+
+# run a claimed job and record its outcome: done, pending again after the backoff delay, or failed after its last attempt.
+# The outcome is only written while the worker still holds the job, so a job taken over after a lock expiry is not overwritten.
+def run_job(job_id, worker_id):
+    job = Job.objects.get(pk=job_id)
+    held = Job.objects.filter(pk=job_id, status=Job.STATUS_RUNNING, locked_by=worker_id)
+    task = None
+    try:
+        task = import_string(job.name)
+        task(*job.args, **job.kwargs)
+    except Exception:
+        logger.exception('Job %s (%s) failed on attempt %s of %s', job_id, job.name, job.attempts, job.max_attempts)
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            delay = task.get_retry_delay(job.attempts) if isinstance(task, Task) else timedelta(seconds=settings.JOBS_RETRY_BACKOFF)
+            held.update(status=Job.STATUS_PENDING, run_at=now + delay, locked_until=None, last_error=error)
+        else:
+            held.update(status=Job.STATUS_FAILED, finished_at=now, locked_until=None, last_error=error)
+    else:
+        held.update(status=Job.STATUS_DONE, finished_at=timezone.now(), locked_until=None)
+
+
+# run every ready job once in this thread (failed attempts are not waited for), and return the number of jobs run.
+# Handy in tests and scripts.
+def run_pending_jobs(worker_id='inline'):
+    count = 0
+    while job_ids := claim_jobs(worker_id, 100):
+        for job_id in job_ids:
+            run_job(job_id, worker_id)
+        count += len(job_ids)
+    return count
+
+
+# delete the jobs that finished successfully more than JOBS_KEEP_DONE ago; failed jobs are kept for inspection
+def purge_done_jobs():
+    deleted, _ = Job.objects.filter(status=Job.STATUS_DONE, finished_at__lt=timezone.now() - settings.JOBS_KEEP_DONE).delete()
+    return deleted
+
+
+# put failed jobs (all of them, or the given ones) back in the queue with a fresh set of attempts
+def retry_failed_jobs(job_ids=None):
+    jobs = Job.objects.filter(status=Job.STATUS_FAILED)
+    if job_ids is not None:
+        jobs = jobs.filter(pk__in=job_ids)
+    return jobs.update(status=Job.STATUS_PENDING, attempts=0, run_at=timezone.now(), finished_at=None)
+
+
+# the number of jobs per status and task, the age of the oldest due job, and the latest failures
+def get_job_stats(failures=10):
+    now = timezone.now()
+    stats = {status: 0 for status, _ in Job.STATUS_CHOICES}
+    tasks = {}
+    oldest_due = None
+    rows = Job.objects.values('name', 'status').annotate(count=Count('id'), oldest=Min('run_at')).order_by()
+    for row in rows:
+        stats[row['status']] += row['count']
+        tasks.setdefault(row['name'], {status: 0 for status, _ in Job.STATUS_CHOICES})[row['status']] = row['count']
+        if row['status'] == Job.STATUS_PENDING and row['oldest'] <= now and (oldest_due is None or row['oldest'] < oldest_due):
+            oldest_due = row['oldest']
+    stats['oldest_due_seconds'] = round((now - oldest_due).total_seconds(), 1) if oldest_due else 0
+    stats['tasks'] = tasks
+    stats['recent_failures'] = list(
+        Job.objects.filter(status=Job.STATUS_FAILED).order_by('-finished_at')
+        .values('id', 'name', 'args', 'kwargs', 'attempts', 'finished_at', 'last_error')[:failures]
+    )
+    return stats
+
+
+# Worker class, that runs the queued jobs on a pool of `threads` threads until stop() is called, polling the table every
+# `poll_interval` seconds when it is idle. With burst=True it returns once no job is ready.
+class Worker:
+    def __init__(self, threads, poll_interval, burst=False):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.id = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+        self.processed = 0
+
+    def stop(self):
+        self.stopping.set()
+
+    # run a job on a pool thread, with the connection handling of a request around it
+    def run_job(self, job_id):
+        close_old_connections()
+        try:
+            run_job(job_id, self.id)
+        except Exception:
+            logger.exception('Could not run job %s', job_id)
+        finally:
+            close_old_connections()
+
+    def run(self):
+        running = set()
+        last_purge = None
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='jobs') as executor:
+            while not self.stopping.is_set():
+                job_ids = claim_jobs(self.id, self.threads - len(running)) if len(running) < self.threads else []
+                close_old_connections()
+                running.update(executor.submit(self.run_job, job_id) for job_id in job_ids)
+                self.processed += len(job_ids)
+
+                if not running and not job_ids:
+                    if self.burst:
+                        break
+                    if last_purge is None or timezone.now() - last_purge > PURGE_INTERVAL:
+                        purge_done_jobs()
+                        last_purge = timezone.now()
+                    self.stopping.wait(self.poll_interval)
+                elif running:
+                    # wait for a free thread, or for the next poll when there are free threads already
+                    timeout = None if len(running) >= self.threads else self.poll_interval
+                    running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED).not_done
+            # the claimed jobs are finished before leaving
+            wait(running)
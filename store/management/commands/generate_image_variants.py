@@ -0,0 +1,40 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from django.db import connections
+from store.images import render_variants, save_variants
+from store.models import ProductImage
+
+
+# generate_image_variants command, that backfills the resized variants of existing product images on a process pool
+class Command(BaseCommand):
+    help = 'Generate the resized WebP/JPEG variants of existing product images in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+        parser.add_argument('--force', action='store_true', help='Regenerate images that already have variants')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        images = ProductImage.objects.order_by('pk')
+        if not options['force']:
+            images = images.filter(width__isnull=True)
+        images = list(images.values_list('pk', 'image'))
+
+        # worker processes only read and write files; every database write happens here
+        connections.close_all()
+        processed = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(render_variants, name, image_id): (image_id, name) for image_id, name in images}
+            for future in as_completed(futures):
+                image_id, name = futures[future]
+                try:
+                    save_variants(image_id, name, *future.result())
+                    processed += 1
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'Image {image_id}: {error}')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} images ({failed} failed) in {elapsed:.2f}s'))
@@ -0,0 +1,159 @@
+import time
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from store.caching import invalidate_catalog
+from store.importing import (
+    IMPORT_SPECS, Checkpoint, RowValidator, format_error, get_format_for_path, get_spec_for_path, open_source, read_rows
+)
+
+
+# import_catalog command, that streams categories, products, users and customers from CSV, JSON lines or SQL INSERT scripts.
+# Rows are validated with the model field validators and upserted in batches: rows with an id (or a natural key such as a
+# category title, a product name in its category or a username) update the existing row, so an import can be re-run safely. Only the columns present in the
+# source are overwritten, e.g. a products file of ids and stock quantities updates the stock only. After every committed batch the
+# number of source rows done is written to a checkpoint file, and an interrupted import resumes from there.
+class Command(BaseCommand):
+    help = 'Bulk import catalog and customer data from CSV, JSON lines (optionally gzipped) or SQL INSERT scripts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files to import, in order (e.g. categories before products)')
+        parser.add_argument('--model', choices=sorted(IMPORT_SPECS), help='Model of the rows (default: guessed from the file name)')
+        parser.add_argument('--format', choices=['csv', 'jsonl', 'sql'], help='Format of the files (default: the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows written per transaction')
+        parser.add_argument('--restart', action='store_true', help='Ignore existing checkpoints and import from the first row')
+        parser.add_argument('--max-errors', type=int, default=50, help='Number of rejected rows reported individually')
+
+    def handle(self, *args, **options):
+        imported_models = set()
+        for path in options['paths']:
+            model = options['model'] or get_spec_for_path(path)
+            if model is None:
+                raise CommandError(f'Cannot tell which model {path} holds, use --model')
+            source_format = options['format'] or get_format_for_path(path)
+            self.import_file(path, model, source_format, options)
+            imported_models.add(model)
+
+        # bulk_create skips the product signals, so the denormalized counters, the search index and the cache are refreshed here
+        if imported_models & {'category', 'product'}:
+            call_command('reconcile_category_counts', stdout=self.stdout)
+            call_command('rebuild_search_index', stdout=self.stdout)
+            invalidate_catalog()
+
+    def import_file(self, path, model, source_format, options):
+        spec = IMPORT_SPECS[model]
+        batch_size = options['batch_size']
+        checkpoint = Checkpoint(f'{path}.checkpoint', path)
+        if options['restart']:
+            checkpoint.clear()
+        done = checkpoint.load()
+        if done:
+            self.stdout.write(f'{path}: resuming after row {done}')
+
+        validator = RowValidator(spec)
+        started = time.monotonic()
+        written = rejected = 0
+        with open_source(path) as file:
+            try:
+                rows = read_rows(file, source_format, spec)
+                # rows committed by an earlier run are parsed but not validated again
+                for _ in islice(rows, done):
+                    pass
+                while True:
+                    batch = list(islice(rows, batch_size))
+                    if not batch:
+                        break
+                    batch_written, errors = self.import_batch(spec, validator, batch)
+                    for row_number, error in errors:
+                        if rejected < options['max_errors']:
+                            self.stderr.write(f'{path}: row {done + row_number}: {error}')
+                        rejected += 1
+                    written += batch_written
+                    done += len(batch)
+                    checkpoint.save(done)
+            except ValueError as error:
+                raise CommandError(f'{path}: {error} (in the batch starting at row {done + 1})')
+
+        checkpoint.clear()
+        elapsed = time.monotonic() - started
+        rate = (written + rejected) / elapsed if elapsed else 0
+        if rejected > options['max_errors']:
+            self.stderr.write(f'{path}: {rejected - options["max_errors"]} more rows rejected')
+        self.stdout.write(self.style.SUCCESS(
+            f'{path}: imported {written} rows, rejected {rejected} '
+            f'in {elapsed:.2f}s ({rate:.0f} rows/sec)'
+        ))
+
+    # validate and upsert one batch; return the number of rows written and the (row number, message) of every rejected row
+    def import_batch(self, spec, validator, batch):
+        instances = []
+        errors = []
+        for row_number, row in enumerate(batch, start=1):
+            try:
+                instance = validator.build(row)
+            except (ValidationError, ValueError, TypeError) as error:
+                errors.append((row_number, format_error(error) if isinstance(error, ValidationError) else str(error)))
+                continue
+            instance._row_number = row_number
+            instances.append(instance)
+
+        for instance, error in validator.check_batch(instances):
+            errors.append((instance._row_number, format_error(error)))
+            instances.remove(instance)
+        validator.match_existing(instances)
+        for instance, error in validator.check_new(instances):
+            errors.append((instance._row_number, format_error(error)))
+            instances.remove(instance)
+
+        # the last row wins when a batch holds the same record twice, by id or (for new rows) by natural key
+        unique = {}
+        for instance in instances:
+            if instance.pk is not None:
+                key = instance.pk
+            else:
+                key = spec.get_natural_key(instance) or id(instance)
+            unique[key] = instance
+        instances = list(unique.values())
+
+        try:
+            with transaction.atomic():
+                self.upsert(spec, instances)
+            return len(instances), sorted(errors)
+        except IntegrityError:
+            pass
+
+        # a row conflicts with an existing record on another unique column: write the rows one by one to find it
+        written = 0
+        with transaction.atomic():
+            for instance in instances:
+                try:
+                    with transaction.atomic():
+                        self.upsert(spec, [instance])
+                    written += 1
+                except IntegrityError as error:
+                    errors.append((instance._row_number, str(error)))
+        return written, sorted(errors)
+
+    # write the instances with one statement per set of source columns. Rows with every column are upserted; rows with some
+    # columns only are existing rows (see RowValidator.check_new) and get those columns updated, as an INSERT would need the others.
+    def upsert(self, spec, instances):
+        groups = {}
+        for instance in instances:
+            groups.setdefault(instance._import_fields, []).append(instance)
+        for fields, group in groups.items():
+            update_fields = spec.get_update_fields(fields)
+            if len(fields) < len(spec.fields):
+                if 'updated_at' in update_fields:
+                    now = timezone.now()
+                    for instance in group:
+                        instance.updated_at = now
+                if update_fields:
+                    spec.model.objects.bulk_update(group, update_fields)
+                continue
+            options = {'update_conflicts': True, 'update_fields': update_fields}
+            if connection.features.supports_update_conflicts_with_target:
+                options['unique_fields'] = [spec.model._meta.pk.name]
+            spec.model.objects.bulk_create(group, **options)
@@ -0,0 +1,50 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from store.models import Cart, CartItem
+from store.reservations import release_items
+
+
+# purge_carts command, that deletes expired carts and their items in small batches so it can run next to live traffic
+class Command(BaseCommand):
+    help = 'Delete carts idle for longer than CART_IDLE_TTL or older than CART_MAX_AGE, with their items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of carts deleted per transaction')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the expired carts')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        started = time.monotonic()
+
+        if options['dry_run']:
+            expired = Cart.objects.expired(now).count()
+            self.stdout.write(f'{expired} expired carts')
+            return
+
+        carts_deleted = items_deleted = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            cart_ids = list(Cart.objects.expired(now).values_list('pk', flat=True)[:options['batch_size']])
+            if not cart_ids:
+                break
+
+            # the expiry is re-checked while the carts are locked, so a cart that became active since it was selected
+            # survives. The locked carts and items are a fixed set: the stock reserved by exactly these items is released,
+            # and exactly these carts are deleted, in the same transaction.
+            with transaction.atomic():
+                cart_ids = list(Cart.objects.expired(now).filter(pk__in=cart_ids).select_for_update().values_list('pk', flat=True))
+                item_ids = list(CartItem.objects.filter(cart_id__in=cart_ids).select_for_update().values_list('pk', flat=True))
+                release_items(CartItem.objects.filter(pk__in=item_ids))
+                _, deleted = Cart.objects.filter(pk__in=cart_ids).delete()
+            carts_deleted += deleted.get('store.Cart', 0)
+            items_deleted += deleted.get('store.CartItem', 0)
+            batches += 1
+            time.sleep(options['sleep'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {carts_deleted} carts and {items_deleted} cart items in {batches} batches, {elapsed:.2f}s'
+        ))
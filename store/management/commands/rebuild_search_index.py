@@ -0,0 +1,45 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from store.models import Product, ProductSearchIndex
+
+
+# rebuild_search_index command, that rewrites the whole product search index from the product and category tables
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of index rows written per INSERT')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        indexed = 0
+
+        products = Product.objects.select_related('category')\
+            .only('id', 'name', 'description', 'category__title')\
+            .order_by('id')
+
+        with transaction.atomic():
+            ProductSearchIndex.objects.all().delete()
+            batch = []
+            for product in products.iterator(chunk_size=batch_size):
+                batch.append(ProductSearchIndex(
+                    product_id=product.id, name=product.name,
+                    description=product.description, category_title=product.category.title
+                ))
+                if len(batch) >= batch_size:
+                    ProductSearchIndex.objects.bulk_create(batch)
+                    indexed += len(batch)
+                    batch = []
+            ProductSearchIndex.objects.bulk_create(batch)
+            indexed += len(batch)
+
+        # merge the FTS5 b-tree segments left behind by the bulk insert
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                table = ProductSearchIndex._meta.db_table
+                cursor.execute(f"INSERT INTO {table}({table}) VALUES('optimize')")
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} products in {elapsed:.2f}s'))
@@ -0,0 +1,63 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from store.aggregates import RATING_FIELDS, RATING_STARS, get_rating_values
+from store.caching import invalidate_catalog
+from store.models import Product, Review
+
+
+# recompute_ratings command, that rebuilds the denormalized rating columns of products from their reviews
+class Command(BaseCommand):
+    help = 'Recompute product rating aggregates from reviews (backfill and drift repair)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of products recomputed per transaction')
+        parser.add_argument('--check', action='store_true', help='Only report products whose aggregates drifted')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        checked = drifted = 0
+        last_id = 0
+
+        while True:
+            with transaction.atomic():
+                products = list(
+                    Product.objects.filter(pk__gt=last_id)
+                    .order_by('pk')
+                    .only('id', *RATING_FIELDS)[:batch_size]
+                )
+                if not products:
+                    break
+                last_id = products[-1].id
+
+                histograms = {product.id: dict.fromkeys(RATING_STARS, 0) for product in products}
+                rows = Review.objects.filter(product_id__in=histograms)\
+                    .values('product_id', 'rating')\
+                    .annotate(reviews=Count('id'))\
+                    .order_by()
+                for row in rows:
+                    histograms[row['product_id']][row['rating']] = row['reviews']
+
+                changed = []
+                for product in products:
+                    values = get_rating_values(histograms[product.id])
+                    if any(getattr(product, field) != value for field, value in values.items()):
+                        for field, value in values.items():
+                            setattr(product, field, value)
+                        product.updated_at = timezone.now()
+                        changed.append(product)
+
+                checked += len(products)
+                drifted += len(changed)
+                if changed and not options['check']:
+                    Product.objects.bulk_update(changed, RATING_FIELDS + ['updated_at'])
+
+        if drifted and not options['check']:
+            invalidate_catalog()
+
+        elapsed = time.monotonic() - started
+        action = 'drifted' if options['check'] else 'updated'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} products, {drifted} {action} in {elapsed:.2f}s'))
@@ -0,0 +1,60 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from store.caching import invalidate_catalog
+from store.models import Category, Product
+
+
+# reconcile_category_counts command, that verifies the maintained Category.products_count against the product table and fixes drift
+class Command(BaseCommand):
+    help = 'Verify and repair Category.products_count in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of categories checked per transaction')
+        parser.add_argument('--check', action='store_true', help='Only report categories whose counter drifted')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        checked = drifted = 0
+        last_id = 0
+
+        while True:
+            with transaction.atomic():
+                categories = list(
+                    Category.objects.filter(pk__gt=last_id)
+                    .order_by('pk')
+                    .only('id', 'products_count')[:batch_size]
+                )
+                if not categories:
+                    break
+                last_id = categories[-1].id
+
+                counts = dict(
+                    Product.objects.filter(category_id__in=[category.id for category in categories])
+                    .order_by()
+                    .values_list('category_id')
+                    .annotate(Count('id'))
+                )
+                changed = []
+                for category in categories:
+                    products_count = counts.get(category.id, 0)
+                    if category.products_count != products_count:
+                        self.stdout.write(f'Category {category.id}: {category.products_count} -> {products_count}')
+                        category.products_count = products_count
+                        category.updated_at = timezone.now()
+                        changed.append(category)
+
+                checked += len(categories)
+                drifted += len(changed)
+                if changed and not options['check']:
+                    Category.objects.bulk_update(changed, ['products_count', 'updated_at'])
+
+        if drifted and not options['check']:
+            invalidate_catalog()
+
+        elapsed = time.monotonic() - started
+        action = 'drifted' if options['check'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} categories, {drifted} {action} in {elapsed:.2f}s'))
@@ -0,0 +1,57 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from store.models import CartItem, Product
+
+
+# reconcile_reservations command, that verifies the maintained Product.reserved_quantity against the reservations of the
+# cart items and fixes drift. Like the reservations themselves, a fix leaves updated_at and the catalog cache alone: the
+# product endpoints read available_quantity live.
+class Command(BaseCommand):
+    help = 'Verify and repair Product.reserved_quantity in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of products checked per transaction')
+        parser.add_argument('--check', action='store_true', help='Only report products whose counter drifted')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        checked = drifted = 0
+        last_id = 0
+
+        while True:
+            with transaction.atomic():
+                products = list(
+                    Product.objects.select_for_update()
+                    .filter(pk__gt=last_id)
+                    .order_by('pk')
+                    .only('id', 'reserved_quantity')[:batch_size]
+                )
+                if not products:
+                    break
+                last_id = products[-1].id
+
+                reserved = dict(
+                    CartItem.objects.filter(product_id__in=[product.id for product in products], reserved_quantity__gt=0)
+                    .order_by()
+                    .values_list('product_id')
+                    .annotate(Sum('reserved_quantity'))
+                )
+                changed = []
+                for product in products:
+                    reserved_quantity = reserved.get(product.id, 0)
+                    if product.reserved_quantity != reserved_quantity:
+                        self.stdout.write(f'Product {product.id}: {product.reserved_quantity} -> {reserved_quantity}')
+                        product.reserved_quantity = reserved_quantity
+                        changed.append(product)
+
+                checked += len(products)
+                drifted += len(changed)
+                if changed and not options['check']:
+                    Product.objects.bulk_update(changed, ['reserved_quantity'])
+
+        elapsed = time.monotonic() - started
+        action = 'drifted' if options['check'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} products, {drifted} {action} in {elapsed:.2f}s'))
@@ -0,0 +1,41 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from store.models import CartItem
+from store.reservations import release_expired_reservations
+
+
+# release_reservations command, that gives the stock of expired cart reservations back in small batches, so it can run
+# next to live traffic (e.g. every minute from cron)
+class Command(BaseCommand):
+    help = 'Release the stock reservations of cart items older than STOCK_RESERVATION_TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of reservations released per transaction')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the expired reservations')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        started = time.monotonic()
+
+        if options['dry_run']:
+            expired = CartItem.objects.filter(reserved_quantity__gt=0, reserved_until__lt=now).count()
+            self.stdout.write(f'{expired} expired reservations')
+            return
+
+        items_released = quantity_released = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            items, quantity = release_expired_reservations(now, options['batch_size'])
+            if not items:
+                break
+            items_released += items
+            quantity_released += quantity
+            batches += 1
+            time.sleep(options['sleep'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Released {items_released} reservations ({quantity_released} units) in {batches} batches, {elapsed:.2f}s'
+        ))
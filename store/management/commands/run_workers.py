@@ -0,0 +1,34 @@
+import json
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from store.jobs import Worker, get_job_stats, retry_failed_jobs
+
+
+# run_workers command, that runs the background jobs of store/jobs.py on a thread pool until it is stopped (SIGINT/SIGTERM
+# let the running jobs finish first). Start as many of these processes as needed; they share the queue safely.
+class Command(BaseCommand):
+    help = 'Run the queued background jobs on a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.JOBS_WORKERS, help='Number of worker threads')
+        parser.add_argument('--poll-interval', type=float, default=settings.JOBS_POLL_INTERVAL, help='Seconds between polls of an idle queue')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is ready to run')
+        parser.add_argument('--stats', action='store_true', help='Print the pending, running, done and failed jobs and exit')
+        parser.add_argument('--retry-failed', action='store_true', help='Queue the failed jobs again and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(get_job_stats(), indent=2, cls=DjangoJSONEncoder))
+            return
+        if options['retry_failed']:
+            self.stdout.write(f'{retry_failed_jobs()} failed jobs queued again')
+            return
+
+        worker = Worker(options['workers'], options['poll_interval'], burst=options['burst'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+        self.stdout.write(f'Worker {worker.id} running jobs on {worker.threads} threads')
+        worker.run()
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker.id} stopped after {worker.processed} jobs'))
@@ -0,0 +1,152 @@
+import atexit
+import json
+import os
+import threading
+import time
+from uuid import uuid4
+from django.conf import settings
+
+
+# upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+COUNTERS = {
+    'http_requests_total': 'Requests handled, by view, method and status code.',
+    'http_request_db_queries_total': 'Database queries run while handling requests.',
+    'http_request_db_duration_seconds_total': 'Time spent in database queries while handling requests.',
+    'http_request_render_duration_seconds_total': 'Time spent rendering (serializing) responses.',
+    'http_response_size_bytes_total': 'Size of the response bodies sent, streaming responses excluded.',
+}
+HISTOGRAM = 'http_request_duration_seconds'
+HISTOGRAM_HELP = 'Request latency, by view and method.'
+
+
+# MetricsRegistry class, the metrics of this process. Every process writes its own snapshot to a file in METRICS_DIR, and
+# the /metrics endpoint adds up the files of all processes, so the numbers cover every gunicorn worker whichever answers the scrape.
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+        self._dirty = False
+        self._path = None
+
+    # forked workers inherit the registry of the process they were forked from: start over with a file of their own, written
+    # by a background thread at most every METRICS_FLUSH_INTERVAL seconds (and at exit), never on the request path
+    def _check_process(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.reset()
+            threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+            atexit.register(self.flush)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            with self._lock:
+                if self._dirty:
+                    self._flush()
+
+    def observe(self, view, method, status, duration, queries, db_duration, render_duration, size):
+        with self._lock:
+            self._check_process()
+            labels = (('view', view), ('method', method))
+            self._add('http_requests_total', labels + (('status', str(status)),), 1)
+            self._add('http_request_db_queries_total', labels, queries)
+            self._add('http_request_db_duration_seconds_total', labels, db_duration)
+            self._add('http_request_render_duration_seconds_total', labels, render_duration)
+            self._add('http_response_size_bytes_total', labels, size)
+
+            histogram = self.histograms.setdefault(labels, {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += duration
+            histogram['count'] += 1
+            self._dirty = True
+
+    def _add(self, name, labels, value):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def flush(self):
+        with self._lock:
+            self._check_process()
+            self._flush()
+
+    # write the snapshot of this process to a temporary file and rename it, so a reader never sees half a snapshot
+    def _flush(self):
+        if self._path is None:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            self._path = os.path.join(settings.METRICS_DIR, f'{self._pid}-{uuid4().hex[:8]}.json')
+        snapshot = {
+            'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+            'histograms': [[list(labels), histogram] for labels, histogram in self.histograms.items()],
+        }
+        temporary = f'{self._path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(snapshot, file)
+        os.replace(temporary, self._path)
+        self._dirty = False
+
+
+registry = MetricsRegistry()
+
+
+# add up the snapshots of every process found in METRICS_DIR
+def collect():
+    counters = {}
+    histograms = {}
+    directory = settings.METRICS_DIR
+    names = os.listdir(directory) if os.path.isdir(directory) else []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding='utf-8') as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for metric, labels, value in snapshot['counters']:
+            key = (metric, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for labels, histogram in snapshot['histograms']:
+            total = histograms.setdefault(tuple(tuple(label) for label in labels), {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return counters, histograms
+
+
+def format_labels(labels):
+    def escape(value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+# render the metrics of all processes in the Prometheus text exposition format (version 0.0.4)
+def render_metrics():
+    registry.flush()
+    counters, histograms = collect()
+
+    lines = []
+    for metric, help_text in COUNTERS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f'{metric}{format_labels(labels)} {value}')
+
+    lines.append(f'# HELP {HISTOGRAM} {HISTOGRAM_HELP}')
+    lines.append(f'# TYPE {HISTOGRAM} histogram')
+    for labels, histogram in sorted(histograms.items()):
+        for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+            lines.append(f'{HISTOGRAM}_bucket{format_labels(labels + (("le", str(bound)),))} {count}')
+        lines.append(f'{HISTOGRAM}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+        lines.append(f'{HISTOGRAM}_sum{format_labels(labels)} {histogram["sum"]}')
+        lines.append(f'{HISTOGRAM}_count{format_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
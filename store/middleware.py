@@ -0,0 +1,115 @@
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from .metrics import registry
+from .querybudget import count_queries, get_query_budget
+
+
+logger = logging.getLogger('store.querybudget')
+
+
+# QueryBudgetMiddleware class, that counts the queries of every request and logs the ones running more than the budget
+# declared for their endpoint in store/querybudget.py, with their SQL. Enabled by settings.QUERY_BUDGET_LOGGING.
+# Queries run while a streaming response is sent are not counted.
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_LOGGING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with count_queries() as queries:
+            response = self.get_response(request)
+        return self.check_budget(request, response, queries)
+
+    async def __acall__(self, request):
+        with count_queries() as queries:
+            response = await self.get_response(request)
+        return self.check_budget(request, response, queries)
+
+    def check_budget(self, request, response, queries):
+        match = request.resolver_match
+        budget = get_query_budget(match.url_name, request.method) if match is not None else None
+        if budget is not None and len(queries) > budget:
+            logger.warning(
+                '%s %s ran %d queries, over its budget of %d (%s):\n%s',
+                request.method, request.path, len(queries), budget, match.url_name, queries.format()
+            )
+        return response
+
+
+# return the name of the view handling a request, e.g. ProductViewSet.list, CacheStatsView.get or "unmatched" for a 404
+def get_view_name(request):
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    view_class = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+    if view_class is None:
+        return match.view_name
+    actions = getattr(match.func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+
+
+# RequestMetricsMiddleware class, that measures every request: total latency, database queries and their time, rendering
+# (serialization of the response data) time and response size. The timings are sent in a Server-Timing header, and every
+# measurement is added to the per-view metrics of store/metrics.py served by /metrics. Enabled by settings.METRICS_ENABLED.
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        request._render_duration = 0.0
+        with count_queries() as queries:
+            response = self.get_response(request)
+        return self.observe(request, response, queries, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        request._render_duration = 0.0
+        with count_queries() as queries:
+            response = await self.get_response(request)
+        return self.observe(request, response, queries, time.perf_counter() - started)
+
+    def observe(self, request, response, queries, duration):
+        view = get_view_name(request)
+        render = request._render_duration
+        app = max(duration - queries.duration - render, 0.0)
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={queries.duration * 1000:.2f};desc="{len(queries)} queries"',
+            f'app;dur={app * 1000:.2f}',
+            f'render;dur={render * 1000:.2f}',
+            f'total;dur={duration * 1000:.2f};desc="{view}"',
+        ])
+
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(view, request.method, response.status_code, duration, len(queries), queries.duration, render, size)
+        return response
+
+    # DRF responses are rendered after the view returns: time the rendering with a post-render callback
+    def process_template_response(self, request, response):
+        render_started = time.perf_counter()
+
+        def rendered(response):
+            request._render_duration = time.perf_counter() - render_started
+
+        response.add_post_render_callback(rendered)
+        return response
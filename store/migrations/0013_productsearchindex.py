@@ -0,0 +1,69 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# the search index is a plain table everywhere except on SQLite, where it is an FTS5 virtual table
+SEARCH_TABLE_SQL = {
+    'sqlite': (
+        "CREATE VIRTUAL TABLE store_productsearchindex USING fts5("
+        "name, description, category_title, tokenize = 'unicode61 remove_diacritics 2')"
+    ),
+    'mysql': (
+        "CREATE TABLE store_productsearchindex ("
+        "rowid bigint NOT NULL PRIMARY KEY, name varchar(255) NOT NULL, description longtext NULL, "
+        "category_title varchar(255) NOT NULL, "
+        "FULLTEXT KEY store_productsearchindex_fulltext (name, description, category_title)"
+        ") ENGINE=InnoDB"
+    ),
+}
+DEFAULT_SEARCH_TABLE_SQL = (
+    "CREATE TABLE store_productsearchindex ("
+    "rowid bigint NOT NULL PRIMARY KEY, name varchar(255) NOT NULL, description text NULL, "
+    "category_title varchar(255) NOT NULL)"
+)
+
+
+def create_search_table(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    schema_editor.execute(SEARCH_TABLE_SQL.get(vendor, DEFAULT_SEARCH_TABLE_SQL))
+
+    Product = apps.get_model('store', 'Product')
+    ProductSearchIndex = apps.get_model('store', 'ProductSearchIndex')
+    products = Product.objects.using(schema_editor.connection.alias).select_related('category')
+    ProductSearchIndex.objects.using(schema_editor.connection.alias).bulk_create([
+        ProductSearchIndex(
+            product_id=product.id, name=product.name,
+            description=product.description, category_title=product.category.title
+        )
+        for product in products.iterator(chunk_size=1000)
+    ], batch_size=1000)
+
+
+def drop_search_table(apps, schema_editor):
+    schema_editor.execute('DROP TABLE store_productsearchindex')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_remove_product_imageurl_alter_productimage_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='store.product')),
+                ('name', models.CharField(max_length=255)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('category_title', models.CharField(max_length=255)),
+            ],
+            options={
+                'db_table': 'store_productsearchindex',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:31
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_products_count(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    Product = apps.get_model('store', 'Product')
+    counts = Product.objects.filter(category_id=OuterRef('pk'))\
+        .order_by()\
+        .values('category_id')\
+        .annotate(count=Count('id'))\
+        .values('count')
+    Category.objects.update(products_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_products_count, migrations.RunPython.noop),
+    ]
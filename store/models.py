@@ -1,7 +1,13 @@
+from decimal import Decimal
 from uuid import uuid4
+from django.conf import settings
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from authsys.models import User
+from .pricing import get_effective_price, get_effective_price_expression
 from .validators import validate_file_size
 # Create your models here.
 
@@ -9,6 +15,9 @@ from .validators import validate_file_size
 # create a category model with fields: id, title
 class Category(models.Model):
     title = models.CharField(max_length=255)
+    # denormalized number of products in the category, maintained by the product signals in store/signals.py
+    products_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
@@ -23,25 +32,69 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=6, decimal_places=2, validators=[MinValueValidator(1)])
     category = models.ForeignKey(Category, on_delete=models.PROTECT, related_name='products')
     stock_quantity = models.IntegerField(validators=[MinValueValidator(0)])
+    # stock held by the reservations of cart items, maintained by store/reservations.py
+    reserved_quantity = models.PositiveIntegerField(default=0)
     created_date = models.DateField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True)
     discount = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True, default=0)
+    # denormalized review aggregates, maintained by store.aggregates.update_product_rating()
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
-    # create a method to apply discount by subtracting the discounted value from the initial price.
+    # override the from_db() method to remember the category a product was loaded with, so a re-categorized product can be detected on save
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
+    # stock that can still be added to a cart: the stock not held by cart reservations
+    @property
+    def available_quantity(self):
+        return max(self.stock_quantity - self.reserved_quantity, 0)
+
+    # number of reviews per star, e.g. {'1': 0, '2': 1, '3': 0, '4': 4, '5': 10}
+    @property
+    def rating_histogram(self):
+        return {str(star): getattr(self, f'rating_{star}') for star in range(1, 6)}
+
+    # the price less the product discount, rounded to the cent like the effective_price annotation (see store/pricing.py)
     @property
     def discounted_price(self):
-        if self.discount:
-            discount_factor = (100 - float(self.discount))/100
-            return round(self.price * discount_factor, 2)
-        return self.price
+        return get_effective_price(self.price, self.discount)
     
 
+# create a product search index model with fields: product_id(OneToOneField-product model, stored as the index rowid), name, description, category_title
+# the table is not managed by django: migration 0013 creates it as an FTS5 virtual table on SQLite and as a FULLTEXT indexed table on MySQL
+class ProductSearchIndex(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', db_constraint=False, related_name='search_index')
+    name = models.CharField(max_length=255)
+    description = models.TextField(null=True, blank=True)
+    category_title = models.CharField(max_length=255)
+
+    class Meta:
+        managed = False
+        db_table = 'store_productsearchindex'
+
+
 # create a product image model with fields: id, product_id(FK-product model), image
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='store/images', validators=[validate_file_size])
+    updated_at = models.DateTimeField(auto_now=True)
+    # filled in the background by store.images: size of the original and the storage names of its resized variants,
+    # e.g. {'webp': {'320': 'store/images/variants/7_chair_320w.webp'}, 'jpeg': {...}}
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    variants = models.JSONField(default=dict, blank=True)
 
 
 # create a customer model with fields: id, user_id(OneToOneField-user model), phone, birth_date, membership
@@ -106,6 +159,22 @@ class Review(models.Model):
         return f'{self.summary}'
 
 
+# OrderQuerySet class, that adds database computed totals to orders
+class OrderQuerySet(models.QuerySet):
+    # annotate every order with total_amount = SUM(quantity * unit_price) of its items, computed as a Decimal by the database.
+    # A correlated subquery keeps it composable with other joins and costs no extra query however many orders are listed.
+    def with_totals(self):
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        totals = OrderItem.objects.filter(order_id=models.OuterRef('pk'))\
+            .order_by()\
+            .values('order_id')\
+            .annotate(total=models.Sum(models.F('quantity') * models.F('unit_price'), output_field=money))\
+            .values('total')
+        return self.annotate(
+            total_amount=Coalesce(models.Subquery(totals), Value(Decimal('0')), output_field=money)
+        )
+
+
 # create a order model with fields: id, customer_id(FK-customer model), payment_status, placed_at
 class Order(models.Model):
     PAYMENT_STATUS_PENDING = 'P'
@@ -121,10 +190,18 @@ class Order(models.Model):
     payment_status = models.CharField(max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT, related_name='orders')
 
-    # define a method to get the total price of the items in the order
+    objects = OrderQuerySet.as_manager()
+
+    # define a method to get the total price of the items in the order.
+    # Orders loaded through Order.objects.with_totals() already carry it; otherwise it is one aggregate query.
     @property
     def total_price(self):
-        return sum(item.quantity * item.unit_price for item in self.items.all())
+        if hasattr(self, 'total_amount'):
+            total = self.total_amount
+        else:
+            money = models.DecimalField(max_digits=12, decimal_places=2)
+            total = self.items.aggregate(total=models.Sum(models.F('quantity') * models.F('unit_price'), output_field=money))['total']
+        return (total or Decimal('0')).quantize(Decimal('0.01'))
     
 
 # create an order item model with fields: id, customer_id(FK-customer model), product_id(FK-product model), date
@@ -147,10 +224,52 @@ class OrderItem(models.Model):
         super().save(*args, **kwargs)
 
 
-# create a cart model with fields: id, created_date
+# CartQuerySet class, that tracks cart activity and finds abandoned carts
+class CartQuerySet(models.QuerySet):
+    # record activity on the carts, which pushes back their expiry
+    def touch(self):
+        return self.update(last_activity=timezone.now())
+
+    # carts idle for longer than settings.CART_IDLE_TTL, or created more than settings.CART_MAX_AGE ago
+    def expired(self, now=None):
+        now = now or timezone.now()
+        condition = models.Q(last_activity__lt=now - settings.CART_IDLE_TTL)
+        if settings.CART_MAX_AGE is not None:
+            condition |= models.Q(created_date__lt=now - settings.CART_MAX_AGE)
+        return self.filter(condition)
+
+    # annotate every cart with item_count (sum of quantities) and total_price (sum of quantity * effective product price for
+    # the membership tier), computed by the database
+    def with_totals(self, membership=None):
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        items = CartItem.objects.filter(cart_id=models.OuterRef('pk')).order_by().values('cart_id')
+        item_count = items.annotate(count=models.Sum('quantity')).values('count')
+        total_price = items.annotate(
+            total=models.Sum(get_effective_price_expression(membership, 'product__', 'quantity'), output_field=money)
+        ).values('total')
+        return self.annotate(
+            item_count=Coalesce(models.Subquery(item_count), 0),
+            total_price=Coalesce(models.Subquery(total_price), Value(Decimal('0')), output_field=money),
+        )
+
+
+# create a cart model with fields: id, created_date, last_activity
 class Cart(models.Model):
     id = models.UUIDField(default=uuid4, primary_key=True)
     created_date = models.DateTimeField(auto_now_add=True)
+    last_activity = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = CartQuerySet.as_manager()
+
+
+# CartItemQuerySet class, that prices cart items in the database
+class CartItemQuerySet(models.QuerySet):
+    # annotate every item with unit_price (the effective price of its product for the membership tier) and total_price
+    def with_prices(self, membership=None):
+        return self.annotate(
+            unit_price=get_effective_price_expression(membership, 'product__'),
+            total_price=get_effective_price_expression(membership, 'product__', 'quantity'),
+        )
 
 
 # create a cart item model with fields: id, cart_id(FK-cart model), product_id(FK-product model), quantity
@@ -158,7 +277,57 @@ class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
+    # stock reserved for the item until reserved_until (see store/reservations.py); 0 once checked out or released
+    reserved_quantity = models.PositiveSmallIntegerField(default=0)
+    reserved_until = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = CartItemQuerySet.as_manager()
 
     class Meta:
         unique_together = [['cart', 'product']]
 
+
+
+# create a job model: a queued call of a background task (see store/jobs.py), run by `python manage.py run_workers`
+class Job(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    # dotted path of the task, e.g. store.images.process_product_image
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    # idempotency key: a task call enqueued again with the same key reuses the existing job
+    key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    # the job is not run before run_at; a retry moves it back by the backoff delay
+    run_at = models.DateTimeField(default=timezone.now)
+    # a running job whose lock expired (its worker died) is claimed again
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+
+# create a catalog version model: the single row holding the version of the cached catalog responses (see store/caching.py),
+# in the database so that the web and async workers, the job workers and the management commands all read and move it
+class CatalogVersion(models.Model):
+    version = models.BigIntegerField()
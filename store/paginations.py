@@ -1,4 +1,150 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, CursorPagination, Cursor
 
 class DefaultPagination(PageNumberPagination):
     page_size = 15
+
+
+# KeysetPagination class, an opt-in alternative to DefaultPagination for large, append-heavy tables.
+# Pages are fetched with a "WHERE (ordering columns) > (last row seen)" condition instead of COUNT(*) + OFFSET,
+# so every page costs the same no matter how deep the client scrolls. The ordering always ends with an
+# `id` tie-breaker, which makes the position of every row unique even when sorting by price or stock_quantity.
+# Ordering fields must be non-null columns (or annotations) of the paginated queryset. A malformed or tampered cursor
+# is answered with a 400, like any other invalid query param.
+class KeysetPagination(CursorPagination):
+    page_size = 15
+    ordering = 'id'
+    tie_breaker = 'id'
+
+    # override the get_ordering() method to fall back to the queryset/model ordering when the view has no
+    # explicit ordering, and to always end the ordering with the unique tie-breaker field
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for filter_cls in getattr(view, 'filter_backends', []):
+            if hasattr(filter_cls, 'get_ordering'):
+                ordering = filter_cls().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            ordering = queryset.query.order_by or queryset.model._meta.ordering or self.ordering
+        if isinstance(ordering, str):
+            ordering = [ordering]
+
+        ordering = [field for field in ordering if '__' not in field and field != '?']
+        if not any(field.lstrip('-') == self.tie_breaker for field in ordering):
+            direction = '-' if ordering and ordering[0].startswith('-') else ''
+            ordering.append(direction + self.tie_breaker)
+        return tuple(ordering)
+
+    # override the paginate_queryset() method to filter on the full (ordering..., id) position of the last row seen
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    # the same as paginate_queryset(), fetching the page with the async ORM
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([row async for row in queryset])
+
+    # decode the cursor and return the queryset of the page, without running it
+    def get_page_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        self.reverse = self.cursor is not None and self.cursor.reverse
+        self.current_position = self._decode_position(self.cursor)
+
+        ordering = [self._flip(field) for field in self.ordering] if self.reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.current_position is not None:
+            try:
+                queryset = queryset.filter(self._after_position(ordering, self.current_position))
+            except (TypeError, ValueError, ValidationError):
+                self.raise_invalid_cursor()
+
+        # fetch one extra row to find out whether another page follows this one, without a COUNT(*) query
+        return queryset[:self.page_size + 1]
+
+    # override the decode_cursor() method to answer a cursor that can not be decoded with a 400 instead of a 404
+    def decode_cursor(self, request):
+        try:
+            return super().decode_cursor(request)
+        except NotFound:
+            self.raise_invalid_cursor()
+
+    def raise_invalid_cursor(self):
+        raise serializers.ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+
+    def set_page(self, results):
+        self.page = results[:self.page_size]
+        has_following = len(results) > self.page_size
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_following
+        else:
+            self.has_next, self.has_previous = has_following, self.current_position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    # override the get_next_link() method to point at the position of the last row on this page
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering) if self.page else self.current_position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=json.dumps(position)))
+
+    # override the get_previous_link() method to point at the position of the first row on this page
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering) if self.page else self.current_position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=json.dumps(position)))
+
+    # override the _get_position_from_instance() method to return the value of every ordering field, not just the first
+    def _get_position_from_instance(self, instance, ordering):
+        position = []
+        for field in ordering:
+            field_name = field.lstrip('-')
+            value = instance[field_name] if isinstance(instance, dict) else getattr(instance, field_name)
+            position.append(str(value))
+        return position
+
+    def _decode_position(self, cursor):
+        if cursor is None or cursor.position is None:
+            return None
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            self.raise_invalid_cursor()
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            self.raise_invalid_cursor()
+        return position
+
+    # build the row-value comparison "(a, b, id) > (x, y, z)" as OR-ed prefixes, honouring each field's direction
+    def _after_position(self, ordering, position):
+        condition = Q()
+        equal_prefix = Q()
+        for field, value in zip(ordering, position):
+            field_name = field.lstrip('-')
+            lookup = '__lt' if field.startswith('-') else '__gt'
+            condition |= equal_prefix & Q(**{field_name + lookup: value})
+            equal_prefix &= Q(**{field_name: value})
+        return condition
+
+    def _flip(self, field):
+        return field[1:] if field.startswith('-') else '-' + field
@@ -0,0 +1,85 @@
+from decimal import ROUND_HALF_UP, Decimal
+from django.conf import settings
+from django.db.models import BigIntegerField, DecimalField, ExpressionWrapper, F, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, Mod, Round
+from django.utils.cache import patch_vary_headers
+
+
+# Pricing engine: the effective price of a product is its price less its discount (a percentage) and less the discount of
+# the customer's membership tier (settings.MEMBERSHIP_DISCOUNTS, a percentage per Customer.membership), rounded once to the
+# cent, half up. It is computed by the database as a queryset annotation, so it can be filtered, ordered and summed without
+# loading rows, and get_effective_price() computes the same value in Python for a single product.
+#
+# The SQL works in integers: price in cents, discounts in basis points (1/100 of a percent), so the result is exact on
+# every backend, including SQLite where decimals are stored as floating point numbers:
+#   cents = ROUND((price_cents * (10000 - discount_bp) * (10000 - tier_bp) + 10^8 / 2) / 10^8, half up)
+# The largest intermediate value (999999 * 10^4 * 10^4) is below 2^53, so it is exact even as a double.
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+SCALE = 10 ** 8
+
+
+def to_basis_points(percentage):
+    return int((Decimal(str(percentage or 0)) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+# the discount of a membership tier ('B', 'S', 'G', or None for visitors and users without a customer profile), in basis points
+def get_tier_basis_points(membership):
+    return to_basis_points(settings.MEMBERSHIP_DISCOUNTS.get(membership, 0))
+
+
+# the membership tier of the caller of a request: request.user carries its customer profile (see authsys/authentication.py)
+def get_membership(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    customer = getattr(user, 'customer', None)
+    return customer.membership if customer is not None else None
+
+
+# the effective price of a product for a membership tier, as a SQL expression. `prefix` reaches the product through a
+# relation, e.g. 'product__' on cart items, and `quantity` names an integer column multiplying the price, e.g. 'quantity'
+# for the total of a cart item (the unit price is rounded first, then multiplied).
+def get_effective_price_expression(membership, prefix='', quantity=None):
+    price_cents = Round(F(f'{prefix}price') * Value(100))
+    discount_bp = Round(Coalesce(F(f'{prefix}discount'), Value(Decimal('0'))) * Value(100))
+    numerator = price_cents * Greatest(Value(10000) - discount_bp, Value(0)) * Value(10000 - get_tier_basis_points(membership)) + Value(SCALE // 2)
+    # the division of a multiple of 10^8 is exact, whatever the backend's division rules
+    cents = Cast((numerator - Mod(numerator, Value(SCALE))) / Value(SCALE), BigIntegerField())
+    if quantity is not None:
+        cents = cents * F(quantity)
+    return ExpressionWrapper(cents * Value(Decimal('0.01')), output_field=MONEY)
+
+
+# the effective price of a single product in Python, equal to the SQL expression
+def get_effective_price(price, discount, membership=None):
+    discount_bp = min(to_basis_points(discount), 10000)
+    price = Decimal(price) * (10000 - discount_bp) * (10000 - get_tier_basis_points(membership)) / SCALE
+    return price.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+# PricingMixin class, for the viewsets rendering effective prices: get_membership() is the caller's tier, and the catalog
+# cache key and ETag (CachedResponseMixin, ConditionalGetMixin, listed after this mixin) are kept apart per tier discount,
+# so a member is never served the cached prices of another tier. Tiers without a discount share the public entries.
+class PricingMixin:
+    def get_membership(self):
+        return get_membership(self.request)
+
+    def get_price_variant(self):
+        return get_tier_basis_points(self.get_membership())
+
+    def get_cache_key(self, request):
+        key = super().get_cache_key(request)
+        variant = self.get_price_variant()
+        return f'{key}:tier{variant}' if variant else key
+
+    def get_etag(self, request, *validators):
+        etag = super().get_etag(request, *validators)
+        variant = self.get_price_variant()
+        return f'{etag[:-1]}-tier{variant}"' if variant else etag
+
+    # the prices depend on the credentials, so shared caches must not serve one caller's response to another
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ['Authorization'])
+        return response
@@ -0,0 +1,101 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+# maximum number of queries per endpoint, keyed by url name and HTTP method, measured with cold caches.
+# A budget must not depend on the size of the result: list endpoints prefetch or annotate instead of querying per row.
+# Every route of store.urls and authsys.urls needs an entry, and store/tests.py enforces both rules.
+QUERY_BUDGETS = {
+    'api-root': {'GET': 0},
+    'products-list': {'GET': 3, 'POST': 6},
+    'products-detail': {'GET': 4, 'PATCH': 7, 'DELETE': 11},
+    'products-bulk-update': {'PATCH': 6},
+    'product-images-list': {'GET': 1},
+    'product-images-detail': {'GET': 1, 'DELETE': 4},
+    'product-reviews-list': {'GET': 1, 'POST': 8},
+    'product-reviews-detail': {'GET': 1, 'PATCH': 8, 'DELETE': 8},
+    'reviews-list': {'GET': 1},
+    'reviews-detail': {'GET': 1},
+    'categories-list': {'GET': 2, 'POST': 2},
+    'categories-detail': {'GET': 3, 'PATCH': 4, 'DELETE': 5},
+    'carts-list': {'POST': 3},
+    'carts-detail': {'GET': 2, 'DELETE': 4},
+    'carts-summary': {'GET': 1},
+    'cart-items-list': {'GET': 1, 'POST': 12},
+    'cart-items-detail': {'GET': 1, 'PATCH': 7, 'DELETE': 7},
+    'customer-list': {'GET': 2, 'POST': 2},
+    'customer-detail': {'GET': 2, 'PATCH': 3, 'DELETE': 7},
+    'orders-list': {'GET': 3, 'POST': 14},
+    'orders-detail': {'GET': 3},
+    'cache-stats': {'GET': 1},
+    'job-stats': {'GET': 3},
+    'export-products': {'GET': 2},
+    'export-customers': {'GET': 2},
+    'export-orders': {'GET': 3},
+    'async-products-list': {'GET': 2},
+    'async-products-detail': {'GET': 2},
+    'async-categories-list': {'GET': 1},
+    'async-carts-detail': {'GET': 2},
+    'register': {'POST': 4},
+    'token_obtain_pair': {'POST': 1},
+    'token_refresh': {'POST': 0},
+}
+
+
+# return the query budget of a request to the url named `url_name`, or None when it has none
+def get_query_budget(url_name, method):
+    return QUERY_BUDGETS.get(url_name, {}).get(method.upper())
+
+
+# QueryLog class, the SQL of every query run on any database connection inside count_queries(), and their total time in seconds
+class QueryLog(list):
+    duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.append(sql)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+
+    def format(self):
+        return '\n'.join(f'{number}. {sql}' for number, sql in enumerate(self, start=1))
+
+
+# the query logs of the count_queries() blocks of the current context. A context variable follows the async ORM into the
+# thread running its queries (sync_to_async copies the context), so the queries of async views are counted too.
+active_logs = ContextVar('query_logs', default=())
+
+
+# execute wrapper installed on every database connection, in every thread: records the query in the active logs, if any
+def record_query(execute, sql, params, many, context):
+    for queries in active_logs.get():
+        execute = partial(queries, execute)
+    return execute(sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+# record the queries run inside the block, without needing DEBUG: with count_queries() as queries: ...
+# Queries run by other threads on behalf of the block (sync_to_async) are recorded, those of unrelated threads are not.
+@contextmanager
+def count_queries():
+    queries = QueryLog()
+    for connection in connections.all():
+        install_query_recorder(connection)
+    token = active_logs.set((*active_logs.get(), queries))
+    try:
+        yield queries
+    finally:
+        active_logs.reset(token)
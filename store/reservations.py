@@ -0,0 +1,100 @@
+from contextlib import nullcontext
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import CartItem, Product
+
+
+# Stock reservations: the quantity of a cart item is reserved for STOCK_RESERVATION_TTL when it is added or changed, so the
+# stock can not be sold twice. Product.reserved_quantity is the sum of the reservations of a product, kept in step by the
+# functions below, and available_quantity (stock minus reservations) is read from the product row without any lock.
+# Reservations change on every cart action, so they neither move Product.updated_at nor invalidate the catalog cache: the
+# product endpoints read available_quantity live (see ProductViewSet.live_fields).
+# CartItem.reserved_quantity and reserved_until hold the reservation of an item until it is checked out, deleted, or
+# released by `python manage.py release_reservations` once expired.
+
+
+class Unavailable(Exception):
+    pass
+
+
+# a "reserved_quantity +/- n" expression for several products at once, e.g. {3: 2, 5: 1}
+def get_quantity_case(quantities):
+    return Case(*(When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()))
+
+
+# reserve {product_id: quantity} with one conditional UPDATE, which only succeeds for products with enough available stock,
+# so concurrent reservations can not oversell even without row locks. Returns {} when every product was reserved, else
+# {product_id: available_quantity} of the products that could not be (None for unknown products) and reserves nothing.
+def reserve_stock(quantities):
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return {}
+    available = reduce(or_, (
+        Q(pk=product_id, stock_quantity__gte=F('reserved_quantity') + quantity) for product_id, quantity in quantities.items()
+    ))
+    try:
+        # with several products, a savepoint undoes the reservations made when one of them is short
+        with transaction.atomic() if len(quantities) > 1 else nullcontext():
+            updated = Product.objects.filter(available).update(reserved_quantity=F('reserved_quantity') + get_quantity_case(quantities))
+            if updated != len(quantities):
+                raise Unavailable
+    except Unavailable:
+        products = Product.objects.filter(pk__in=quantities).values_list('id', 'stock_quantity', 'reserved_quantity')
+        found = {product_id: max(stock_quantity - reserved_quantity, 0) for product_id, stock_quantity, reserved_quantity in products}
+        return {
+            product_id: found.get(product_id) for product_id, quantity in quantities.items()
+            if found.get(product_id) is None or found[product_id] < quantity
+        }
+    return {}
+
+
+# give {product_id: quantity} of reserved stock back
+def release_stock(quantities):
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(
+            reserved_quantity=Greatest(F('reserved_quantity') - get_quantity_case(quantities), Value(0))
+        )
+    return quantities
+
+
+# release the reservations of a queryset of cart items, grouped by product into one UPDATE, and return {product_id: quantity}.
+# Run it in the transaction that deletes the items or clears their reservation.
+def release_items(items):
+    reserved = items.filter(reserved_quantity__gt=0).order_by().values('product_id').annotate(quantity=Sum('reserved_quantity'))
+    return release_stock({row['product_id']: row['quantity'] for row in reserved})
+
+
+# delete a queryset of cart items with their reservations
+def delete_items(items):
+    with transaction.atomic():
+        release_items(items)
+        return items.delete()
+
+
+# the expiry of a reservation made now
+def get_reserved_until():
+    return timezone.now() + settings.STOCK_RESERVATION_TTL
+
+
+# release up to `batch_size` reservations that expired before `now`, in one transaction, and return (items, quantity)
+# released. The items stay in their carts without a reservation; their stock is reserved again when they change, and
+# checked at checkout.
+def release_expired_reservations(now=None, batch_size=500):
+    now = now or timezone.now()
+    with transaction.atomic():
+        item_ids = list(
+            CartItem.objects.select_for_update().filter(reserved_quantity__gt=0, reserved_until__lt=now)
+            .order_by('reserved_until').values_list('id', flat=True)[:batch_size]
+        )
+        if not item_ids:
+            return 0, 0
+        items = CartItem.objects.filter(pk__in=item_ids)
+        released = release_items(items)
+        items.update(reserved_quantity=0, reserved_until=None)
+    return len(item_ids), sum(released.values())
@@ -0,0 +1,91 @@
+import re
+from django.db import connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+from .models import Product, ProductSearchIndex
+
+
+# backends with a native full-text index on store_productsearchindex (see migration 0013)
+FULLTEXT_VENDORS = ['sqlite', 'mysql']
+
+
+# split a raw ?search= value into plain word terms, dropping any full-text operators the client sent
+def get_search_terms(text):
+    return re.findall(r'\w+', text)
+
+
+# build the backend specific MATCH query: every term must match, and each term also matches as a prefix
+def get_match_query(terms, vendor):
+    if vendor == 'sqlite':
+        return ' '.join(f'"{term}"*' for term in terms)
+    return ' '.join(f'+{term}*' for term in terms)
+
+
+# return (matching product ids, relevance) as two RawSQL expressions; a higher relevance is a better match
+def get_search_expressions(terms, using='default'):
+    connection = connections[using]
+    vendor = connection.vendor
+    table = connection.ops.quote_name(ProductSearchIndex._meta.db_table)
+    product_id = f'{connection.ops.quote_name(Product._meta.db_table)}.{connection.ops.quote_name("id")}'
+    query = get_match_query(terms, vendor)
+
+    if vendor == 'sqlite':
+        matches = RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [query])
+        rank = RawSQL(
+            f'SELECT -bm25({table}) FROM {table} WHERE {table} MATCH %s AND {table}.rowid = {product_id}',
+            [query], output_field=FloatField()
+        )
+    else:
+        match = 'MATCH (name, description, category_title) AGAINST (%s IN BOOLEAN MODE)'
+        matches = RawSQL(f'SELECT rowid FROM {table} WHERE {match}', [query])
+        rank = RawSQL(
+            f'SELECT {match} FROM {table} WHERE {match} AND {table}.rowid = {product_id}',
+            [query, query], output_field=FloatField()
+        )
+    return matches, rank
+
+
+# write (or rewrite) the index rows of the given products
+def index_products(products):
+    products = list(products)
+    if not products:
+        return
+    remove_products([product.id for product in products])
+    ProductSearchIndex.objects.bulk_create([
+        ProductSearchIndex(
+            product_id=product.id, name=product.name,
+            description=product.description, category_title=product.category.title
+        )
+        for product in products
+    ])
+
+
+# delete the index rows of the given product ids
+def remove_products(product_ids):
+    ProductSearchIndex.objects.filter(product_id__in=product_ids).delete()
+
+
+# copy a renamed category title onto the index rows of all its products
+def index_category(category):
+    product_ids = Product.objects.filter(category=category).values('id')
+    ProductSearchIndex.objects.filter(product_id__in=product_ids).update(category_title=category.title)
+
+
+# ProductSearchFilter class, a drop-in replacement for SearchFilter on ProductViewSet.
+# On SQLite (FTS5) and MySQL (FULLTEXT) the ?search= terms are matched against store_productsearchindex and the
+# results are annotated with `search_rank` and ordered by relevance, unless the client asks for an explicit ?ordering=.
+# Other database backends fall back to the icontains lookups on the view's search_fields.
+class ProductSearchFilter(SearchFilter):
+    def filter_queryset(self, request, queryset, view):
+        if connections[queryset.db].vendor not in FULLTEXT_VENDORS:
+            return super().filter_queryset(request, queryset, view)
+
+        terms = get_search_terms(' '.join(self.get_search_terms(request)))
+        if not terms:
+            return queryset
+
+        matches, rank = get_search_expressions(terms, using=queryset.db)
+        return queryset.filter(pk__in=matches)\
+            .annotate(search_rank=rank)\
+            .order_by('-search_rank', 'id')
@@ -1,8 +1,20 @@
 from decimal import Decimal
-from django.db.models import Count
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
 from rest_framework.validators import UniqueValidator
 from rest_framework import serializers
-from .models import Product, Category, Review, Cart, CartItem, Customer, ProductImage
+from rest_framework.exceptions import NotFound
+from .models import Product, Category, Review, Cart, CartItem, Customer, ProductImage, Order, OrderItem
+from .caching import invalidate_catalog
+from .fieldsets import FieldsetSerializerMixin
+from .images import enqueue_image_files_deletion, enqueue_product_image, get_srcset
+from .pricing import get_effective_price_expression
+from .reservations import get_quantity_case, get_reserved_until, release_stock, reserve_stock
 
 
 # CategorySerializer class, that gets rendered on the api endpoint for GET request: store/categories 
@@ -22,22 +34,52 @@ class CreateCategorySerializer(serializers.ModelSerializer):
 
 # ProductImageSerializer class, that handles the api endpoint for POST request: store/products/id/images 
 class ProductImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField(method_name='get_srcset')
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'width', 'height', 'srcset']
+        read_only_fields = ['width', 'height']
 
-    # override the create() method in ModelSerializer class, to add a serializer context while creating the serializer
+    # override the create() method in ModelSerializer class, to add a serializer context while creating the serializer.
+    # The resized variants are generated in the background once the upload is committed.
     def create(self, validated_data):
         product_id = self.context['product_id']
-        return ProductImage.objects.create(product_id=product_id, **validated_data)
+        product_image = ProductImage.objects.create(product_id=product_id, **validated_data)
+        enqueue_product_image(product_image.id, product_image.image.name)
+        return product_image
+
+    # override the update() method to generate the variants of a replaced image again; the files of the former image are
+    # deleted in the background (its srcset is empty until the new variants are ready)
+    def update(self, product_image, validated_data):
+        if 'image' not in validated_data:
+            return super().update(product_image, validated_data)
+        name, variants = product_image.image.name, product_image.variants
+        product_image = super().update(product_image, {**validated_data, 'width': None, 'height': None, 'variants': {}})
+        if product_image.image.name != name:
+            enqueue_product_image(product_image.id, product_image.image.name)
+            enqueue_image_files_deletion(name, variants)
+        return product_image
+
+    # custom method to return the resized variants of the image, grouped by format
+    def get_srcset(self, product_image):
+        return get_srcset(product_image, self.context.get('request'))
     
 
 # ProductSerializer class, that handles the api endpoint for GET request: store/products 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True)
+    # the price for the caller's membership tier, annotated by ProductViewSet (see store/pricing.py)
+    effective_price = serializers.DecimalField(max_digits=8, decimal_places=2, read_only=True)
+    available_quantity = serializers.IntegerField(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
     class Meta:
         model = Product
-        fields = ['id', 'name', 'price', 'description', 'images', 'stock_quantity', 'category']
+        fields = ['id', 'name', 'price', 'effective_price', 'description', 'images', 'stock_quantity', 'available_quantity', 'category', 'rating_avg', 'rating_count', 'rating_histogram']
+        expandable_fields = {'category': CategorySerializer}
+        field_sources = {
+            'available_quantity': ['stock_quantity', 'reserved_quantity'],
+            'rating_histogram': ['rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5'],
+        }
 
 
 # UpdateProductSerializer class, that handles the api endpoint for PUT request: store/products/id
@@ -47,6 +89,73 @@ class UpdateProductSerializer(serializers.ModelSerializer):
         fields = ['stock_quantity', 'price',]
 
 
+# BulkUpdateProductListSerializer class, that validates a price/stock feed row by row and applies the valid rows in bulk.
+# Invalid rows do not fail the whole request: their errors are collected in `row_errors`, keyed by their index in the feed.
+class BulkUpdateProductListSerializer(serializers.ListSerializer):
+    # override the to_internal_value() method in ListSerializer class, to keep the valid rows instead of raising on the first invalid one
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of products.']})
+        if len(data) > settings.PRODUCT_BULK_UPDATE_MAX_ROWS:
+            raise serializers.ValidationError({'non_field_errors': [f'A feed may hold at most {settings.PRODUCT_BULK_UPDATE_MAX_ROWS} products.']})
+
+        self.row_errors = []
+        rows = []
+        for index, item in enumerate(data):
+            try:
+                row = self.child.run_validation(item)
+            except serializers.ValidationError as error:
+                self.row_errors.append({'index': index, 'id': item.get('id') if isinstance(item, dict) else None, 'errors': error.detail})
+                continue
+            row['index'] = index
+            rows.append(row)
+        return rows
+
+    # override the save() method in ListSerializer class, to write the rows with one bulk UPDATE per set of changed columns and batch,
+    # so a row that only carries a price never overwrites a stock quantity changed concurrently (e.g. by a checkout)
+    def save(self, **kwargs):
+        rows = {}
+        for row in self.validated_data:
+            rows.setdefault(row['id'], {}).update(row)
+
+        with transaction.atomic():
+            existing = set(Product.objects.filter(pk__in=rows).values_list('pk', flat=True))
+            now = timezone.now()
+            groups = {}
+            for product_id, row in rows.items():
+                if product_id not in existing:
+                    self.row_errors.append({'index': row['index'], 'id': product_id, 'errors': {'id': ['Product not found.']}})
+                    continue
+                fields = tuple(field for field in ('price', 'stock_quantity') if field in row)
+                product = Product(pk=product_id, updated_at=now, **{field: row[field] for field in fields})
+                groups.setdefault(fields, []).append(product)
+
+            updated = 0
+            for fields, products in groups.items():
+                updated += Product.objects.bulk_update(products, [*fields, 'updated_at'], batch_size=settings.PRODUCT_BULK_UPDATE_BATCH_SIZE)
+            # bulk_update skips the save signals, so the cached catalog responses are invalidated here
+            if updated:
+                transaction.on_commit(invalidate_catalog)
+
+        self.row_errors.sort(key=lambda error: error['index'])
+        return updated
+
+
+# BulkUpdateProductSerializer class, that handles one row of the api endpoint for PATCH request: store/products/bulk
+class BulkUpdateProductSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField()
+    class Meta:
+        model = Product
+        fields = ['id', 'stock_quantity', 'price']
+        extra_kwargs = {'stock_quantity': {'required': False}, 'price': {'required': False}}
+        list_serializer_class = BulkUpdateProductListSerializer
+
+    def validate(self, attrs):
+        if 'stock_quantity' not in attrs and 'price' not in attrs:
+            raise serializers.ValidationError('Provide a stock_quantity, a price or both.')
+        return attrs
+
+
 # CreateProductSerializer class, that handles the api endpoint for POST request: store/products 
 class CreateProductSerializer(serializers.ModelSerializer):
     class Meta:
@@ -54,16 +163,26 @@ class CreateProductSerializer(serializers.ModelSerializer):
         fields = ['name', 'description', 'price', 'category', 'stock_quantity']
 
 
+# ReviewCustomerSerializer class, that renders the 'customer' field of a review as a nested object with ?expand=customer
+class ReviewCustomerSerializer(serializers.ModelSerializer):
+    first_name = serializers.CharField(source='user.first_name', read_only=True)
+    last_name = serializers.CharField(source='user.last_name', read_only=True)
+    class Meta:
+        model = Customer
+        fields = ['id', 'first_name', 'last_name']
+
+
 # ReviewSerializer class, that handles the api endpoint for POST request: store/products/id/reviews 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ['id', 'customer', 'summary', 'details', 'rating', 'date']
+        expandable_fields = {'customer': ReviewCustomerSerializer}
 
     # override the create() method in ModelSerializer class, to add a serializer context while creating the serializer
     def create(self, validated_data):
-        product_pk = self.context['product_pk']
-        return Review.objects.create(product_id=product_pk, **validated_data)
+        product_id = self.context['product_id']
+        return Review.objects.create(product_id=product_id, **validated_data)
     
 
 # CartItemProductSerializer class, that renders the 'product' field as a nested object in the CartItem on the api endpoint for GET request: store/cartitems/ 
@@ -76,14 +195,110 @@ class CartItemProductSerializer(serializers.ModelSerializer):
 # CartItemSerializer class, that handles the api endpoint for GET request: store/cartitems 
 class CartItemSerializer(serializers.ModelSerializer):
     product = CartItemProductSerializer() #renders product field as a nested object
-    total_price = serializers.SerializerMethodField(method_name='get_total_price')
+    # the effective price of the product and its multiple by the quantity, annotated by CartItem.objects.with_prices()
+    unit_price = serializers.DecimalField(max_digits=8, decimal_places=2, read_only=True)
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
     class Meta:
         model = CartItem
-        fields = ['id', 'product', 'quantity', 'total_price']
+        fields = ['id', 'product', 'quantity', 'unit_price', 'total_price']
 
-    # custom method to calculate the total_price of a cart item based on the quantity.
-    def get_total_price(self, cartitem):
-        return cartitem.product.price * cartitem.quantity
+
+# reserve {product_id: quantity} for cart items (see store/reservations.py), or raise a validation error naming the unknown
+# products and the ones without enough available stock
+def reserve_cart_stock(quantities):
+    unavailable = reserve_stock(quantities)
+    missing = sorted(product_id for product_id, available in unavailable.items() if available is None)
+    if missing:
+        raise serializers.ValidationError({'product_id': f'No product with the given ids: {missing}'})
+    if unavailable:
+        raise serializers.ValidationError({'quantity': [
+            f'Only {available} left of product {product_id}' for product_id, available in sorted(unavailable.items())
+        ]})
+
+
+# lock the cart the items of a request are added to, or raise a 404 when there is none. Adds to one cart (and its checkout
+# and purge, which lock it too) then run one after the other, so the items read under the lock are the ones written, and
+# an item is never inserted for a cart that is gone: its foreign key is checked only at commit on most databases.
+def lock_cart(cart_id):
+    if Cart.objects.select_for_update().filter(pk=cart_id).values_list('pk', flat=True).first() is None:
+        raise NotFound('No cart with the given id')
+
+
+# add quantity to the (cart, product) item, creating it when missing, and reserve its stock. The increment is a single
+# "quantity = quantity + n" UPDATE on the locked row. The stock to reserve depends on the part of the item whose
+# reservation expired, so the row is read first; the cart lock keeps that read and the write atomic, and a writer that
+# creates the item without the lock is caught by the unique_together constraint. The reservation covers the whole new
+# quantity of the item, and restarts its TTL.
+def upsert_cart_item(cart_id, product_id, quantity, locked=False):
+    with transaction.atomic():
+        if not locked:
+            lock_cart(cart_id)
+        cart_item = CartItem.objects.select_for_update().filter(cart_id=cart_id, product_id=product_id).first()
+        reserve = quantity if cart_item is None else cart_item.quantity + quantity - cart_item.reserved_quantity
+        reserve_cart_stock({product_id: reserve})
+        reserved_until = get_reserved_until()
+        if cart_item is None:
+            try:
+                with transaction.atomic():
+                    return CartItem.objects.create(
+                        cart_id=cart_id, product_id=product_id, quantity=quantity, reserved_quantity=quantity, reserved_until=reserved_until
+                    )
+            except IntegrityError:
+                # only the unique (cart, product) conflict is a lost race; any other failure is not retried
+                cart_item = CartItem.objects.select_for_update().filter(cart_id=cart_id, product_id=product_id).first()
+                if cart_item is None:
+                    raise
+
+        CartItem.objects.filter(pk=cart_item.pk).update(
+            quantity=F('quantity') + quantity, reserved_quantity=F('reserved_quantity') + reserve, reserved_until=reserved_until
+        )
+        cart_item.quantity += quantity
+        return cart_item
+
+
+# AddCartItemListSerializer class, that handles a batch POST request: store/carts/id/items with a list of {product_id, quantity}
+class AddCartItemListSerializer(serializers.ListSerializer):
+    # override the save() method in ListSerializer class, to upsert every item of the batch in one transaction
+    # with a constant number of queries: the cart lock (see lock_cart()), one locked read, one conditional UPDATE reserving
+    # the stock of every product (which also finds the unknown ones), one bulk UPDATE and one bulk INSERT.
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        quantities = {}
+        for item in self.validated_data:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+
+        with transaction.atomic():
+            lock_cart(cart_id)
+            existing = list(CartItem.objects.select_for_update().filter(cart_id=cart_id, product_id__in=quantities))
+            reserve = dict(quantities)
+            for cart_item in existing:
+                reserve[cart_item.product_id] += cart_item.quantity - cart_item.reserved_quantity
+            reserve_cart_stock(reserve)
+
+            reserved_until = get_reserved_until()
+            for cart_item in existing:
+                cart_item.quantity = F('quantity') + quantities[cart_item.product_id]
+                cart_item.reserved_quantity = F('reserved_quantity') + reserve[cart_item.product_id]
+                cart_item.reserved_until = reserved_until
+            CartItem.objects.bulk_update(existing, ['quantity', 'reserved_quantity', 'reserved_until'])
+
+            existing_products = {cart_item.product_id for cart_item in existing}
+            new_items = [
+                CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity, reserved_quantity=quantity, reserved_until=reserved_until)
+                for product_id, quantity in quantities.items() if product_id not in existing_products
+            ]
+            try:
+                with transaction.atomic():
+                    CartItem.objects.bulk_create(new_items)
+            except IntegrityError:
+                # a concurrent request created some of these items first, so fall back to one upsert per new item,
+                # which reserves their stock again
+                release_stock({cart_item.product_id: cart_item.quantity for cart_item in new_items})
+                for cart_item in new_items:
+                    upsert_cart_item(cart_id, cart_item.product_id, cart_item.quantity, locked=True)
+
+            self.instance = list(CartItem.objects.filter(cart_id=cart_id, product_id__in=quantities).order_by('id'))
+        return self.instance
 
 
 # AddCartItemSerializer class, that handles the api endpoint for POST request: store/cartitems 
@@ -92,28 +307,13 @@ class AddCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['id', 'product_id', 'quantity']
+        list_serializer_class = AddCartItemListSerializer
 
-    # custom method to check the existence of product_id to ensure the product exists in the database before adding it to cart.
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError('No product with the given id')
-        return value
-
-     # override the save() method in BaseSerializer class, to handle creating and updating of a model f
+    # override the save() method in BaseSerializer class, to atomically create the item or increment the quantity of an existing one
     def save(self, **kwargs):
-        product_id = self.validated_data['product_id']
-        quantity = self.validated_data['quantity']
-        cart_id = self.context['cart_id']
-        
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-            # Update an existing item if cart item object exists in the database.
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            # Create a new item if no cart item object was found
-            self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
+        self.instance = upsert_cart_item(
+            self.context['cart_id'], self.validated_data['product_id'], self.validated_data['quantity']
+        )
         return self.instance
 
 
@@ -123,10 +323,24 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['quantity']
 
+    # override the update() method in ModelSerializer class, to reserve the added stock, or release the removed stock,
+    # of the item along with the new quantity
+    def update(self, instance, validated_data):
+        quantity = validated_data['quantity']
+        with transaction.atomic():
+            reserved_quantity = CartItem.objects.select_for_update().filter(pk=instance.pk).values_list('reserved_quantity', flat=True).get()
+            if quantity > reserved_quantity:
+                reserve_cart_stock({instance.product_id: quantity - reserved_quantity})
+            else:
+                release_stock({instance.product_id: reserved_quantity - quantity})
+            CartItem.objects.filter(pk=instance.pk).update(quantity=quantity, reserved_quantity=quantity, reserved_until=get_reserved_until())
+        instance.quantity = quantity
+        return instance
+
 
 
 # CartSerializer class, that handles the api endpoint for POST request: store/carts
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     items = CartItemSerializer(many=True, read_only=True) #renders items field as a nested object
     total_price = serializers.SerializerMethodField(method_name='get_total_price')
@@ -134,13 +348,13 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ['id', 'items', 'total_price']
 
-    # custom method to calculate the total_price of all items in a cart
+    # custom method to calculate the total_price of all items in a cart, from the total prices annotated on the items
     def get_total_price(self, cart):
-        return sum(item.product.price * item.quantity for item in cart.items.all())
+        return sum(item.total_price for item in cart.items.all())
     
 
 # CustomerSerializer class, that handles the api endpoint for POST/GET requests: store/customers
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     first_name = serializers.SerializerMethodField()
     last_name = serializers.SerializerMethodField()
 
@@ -154,4 +368,97 @@ class CustomerSerializer(serializers.ModelSerializer):
     
     # custom method to return customer's last_name from the related user model
     def get_last_name(self, customer):
-        return customer.user.last_name
\ No newline at end of file
+        return customer.user.last_name
+
+
+# OrderItemSerializer class, that renders the items of an order on the api endpoint for GET request: store/orders
+class OrderItemSerializer(serializers.ModelSerializer):
+    product = CartItemProductSerializer()
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'product', 'quantity', 'unit_price', 'total_price']
+
+
+# OrderSerializer class, that handles the api endpoint for GET request: store/orders
+class OrderSerializer(serializers.ModelSerializer):
+    items = OrderItemSerializer(many=True, read_only=True)
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    class Meta:
+        model = Order
+        fields = ['id', 'customer', 'placed_at', 'payment_status', 'items', 'total_price']
+
+
+# CreateOrderSerializer class, that handles the checkout api endpoint for POST request: store/orders
+class CreateOrderSerializer(serializers.Serializer):
+    cart_id = serializers.UUIDField()
+
+    # override the save() method in BaseSerializer class, to convert a cart into an order in a single transaction:
+    # lock the cart, so a concurrent checkout of the same cart waits and then finds it gone, lock the cart's products
+    # (in id order, so concurrent checkouts can not deadlock), take their stock and the items' reservations with one
+    # conditional UPDATE, bulk create the order items with the effective prices (for the customer's membership tier)
+    # read under the lock, then delete the cart. An item whose reservation expired is sold if the stock not reserved by
+    # other carts covers it.
+    def save(self, **kwargs):
+        cart_id = self.validated_data['cart_id']
+
+        with transaction.atomic():
+            customer_id = self.context.get('customer_id')
+            membership = self.context.get('membership')
+            if customer_id is None:
+                customer_id, membership = Customer.objects.filter(user_id=self.context['user_id'])\
+                    .values_list('id', 'membership').first() or (None, None)
+            if customer_id is None:
+                raise serializers.ValidationError({'customer': 'Create a customer profile before placing an order'})
+
+            if Cart.objects.select_for_update().filter(pk=cart_id).values_list('pk', flat=True).first() is None:
+                raise serializers.ValidationError({'cart_id': 'No cart with the given id, or the cart is empty'})
+            items = CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity', 'reserved_quantity')
+            quantities = {}
+            reserved = {}
+            for product_id, quantity, reserved_quantity in items:
+                quantities[product_id] = quantity
+                reserved[product_id] = reserved_quantity
+            if not quantities:
+                raise serializers.ValidationError({'cart_id': 'No cart with the given id, or the cart is empty'})
+
+            products = Product.objects.select_for_update()\
+                .filter(pk__in=quantities)\
+                .order_by('pk')\
+                .annotate(effective_price=get_effective_price_expression(membership))\
+                .values_list('id', 'effective_price', 'stock_quantity', 'reserved_quantity')
+            prices = {}
+            out_of_stock = []
+            for product_id, price, stock_quantity, reserved_quantity in products:
+                prices[product_id] = price
+                if stock_quantity - (reserved_quantity - reserved[product_id]) < quantities[product_id]:
+                    out_of_stock.append(product_id)
+            if out_of_stock:
+                raise serializers.ValidationError({'stock_quantity': f'Not enough stock for products {out_of_stock}'})
+
+            # the stock condition is repeated in the UPDATE, so an oversell is impossible even where rows are not locked (SQLite)
+            in_stock = reduce(or_, (
+                Q(pk=product_id, stock_quantity__gte=F('reserved_quantity') - reserved[product_id] + quantity)
+                for product_id, quantity in quantities.items()
+            ))
+            updated = Product.objects.filter(in_stock).update(
+                updated_at=timezone.now(),
+                stock_quantity=F('stock_quantity') - get_quantity_case(quantities),
+                reserved_quantity=Greatest(F('reserved_quantity') - get_quantity_case(reserved), Value(0)),
+            )
+            if updated != len(quantities):
+                raise serializers.ValidationError({'stock_quantity': 'Stock changed during checkout, please try again'})
+
+            order = Order.objects.create(customer_id=customer_id)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product_id, quantity=quantity, unit_price=prices[product_id])
+                for product_id, quantity in quantities.items()
+            ])
+            # the cart lock is a no-op where rows can not be locked (SQLite): the checkout that did not delete the cart rolls back
+            _, deleted = Cart.objects.filter(pk=cart_id).delete()
+            if deleted.get(Cart._meta.label) != 1:
+                raise serializers.ValidationError({'cart_id': 'This cart was checked out already'})
+            transaction.on_commit(invalidate_catalog)
+
+        self.instance = order
+        return order
+
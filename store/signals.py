@@ -0,0 +1,80 @@
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from authsys.authentication import invalidate_user
+from .models import Category, Customer, Product, ProductImage
+from .caching import invalidate_catalog
+from .images import enqueue_image_files_deletion
+from .aggregates import adjust_products_count
+from . import search
+
+
+# keep the product search index in sync with product and category writes
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    search.remove_products([instance.id])
+
+
+@receiver(post_save, sender=Category)
+def index_saved_category(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        search.index_category(instance)
+
+
+# keep Category.products_count in step with product creates, deletes and re-categorizations
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, raw=False, **kwargs):
+    loaded_category_id = getattr(instance, '_loaded_category_id', None)
+    if created and not raw:
+        adjust_products_count(instance.category_id, 1)
+    elif loaded_category_id is not None and loaded_category_id != instance.category_id:
+        adjust_products_count(loaded_category_id, -1)
+        adjust_products_count(instance.category_id, 1)
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+    adjust_products_count(instance.category_id, -1)
+
+
+# an image change is a change of the product representation, so it moves the product's updated_at (ETag/Last-Modified)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_image_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+# delete the stored files (the upload and its variants) of a deleted product image in the background
+@receiver(post_delete, sender=ProductImage)
+def delete_image_files(sender, instance, **kwargs):
+    enqueue_image_files_deletion(instance.image.name, instance.variants)
+
+
+# drop every cached catalog response when a product, product image or category changes. The version moves once the change
+# is committed: moved earlier, a concurrent request could cache the old data under the new version.
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_cache(sender, **kwargs):
+    transaction.on_commit(invalidate_catalog)
+
+
+# the cached user of an authenticated request carries its customer profile (and its membership tier, see store/pricing.py),
+# so drop it when the profile changes, once the change is committed
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_customer_user(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_user, instance.user_id))
@@ -1,3 +1,1029 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import F, Sum
+from unittest import mock
+from urllib.parse import quote, urlencode
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.urls import URLResolver, reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from authsys.models import User
+from authsys import urls as authsys_urls
+from . import urls as store_urls
+from .models import Cart, CartItem, Category, Customer, Job, Order, OrderItem, Product, ProductImage, Review
+from .pricing import get_effective_price, get_effective_price_expression
+from .caching import get_response_items
+from .jobs import get_job_stats, job, retry_failed_jobs, run_pending_jobs
+from .reservations import release_items
+from .querybudget import QUERY_BUDGETS, count_queries, get_query_budget
+from .paginations import KeysetPagination
+from .views import ProductViewSet
 
 # Create your tests here.
+
+
+# raised to roll back the changes of a request once its queries have been counted
+class Rollback(Exception):
+    pass
+
+
+# run a block with the process-local caches of another process, as the job workers, the management commands and the other
+# web workers have
+def other_process():
+    return override_settings(CACHES={
+        alias: {**options, 'LOCATION': f'other-process-{alias}'} for alias, options in settings.CACHES.items()
+    })
+
+
+# return the names of every route in the given url patterns, e.g. {'products-list', 'products-detail', ...}
+def get_url_names(patterns):
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= get_url_names(pattern.url_patterns)
+        else:
+            names.add(pattern.name)
+    return names
+
+
+# QueryBudgetTests class, that calls every endpoint against a seeded catalog and checks its number of queries against the budget
+# declared in store/querybudget.py, then checks that list endpoints run the same queries when they return more rows
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'secret-password', is_staff=True)
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret-password', first_name='Ada', last_name='Obi')
+        cls.customer = Customer.objects.create(user=cls.user, phone='0800')
+        cls.new_customer = Customer.objects.create(user=User.objects.create_user('new-customer', 'new@example.org'))
+        cls.category = Category.objects.create(title='Computers')
+        cls.empty_category = Category.objects.create(title='Garden')
+        cls.cart = Cart.objects.create()
+        cls.empty_cart = Cart.objects.create()
+        cls.seed(3)
+        cls.product = Product.objects.order_by('id').first()
+        cls.unordered_product = Product.objects.create(name='Unordered', price=5, stock_quantity=5, category=cls.category)
+        cls.review = Review.objects.filter(product=cls.product).first()
+        cls.image = ProductImage.objects.filter(product=cls.product).first()
+        cls.cart_item = CartItem.objects.filter(cart=cls.cart).first()
+        cls.order = Order.objects.first()
+
+    # add `size` products, each with images, reviews, a cart item and an order line, so every list endpoint returns more rows
+    @classmethod
+    def seed(cls, size):
+        for _ in range(size):
+            customer_user = User.objects.create_user(f'customer{User.objects.count()}', f'c{User.objects.count()}@example.com')
+            customer = Customer.objects.create(user=customer_user)
+            product = Product.objects.create(name='Laptop', price=100, stock_quantity=50, category=cls.category)
+            for width in (320, 640):
+                ProductImage.objects.create(
+                    product=product, image=f'store/images/laptop_{width}.jpg', width=width, height=width,
+                    variants={'webp': {'160': 'store/images/variants/laptop_160w.webp'}}
+                )
+            Review.objects.create(customer=customer, product=product, summary='Good', rating=4)
+            CartItem.objects.create(cart=cls.cart, product=product, quantity=1)
+            for order_customer in (cls.customer, customer):
+                order = Order.objects.create(customer=order_customer)
+                OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=100)
+
+    def setUp(self):
+        # the response and user caches outlive the rolled back transactions of the tests, and a warm cache would hide queries
+        caches['catalog'].clear()
+        caches['auth'].clear()
+
+    def get_requests(self):
+        product, category, cart = self.product, self.category, self.cart
+        return [
+            ('api-root', 'GET', {}, None, None),
+            ('products-list', 'GET', {}, None, None),
+            ('products-list', 'POST', {}, {'name': 'Mouse', 'price': 10, 'category': category.id, 'stock_quantity': 4}, 'admin'),
+            ('products-detail', 'GET', {'pk': product.id}, None, None),
+            ('products-detail', 'PATCH', {'pk': product.id}, {'price': 90}, 'admin'),
+            ('products-detail', 'DELETE', {'pk': self.unordered_product.id}, None, 'admin'),
+            ('products-bulk-update', 'PATCH', {}, [{'id': product.id, 'price': 80}, {'id': self.unordered_product.id, 'stock_quantity': 1}], 'admin'),
+            ('product-images-list', 'GET', {'product_pk': product.id}, None, None),
+            ('product-images-detail', 'GET', {'product_pk': product.id, 'pk': self.image.id}, None, None),
+            ('product-images-detail', 'DELETE', {'product_pk': product.id, 'pk': self.image.id}, None, None),
+            ('product-reviews-list', 'GET', {'product_pk': product.id}, None, None),
+            ('product-reviews-list', 'POST', {'product_pk': product.id}, {'customer': self.customer.id, 'summary': 'Fine', 'rating': 3}, None),
+            ('product-reviews-detail', 'GET', {'product_pk': product.id, 'pk': self.review.id}, None, None),
+            ('product-reviews-detail', 'PATCH', {'product_pk': product.id, 'pk': self.review.id}, {'rating': 2}, None),
+            ('product-reviews-detail', 'DELETE', {'product_pk': product.id, 'pk': self.review.id}, None, None),
+            ('reviews-list', 'GET', {}, None, None),
+            ('reviews-detail', 'GET', {'pk': self.review.id}, None, None),
+            ('categories-list', 'GET', {}, None, None),
+            ('categories-list', 'POST', {}, {'title': 'Toys'}, 'admin'),
+            ('categories-detail', 'GET', {'pk': category.id}, None, None),
+            ('categories-detail', 'PATCH', {'pk': category.id}, {'title': 'Laptops'}, 'admin'),
+            ('categories-detail', 'DELETE', {'pk': self.empty_category.id}, None, 'admin'),
+            ('carts-list', 'POST', {}, {}, None),
+            ('carts-detail', 'GET', {'pk': cart.id}, None, None),
+            ('carts-detail', 'DELETE', {'pk': self.empty_cart.id}, None, None),
+            ('carts-summary', 'GET', {'pk': cart.id}, None, None),
+            ('cart-items-list', 'GET', {'cart_pk': cart.id}, None, None),
+            ('cart-items-list', 'POST', {'cart_pk': cart.id}, {'product_id': self.unordered_product.id, 'quantity': 2}, None),
+            ('cart-items-detail', 'GET', {'cart_pk': cart.id, 'pk': self.cart_item.id}, None, None),
+            ('cart-items-detail', 'PATCH', {'cart_pk': cart.id, 'pk': self.cart_item.id}, {'quantity': 3}, None),
+            ('cart-items-detail', 'DELETE', {'cart_pk': cart.id, 'pk': self.cart_item.id}, None, None),
+            ('customer-list', 'GET', {}, None, 'admin'),
+            ('customer-list', 'POST', {}, {'phone': '0900'}, 'admin'),
+            ('customer-detail', 'GET', {'pk': self.customer.id}, None, 'user'),
+            ('customer-detail', 'PATCH', {'pk': self.customer.id}, {'phone': '0901'}, 'user'),
+            ('customer-detail', 'DELETE', {'pk': self.new_customer.id}, None, 'admin'),
+            ('orders-list', 'GET', {}, None, 'user'),
+            ('orders-list', 'POST', {}, {'cart_id': str(cart.id)}, 'user'),
+            ('orders-detail', 'GET', {'pk': self.order.id}, None, 'user'),
+            ('cache-stats', 'GET', {}, None, 'admin'),
+            ('job-stats', 'GET', {}, None, 'admin'),
+            ('export-products', 'GET', {'file_format': 'csv'}, None, 'admin'),
+            ('export-customers', 'GET', {'file_format': 'jsonl'}, None, 'admin'),
+            ('export-orders', 'GET', {'file_format': 'jsonl'}, None, 'admin'),
+            ('async-products-list', 'GET', {}, None, None),
+            ('async-products-detail', 'GET', {'pk': product.id}, None, None),
+            ('async-categories-list', 'GET', {}, None, None),
+            ('async-carts-detail', 'GET', {'pk': cart.id}, None, None),
+            ('register', 'POST', {}, {
+                'username': 'new', 'email': 'new@example.com', 'password': 'Unusual-Pass-123',
+                'password2': 'Unusual-Pass-123', 'first_name': 'New', 'last_name': 'User'
+            }, None),
+            ('token_obtain_pair', 'POST', {}, {'username': 'buyer', 'password': 'secret-password'}, None),
+            ('token_refresh', 'POST', {}, {'refresh': str(RefreshToken.for_user(self.user))}, None),
+        ]
+
+    def get_client(self, role):
+        client = APIClient()
+        if role is not None:
+            user = self.admin if role == 'admin' else self.user
+            client.credentials(HTTP_AUTHORIZATION=f'JWT {RefreshToken.for_user(user).access_token}')
+        return client
+
+    # call one endpoint with cold caches and return (response, queries); its changes are rolled back
+    def call(self, url_name, method, kwargs, data, role):
+        url = reverse(url_name, kwargs=kwargs)
+        client = self.get_client(role)
+        caches['catalog'].clear()
+        caches['auth'].clear()
+        try:
+            with transaction.atomic():
+                with count_queries() as queries:
+                    response = getattr(client, method.lower())(url, data, format='json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                raise Rollback
+        except Rollback:
+            pass
+        return response, queries
+
+    def test_every_route_has_a_budget_and_a_request(self):
+        url_names = get_url_names(store_urls.urlpatterns) | get_url_names(authsys_urls.urlpatterns)
+        requested = {url_name for url_name, *_ in self.get_requests()}
+        self.assertEqual(url_names - set(QUERY_BUDGETS), set(), 'routes without a query budget in store/querybudget.py')
+        self.assertEqual(url_names - requested, set(), 'routes not called by QueryBudgetTests.get_requests()')
+        for url_name, method, *_ in self.get_requests():
+            self.assertIsNotNone(get_query_budget(url_name, method), f'{method} {url_name} has no query budget')
+
+    def test_endpoints_stay_within_their_query_budget(self):
+        for url_name, method, kwargs, data, role in self.get_requests():
+            with self.subTest(url_name=url_name, method=method):
+                response, queries = self.call(url_name, method, kwargs, data, role)
+                self.assertLess(response.status_code, 400, f'{method} {url_name}: {getattr(response, "data", "")}')
+                budget = get_query_budget(url_name, method)
+                self.assertLessEqual(
+                    len(queries), budget,
+                    f'{method} {url_name} ran {len(queries)} queries, over its budget of {budget}:\n{queries.format()}'
+                )
+
+    def test_read_queries_do_not_depend_on_result_size(self):
+        reads = [request for request in self.get_requests() if request[1] == 'GET']
+        before = {request[:2]: len(self.call(*request)[1]) for request in reads}
+        self.seed(5)
+        for request in reads:
+            with self.subTest(url_name=request[0]):
+                response, queries = self.call(*request)
+                self.assertEqual(
+                    len(queries), before[request[:2]],
+                    f'GET {request[0]} ran {len(queries)} queries instead of {before[request[:2]]} with more rows:\n{queries.format()}'
+                )
+
+
+# ProductValuesTests class, that checks the values() fast path of the product list renders the same bytes as ProductSerializer
+class ProductValuesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(user=User.objects.create_user('reviewer', 'reviewer@example.com'))
+        categories = [Category.objects.create(title='Desks'), Category.objects.create(title='Chairs')]
+        for number in range(20):
+            product = Product.objects.create(
+                name=f'Oak desk {number}' if number % 2 else f'Office chair {number}', price=f'{10 + number * 7 % 13}.5',
+                description=None if number % 3 else 'Solid and sturdy', stock_quantity=number, reserved_quantity=number % 4,
+                discount=f'{number % 5 * 7.5}', category=categories[number % 2]
+            )
+            for width in range(number % 3):
+                ProductImage.objects.create(
+                    product=product, image=f'store/images/product_{number}_{width}.jpg', width=640, height=480,
+                    variants={} if width else {'webp': {'640': f'store/images/variants/p{number}_640w.webp', '160': f'store/images/variants/p{number}_160w.webp'}}
+                )
+            if number % 4:
+                Review.objects.create(customer=customer, product=product, summary='Fine', rating=number % 5 + 1)
+
+    def get_content(self, url, fast):
+        caches['catalog'].clear()
+        with mock.patch.object(ProductViewSet, 'values_serializer_class', ProductViewSet.values_serializer_class if fast else None):
+            response = APIClient().get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_list_pages_are_identical_to_the_serializer_output(self):
+        queries = [
+            '', '?ordering=-price', '?ordering=rating_avg&price__gte=12', '?search=desk', '?search=nothing', '?category_id=1',
+            '?fields=id,name&ordering=-price', '?fields=images,rating_histogram&search=desk',
+            '?ordering=-effective_price&effective_price__lte=15', '?fields=id&ordering=effective_price',
+        ]
+        for query in queries:
+            url = f'/store/products/{query}'
+            pages = 0
+            while url and pages < 3:
+                with self.subTest(url=url):
+                    content = self.get_content(url, fast=True)
+                    self.assertEqual(content, self.get_content(url, fast=False))
+                url = json.loads(content)['next']
+                pages += 1
+
+
+# KeysetPaginationTests class, that walks the product pages forwards and backwards through their cursors, and checks
+# tampered cursors are rejected
+@mock.patch.object(KeysetPagination, 'page_size', 2)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Cups')
+        # equal prices, so the pages rely on the id tie-breaker
+        for number, price in enumerate([3, 1, 2, 1, 3]):
+            Product.objects.create(name=f'Cup {number}', price=price, stock_quantity=1, category=category)
+
+    def get(self, url):
+        caches['catalog'].clear()
+        response = APIClient().get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_are_walked_in_both_directions(self):
+        expected = list(Product.objects.order_by('price', 'id').values_list('name', flat=True))
+        pages = [self.get('/store/products/?ordering=price&fields=name')]
+        while pages[-1]['next']:
+            pages.append(self.get(pages[-1]['next']))
+        self.assertEqual([[product['name'] for product in page['results']] for page in pages], [expected[0:2], expected[2:4], expected[4:]])
+        self.assertIsNone(pages[0]['previous'])
+
+        backwards = [pages[-1]]
+        while backwards[-1]['previous']:
+            backwards.append(self.get(backwards[-1]['previous']))
+        self.assertEqual([[product['name'] for product in page['results']] for page in backwards], [expected[4:], expected[2:4], expected[0:2]])
+
+    def test_tampered_cursors_are_rejected(self):
+        def encode(**params):
+            return base64.b64encode(urlencode(params).encode()).decode()
+
+        cursors = ['not-base64!', encode(p='not json'), encode(p='["1"]'), encode(p='["cheap", "1"]'), encode(p='{"price": 1}')]
+        for cursor in cursors:
+            for url in ['/store/products/', '/store/async/products/']:
+                with self.subTest(cursor=cursor, url=url):
+                    response = APIClient().get(f'{url}?ordering=price&cursor={quote(cursor)}')
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('cursor', response.json())
+
+
+# SearchIndexTests class, that checks the product search follows product edits, category renames and deletions
+class SearchIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', is_staff=True)
+        cls.category = Category.objects.create(title='Lighting')
+        cls.product = Product.objects.create(name='Desk lamp', description='Warm light', price=20, stock_quantity=3, category=cls.category)
+        Product.objects.create(name='Rug', price=40, stock_quantity=1, category=Category.objects.create(title='Floor'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def search(self, text):
+        caches['catalog'].clear()
+        return [product['name'] for product in self.client.get(f'/store/products/?search={text}&fields=name').json()['results']]
+
+    def test_the_index_follows_the_catalog_writes(self):
+        self.assertEqual(self.search('lamp'), ['Desk lamp'])
+
+        # the product API only edits prices and stock: the name changes through the admin or an import
+        self.product.name = 'Desk torch'
+        self.product.save()
+        self.assertEqual((self.search('lamp'), self.search('torch')), ([], ['Desk torch']))
+
+        response = self.client.patch(f'/store/categories/{self.category.id}/', {'title': 'Outdoor'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self.search('lighting'), self.search('outdoor')), ([], ['Desk torch']))
+
+        self.assertEqual(self.client.delete(f'/store/products/{self.product.id}/').status_code, 204)
+        self.assertEqual((self.search('torch'), self.search('rug')), ([], ['Rug']))
+
+
+# RatingTests class, that checks the rating counters of a product follow the creation, edit and deletion of its reviews
+class RatingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(user=User.objects.create_user('critic', 'critic@example.com'))
+        cls.product = Product.objects.create(name='Kettle', price=25, stock_quantity=4, category=Category.objects.create(title='Kitchen'))
+
+    def get_ratings(self):
+        product = Product.objects.get(pk=self.product.pk)
+        return str(product.rating_avg), product.rating_count, product.rating_histogram
+
+    def test_counters_follow_review_edits_and_deletions(self):
+        client = APIClient()
+        url = f'/store/products/{self.product.id}/reviews/'
+        review_ids = [
+            client.post(url, {'customer': self.customer.id, 'summary': 'Fine', 'rating': rating}, format='json').json()['id']
+            for rating in [5, 2]
+        ]
+        self.assertEqual(self.get_ratings(), ('3.50', 2, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1}))
+
+        self.assertEqual(client.patch(f'{url}{review_ids[1]}/', {'rating': 4}, format='json').status_code, 200)
+        self.assertEqual(self.get_ratings(), ('4.50', 2, {'1': 0, '2': 0, '3': 0, '4': 1, '5': 1}))
+
+        self.assertEqual(client.delete(f'{url}{review_ids[0]}/').status_code, 204)
+        self.assertEqual(self.get_ratings(), ('4.00', 1, {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0}))
+
+        # the maintained counters agree with a full recomputation
+        call_command('recompute_ratings', stdout=io.StringIO())
+        self.assertEqual(self.get_ratings(), ('4.00', 1, {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0}))
+
+
+# ProductsCountTests class, that checks the products_count of the categories follows product creations, moves and deletions
+class ProductsCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', is_staff=True)
+        cls.tables = Category.objects.create(title='Tables')
+        cls.chairs = Category.objects.create(title='Chairs')
+
+    def get_counts(self):
+        caches['catalog'].clear()
+        return {category['title']: category['products_count'] for category in APIClient().get('/store/categories/').json()['results']}
+
+    def test_counts_follow_products_between_categories(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        for name in ['Desk', 'Stool']:
+            data = {'name': name, 'price': 50, 'stock_quantity': 2, 'category': self.tables.id}
+            self.assertEqual(client.post('/store/products/', data, format='json').status_code, 201)
+        self.assertEqual(self.get_counts(), {'Chairs': 0, 'Tables': 2})
+
+        stool = Product.objects.get(name='Stool')
+        stool.category = self.chairs
+        stool.save()
+        # saving again without a move changes nothing
+        stool.save()
+        self.assertEqual(self.get_counts(), {'Chairs': 1, 'Tables': 1})
+
+        self.assertEqual(client.delete(f'/store/products/{stool.id}/').status_code, 204)
+        self.assertEqual(self.get_counts(), {'Chairs': 0, 'Tables': 1})
+        # the emptied category can be deleted again
+        self.assertEqual(client.delete(f'/store/categories/{self.chairs.id}/').status_code, 204)
+
+
+# BulkUpdateTests class, that checks a price/stock feed applies its valid rows, merges the rows of one product and reports
+# the invalid ones by their index
+class BulkUpdateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', is_staff=True)
+        category = Category.objects.create(title='Pans')
+        cls.pan = Product.objects.create(name='Pan', price=30, stock_quantity=5, category=category)
+        cls.pot = Product.objects.create(name='Pot', price=40, stock_quantity=6, category=category)
+
+    def test_feed_rows_are_applied_or_reported_one_by_one(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        feed = [
+            {'id': self.pan.id, 'price': '29.50'},
+            {'id': self.pot.id, 'price': '-1'},
+            {'id': self.pan.id, 'stock_quantity': 8},
+            {'id': 0, 'stock_quantity': 1},
+            {'id': self.pot.id},
+            {'id': self.pan.id, 'price': '28.00'},
+        ]
+        response = client.patch('/store/products/bulk/', feed, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual([(error['index'], error['id'], sorted(error['errors'])) for error in response.json()['errors']], [
+            (1, self.pot.id, ['price']), (3, 0, ['id']), (4, self.pot.id, ['non_field_errors']),
+        ])
+        # the rows of one product are merged, the last price winning; the invalid rows changed nothing
+        self.assertEqual(
+            list(Product.objects.order_by('id').values_list('price', 'stock_quantity')), [(Decimal('28.00'), 8), (Decimal('40.00'), 6)]
+        )
+
+
+# AuthCacheTests class, that checks the users of JWT requests are served from the user cache until they change
+class AuthCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret')
+        Customer.objects.create(user=cls.user)
+
+    def get(self, client):
+        with count_queries() as queries:
+            response = client.get('/store/customers/')
+        # the queries resolving the user of the token, rather than the customers listed with their users
+        return response.status_code, sum('FROM "authsys_user"' in sql for sql in queries)
+
+    # user ids are reused once a test rolls back, so no cached user outlives its test
+    def setUp(self):
+        caches['auth'].clear()
+        self.addCleanup(caches['auth'].clear)
+
+    def test_deactivated_users_are_rejected_once_committed(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'JWT {RefreshToken.for_user(self.user).access_token}')
+        self.assertEqual(self.get(client), (200, 1))
+        self.assertEqual(self.get(client), (200, 0))
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+            self.assertEqual(self.get(client)[0], 200)
+        self.assertEqual(self.get(client), (401, 1))
+
+
+# FieldsetTests class, that checks ?fields= and ?expand= shape the responses and shrink the queries behind them
+class FieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', first_name='Ada', last_name='Obi')
+        cls.customer = Customer.objects.create(user=cls.user, phone='0800')
+        cls.category = Category.objects.create(title='Lamps')
+        cls.product = Product.objects.create(name='Desk lamp', description='Bright', price=20, stock_quantity=3, category=cls.category)
+        ProductImage.objects.create(product=cls.product, image='store/images/lamp.jpg')
+        Review.objects.create(customer=cls.customer, product=cls.product, summary='Good', rating=5)
+        cls.cart = Cart.objects.create()
+        CartItem.objects.create(cart=cls.cart, product=cls.product, quantity=2)
+
+    def get(self, url, user=None):
+        caches['catalog'].clear()
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        with count_queries() as queries:
+            response = client.get(url)
+        return response, queries
+
+    def test_fields_select_the_rendered_fields_and_their_queries(self):
+        response, queries = self.get('/store/products/?fields=id,name,price')
+        self.assertEqual(response.json()['results'], [{'id': self.product.id, 'name': 'Desk lamp', 'price': 20.0}])
+        self.assertFalse(any('store_productimage' in sql or '"description"' in sql for sql in queries))
+
+        response, queries = self.get(f'/store/products/{self.product.id}/?fields=id,images.image')
+        self.assertEqual(response.json(), {'id': self.product.id, 'images': [{'image': 'http://testserver/media/store/images/lamp.jpg'}]})
+
+        response, queries = self.get(f'/store/carts/{self.cart.id}/?fields=id')
+        self.assertEqual(response.json(), {'id': str(self.cart.id)})
+        self.assertFalse(any('store_cartitem' in sql for sql in queries))
+
+        response, queries = self.get('/store/customers/?fields=id,phone', user=self.user)
+        self.assertEqual(response.json(), [{'id': self.customer.id, 'phone': '0800'}])
+        self.assertFalse(any('authsys_user' in sql for sql in queries))
+
+    def test_expand_renders_related_objects(self):
+        response, queries = self.get(f'/store/products/{self.product.id}/?fields=id&expand=category')
+        self.assertEqual(response.json(), {'id': self.product.id, 'category': {'id': self.category.id, 'title': 'Lamps', 'products_count': 1}})
+
+        response, queries = self.get(f'/store/products/{self.product.id}/reviews/?fields=rating&expand=customer')
+        self.assertEqual(response.json()['results'], [{'customer': {'id': self.customer.id, 'first_name': 'Ada', 'last_name': 'Obi'}, 'rating': 5}])
+        self.assertEqual(len(queries), 1)
+
+    def test_unknown_fields_and_expansions_are_rejected(self):
+        for url in ['/store/products/?fields=id,colour', '/store/products/?expand=images', '/store/reviews/?fields=rating.value']:
+            with self.subTest(url=url):
+                response, queries = self.get(url)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(len(queries), 0)
+
+
+# AsyncViewTests class, that checks the async endpoints answer with the same JSON as their sync counterparts
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = category = Category.objects.create(title='Lamps')
+        for number in range(20):
+            product = Product.objects.create(name=f'Lamp {number}', price=f'{10 + number * 7 % 13}.5', stock_quantity=number, category=category)
+            ProductImage.objects.create(product=product, image=f'store/images/lamp_{number}.jpg', width=640, height=480)
+        cls.product = product
+        cls.cart = Cart.objects.create()
+        CartItem.objects.create(cart=cls.cart, product=product, quantity=3)
+
+    def get(self, url):
+        caches['catalog'].clear()
+        response = APIClient().get(url)
+        return response.status_code, response.content.replace(b'/store/async/', b'/store/')
+
+    def test_async_responses_are_identical_to_the_sync_ones(self):
+        queries = [
+            'products/', f'products/?ordering=-price&category_id={self.category.id}', 'products/?fields=id,name', 'products/?search=lamp',
+            f'products/{self.product.id}/', 'products/0/', 'products/?fields=colour', 'categories/',
+            f'carts/{self.cart.id}/', f'carts/{uuid.uuid4()}/',
+        ]
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertEqual(self.get(f'/store/async/{query}'), self.get(f'/store/{query}'))
+
+    def test_async_endpoints_are_read_only(self):
+        response = APIClient().post('/store/async/products/', {'name': 'Lamp'}, format='json')
+        self.assertEqual(response.status_code, 405)
+
+
+# tasks of JobTests: record their calls, and fail while `failures` is positive
+calls = []
+
+
+@job(max_attempts=2)
+def record_call(value, failures=0):
+    calls.append(value)
+    if len(calls) <= failures:
+        raise RuntimeError(f'failure {len(calls)}')
+
+
+# AsyncQueryCountTests class, that checks the queries of the async ORM are counted under a real event loop, as under an ASGI
+# server, where they run on the connection of another thread
+class AsyncQueryCountTests(TransactionTestCase):
+    def test_queries_of_the_async_orm_are_counted(self):
+        async def run_queries():
+            with count_queries() as queries:
+                await Category.objects.acount()
+                [category async for category in Category.objects.all()]
+            return len(queries)
+        self.assertEqual(asyncio.run(run_queries()), 2)
+
+    # the middleware stack of e_commerce/asgi.py, all async
+    @override_settings(MIDDLEWARE=[name for name in settings.MIDDLEWARE if name not in settings.SYNC_ONLY_MIDDLEWARE])
+    def test_async_views_report_their_queries(self):
+        from django.core.handlers.asgi import ASGIHandler
+        messages = []
+        received = []
+
+        async def receive():
+            if not received:
+                received.append(True)
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # the client stays connected until the response is sent
+            await asyncio.Event().wait()
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': '/store/async/categories/', 'raw_path': b'/store/async/categories/', 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        asyncio.run(ASGIHandler()(scope, receive, send))
+        headers = dict(messages[0]['headers'])
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn(b'desc="1 queries"', headers[b'Server-Timing'])
+
+
+# JobTests class, that checks the background jobs run once per idempotency key, and are retried then failed on errors
+class JobTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_jobs_run_once_per_key(self):
+        first = record_call.enqueue(['a'], key='record:a')
+        self.assertEqual(record_call.enqueue(['a'], key='record:a'), first)
+        record_call.delay('b')
+        self.assertEqual(calls, [])
+
+        self.assertEqual(run_pending_jobs(), 2)
+        self.assertEqual(sorted(calls), ['a', 'b'])
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {Job.STATUS_DONE})
+        self.assertEqual(run_pending_jobs(), 0)
+
+    def test_failed_jobs_are_retried_with_backoff_then_failed(self):
+        record_call.delay('c', failures=2)
+        with self.assertLogs('store.jobs', 'ERROR'):
+            self.assertEqual(run_pending_jobs(), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_PENDING, 1))
+        self.assertGreater(job.run_at, job.started_at)
+        self.assertIn('RuntimeError: failure 1', job.last_error)
+
+        # the retry is not run before its backoff delay
+        self.assertEqual(run_pending_jobs(), 0)
+        Job.objects.update(run_at=job.started_at)
+        with self.assertLogs('store.jobs', 'ERROR'):
+            self.assertEqual(run_pending_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 2))
+        stats = get_job_stats()
+        self.assertEqual((stats['failed'], stats['recent_failures'][0]['id']), (1, job.id))
+
+        self.assertEqual(retry_failed_jobs(), 1)
+        self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(Job.objects.get().status, Job.STATUS_DONE)
+        self.assertEqual(calls, ['c', 'c', 'c'])
+
+
+# ImageTests class, that checks the variants of product images sharing a file name stay apart, are generated again for a
+# replaced image, and are deleted with their image
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), PRODUCT_IMAGE_VARIANT_WIDTHS=[2], PRODUCT_IMAGE_VARIANT_FORMATS=['webp'])
+class ImageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Lamps')
+        cls.products = [Product.objects.create(name=f'Lamp {i}', price=10, stock_quantity=1, category=category) for i in range(2)]
+
+    def upload(self, method, url, color):
+        from PIL import Image
+        file = io.BytesIO()
+        Image.new('RGB', (4, 4), color).save(file, 'PNG')
+        file.name = 'a.png'
+        file.seek(0)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(APIClient(), method)(url, {'image': file}, format='multipart')
+        self.assertIn(response.status_code, (200, 201))
+        run_pending_jobs()
+        return ProductImage.objects.get(pk=response.data['id'])
+
+    def test_variants_follow_their_image(self):
+        from django.core.files.storage import default_storage
+        first, second = [self.upload('post', f'/store/products/{product.id}/images/', 'red') for product in self.products]
+        first_variant, second_variant = first.variants['webp']['2'], second.variants['webp']['2']
+        self.assertNotEqual(first_variant, second_variant)
+        self.assertTrue(default_storage.exists(first_variant) and default_storage.exists(second_variant))
+
+        replaced = self.upload('patch', f'/store/products/{self.products[0].id}/images/{first.id}/', 'blue')
+        self.assertNotEqual(replaced.variants['webp']['2'], first_variant)
+        self.assertEqual(replaced.width, 4)
+        self.assertFalse(default_storage.exists(first.image.name) or default_storage.exists(first_variant))
+        self.assertTrue(default_storage.exists(second_variant))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            APIClient().delete(f'/store/products/{self.products[0].id}/images/{first.id}/')
+        run_pending_jobs()
+        self.assertFalse(default_storage.exists(replaced.image.name) or default_storage.exists(replaced.variants['webp']['2']))
+        self.assertTrue(default_storage.exists(second.image.name) and default_storage.exists(second_variant))
+
+
+# CartSummaryTests class, that checks the summary of a cart, its ETag, and the 404 of a missing or malformed cart id
+class CartSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='Mugs')
+        cls.product = Product.objects.create(name='Mug', price='4.50', stock_quantity=9, category=category)
+        cls.cart = Cart.objects.create()
+        CartItem.objects.create(cart=cls.cart, product=cls.product, quantity=2)
+
+    def test_summary_counts_the_items_of_the_cart(self):
+        client = APIClient()
+        response = client.get(f'/store/carts/{self.cart.id}/summary/')
+        self.assertEqual(response.json(), {'id': str(self.cart.id), 'item_count': 2, 'total_price': 9.0})
+        self.assertEqual(client.get(f'/store/carts/{self.cart.id}/summary/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_summary_of_a_missing_cart_is_not_found(self):
+        for cart_id in [uuid.uuid4(), 'not-a-uuid']:
+            with self.subTest(cart_id=cart_id):
+                self.assertEqual(APIClient().get(f'/store/carts/{cart_id}/summary/').status_code, 404)
+                self.assertEqual(APIClient().get(f'/store/carts/{cart_id}/').status_code, 404)
+
+
+# ReservationTests class, that checks cart items reserve stock, and give it back when removed, checked out or expired
+class ReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com')
+        Customer.objects.create(user=cls.user)
+        category = Category.objects.create(title='Lamps')
+        cls.lamp = Product.objects.create(name='Lamp', price=20, stock_quantity=5, category=category)
+        cls.bulb = Product.objects.create(name='Bulb', price=2, stock_quantity=1, category=category)
+        cls.cart = Cart.objects.create()
+        cls.other_cart = Cart.objects.create()
+
+    def add(self, cart, data):
+        return APIClient().post(f'/store/carts/{cart.id}/items/', data, format='json')
+
+    def get_available(self, product):
+        caches['catalog'].clear()
+        return APIClient().get(f'/store/products/{product.id}/').json()['available_quantity']
+
+    def test_cart_items_reserve_stock(self):
+        self.assertEqual(self.add(self.cart, {'product_id': self.lamp.id, 'quantity': 3}).status_code, 201)
+        self.assertEqual(self.get_available(self.lamp), 2)
+
+        response = self.add(self.other_cart, {'product_id': self.lamp.id, 'quantity': 3})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'quantity': [f'Only 2 left of product {self.lamp.id}']})
+
+        # a batch with one short product reserves nothing
+        response = self.add(self.other_cart, [{'product_id': self.lamp.id, 'quantity': 2}, {'product_id': self.bulb.id, 'quantity': 2}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((self.get_available(self.lamp), self.get_available(self.bulb)), (2, 1))
+        self.assertFalse(self.other_cart.items.exists())
+
+        item = self.cart.items.get()
+        self.assertEqual(APIClient().patch(f'/store/carts/{self.cart.id}/items/{item.id}/', {'quantity': 1}, format='json').status_code, 200)
+        self.assertEqual(self.get_available(self.lamp), 4)
+        self.assertEqual(APIClient().delete(f'/store/carts/{self.cart.id}/items/{item.id}/').status_code, 204)
+        self.assertEqual(self.get_available(self.lamp), 5)
+
+    def test_items_of_a_missing_cart_are_not_found(self):
+        missing = Cart(id=uuid.uuid4())
+        self.assertEqual(self.add(missing, {'product_id': self.lamp.id, 'quantity': 1}).status_code, 404)
+        self.assertEqual(self.add(missing, [{'product_id': self.lamp.id, 'quantity': 1}]).status_code, 404)
+        self.assertEqual((CartItem.objects.count(), self.get_available(self.lamp)), (0, 5))
+
+    def test_checkout_takes_the_reservations(self):
+        self.add(self.cart, [{'product_id': self.lamp.id, 'quantity': 4}, {'product_id': self.bulb.id, 'quantity': 1}])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.post('/store/orders/', {'cart_id': str(self.cart.id)}, format='json').status_code, 201)
+        self.assertEqual(
+            list(Product.objects.order_by('id').values_list('stock_quantity', 'reserved_quantity')), [(1, 0), (0, 0)]
+        )
+        # a second checkout of the same cart finds it gone
+        self.assertEqual(client.post('/store/orders/', {'cart_id': str(self.cart.id)}, format='json').status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_reservations_are_released(self):
+        self.add(self.cart, {'product_id': self.lamp.id, 'quantity': 5})
+        self.assertEqual(self.add(self.other_cart, {'product_id': self.lamp.id, 'quantity': 1}).status_code, 400)
+
+        CartItem.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+        call_command('release_reservations', sleep=0, stdout=io.StringIO())
+        self.assertEqual(self.get_available(self.lamp), 5)
+        self.assertEqual(self.add(self.other_cart, {'product_id': self.lamp.id, 'quantity': 4}).status_code, 201)
+
+        # the released item is still in its cart, and checks out from the stock other carts leave
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/store/orders/', {'cart_id': str(self.cart.id)}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'stock_quantity': f'Not enough stock for products {[self.lamp.id]}'})
+
+    def test_expired_carts_are_purged_in_batches(self):
+        carts = [Cart.objects.create() for _ in range(5)]
+        for cart in carts:
+            self.add(cart, {'product_id': self.lamp.id, 'quantity': 1})
+        self.add(self.cart, {'product_id': self.bulb.id, 'quantity': 1})
+        Cart.objects.filter(pk__in=[cart.pk for cart in carts]).update(last_activity=timezone.now() - settings.CART_IDLE_TTL - timedelta(seconds=1))
+
+        stdout = io.StringIO()
+        call_command('purge_carts', batch_size=2, sleep=0, stdout=stdout)
+        self.assertIn('Deleted 5 carts and 5 cart items in 3 batches', stdout.getvalue())
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {self.cart.pk, self.other_cart.pk})
+        self.assertEqual((self.get_available(self.lamp), self.get_available(self.bulb)), (5, 0))
+
+    def test_purged_carts_release_their_reservations_once(self):
+        self.add(self.cart, {'product_id': self.lamp.id, 'quantity': 2})
+        self.add(self.other_cart, {'product_id': self.lamp.id, 'quantity': 1})
+        Cart.objects.update(last_activity=timezone.now() - settings.CART_IDLE_TTL - timedelta(seconds=1))
+
+        # a cart touched once its reservations are released is deleted with the batch it was locked in, rather than kept
+        # with items that still count a reservation the product gave back
+        def release_and_touch(items):
+            released = release_items(items)
+            Cart.objects.filter(pk=self.other_cart.pk).touch()
+            return released
+        with mock.patch('store.management.commands.purge_carts.release_items', release_and_touch):
+            call_command('purge_carts', sleep=0, stdout=io.StringIO())
+        reserved = CartItem.objects.filter(product=self.lamp).aggregate(total=Sum('reserved_quantity'))['total'] or 0
+        self.assertEqual(Product.objects.get(pk=self.lamp.pk).reserved_quantity, reserved)
+
+
+# ConditionalGetTests class, that checks list validators come from the catalog version shared by every process, read in one query
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Clocks')
+        cls.product = Product.objects.create(name='Clock', price=30, stock_quantity=4, category=cls.category)
+
+    # the catalog version rolls back with each test, unlike the responses cached under the versions it had
+    def setUp(self):
+        caches['catalog'].clear()
+
+    def test_lists_answer_not_modified_until_the_catalog_changes(self):
+        client = APIClient()
+        # the available stock of the products is read live from the product rows, in one more query
+        for url, queries_count in [('/store/categories/', 1), ('/store/products/?category_id=1', 2)]:
+            with self.subTest(url=url):
+                etag = client.get(url)['ETag']
+                with count_queries() as queries:
+                    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual((response.status_code, len(queries)), (304, queries_count))
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.product.save()
+                    # the catalog version only moves once the change is committed
+                    self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_reservations_keep_the_catalog_cache(self):
+        client = APIClient()
+        for url in ['/store/products/', f'/store/products/{self.product.id}/']:
+            with self.subTest(url=url):
+                caches['catalog'].clear()
+                etag = client.get(url)['ETag']
+                Product.objects.update(reserved_quantity=F('reserved_quantity') + 1)
+                with count_queries() as queries:
+                    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+                # a cache hit (the catalog version, then the availability), with the new availability and ETag
+                self.assertEqual((response.status_code, len(queries)), (200, 2))
+                self.assertEqual(get_response_items(response.data)[0]['available_quantity'], Product.objects.get().available_quantity)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_lists_are_modified_by_the_writes_of_other_processes(self):
+        client = APIClient()
+        etag = client.get('/store/categories/')['ETag']
+        with other_process(), self.captureOnCommitCallbacks(execute=True):
+            self.category.title = 'Alarm clocks'
+            self.category.save()
+        response = client.get('/store/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['title'], 'Alarm clocks')
+
+    def test_writes_of_other_processes_reach_the_cached_responses(self):
+        client = APIClient()
+        self.assertEqual(client.get('/store/categories/').json()['results'][0]['title'], 'Clocks')
+        with other_process(), self.captureOnCommitCallbacks(execute=True):
+            self.category.title = 'Watches'
+            self.category.save()
+        self.assertEqual(client.get('/store/categories/').json()['results'][0]['title'], 'Watches')
+
+
+# MetricsTests class, that checks /metrics is only served to scrapers holding the token, or to internal clients without one
+class MetricsTests(TestCase):
+    def test_metrics_are_denied_by_default(self):
+        with override_settings(METRICS_TOKEN=None, INTERNAL_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret', REMOTE_ADDR='203.0.113.7').status_code, 200)
+
+
+# ExportTests class, that checks the exports read every row through their keyset batches
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', is_staff=True)
+        customer = Customer.objects.create(user=cls.admin)
+        category = Category.objects.create(title='Pens')
+        products = [Product.objects.create(name=f'Pen {number}', price=2, stock_quantity=9, category=category) for number in range(5)]
+        for number in range(5):
+            order = Order.objects.create(customer=customer)
+            for product in products[:number]:
+                OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=2)
+
+    def export(self, name):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        with mock.patch('store.exports.EXPORT_CHUNK_SIZE', 2), count_queries() as queries:
+            lines = b''.join(client.get(f'/store/export/{name}.jsonl').streaming_content).decode().splitlines()
+        return [json.loads(line) for line in lines], queries
+
+    def test_exports_are_read_in_batches(self):
+        products, queries = self.export('products')
+        self.assertEqual([product['name'] for product in products], [f'Pen {number}' for number in range(5)])
+        self.assertEqual(len(queries), 3)
+
+        orders, _ = self.export('orders')
+        self.assertEqual([len(order['items']) for order in orders], [0, 1, 2, 3, 4])
+        self.assertEqual([order['total'] for order in orders], ['0.00', '2.00', '4.00', '6.00', '8.00'])
+
+
+# ImportTests class, that checks a re-import through the import_catalog command only overwrites the columns of its source
+class ImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('admin', 'admin@example.com', 'secret', is_staff=True)
+        category = Category.objects.create(title='Vases')
+        cls.product = Product.objects.create(name='Vase', price='12.50', discount='10.00', stock_quantity=3, category=category)
+
+    def import_file(self, name, content):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, name)
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(content)
+            stderr = io.StringIO()
+            call_command('import_catalog', path, stdout=io.StringIO(), stderr=stderr)
+        return stderr.getvalue()
+
+    def test_partial_files_update_only_their_columns(self):
+        self.import_file('products.csv', f'id,stock_quantity\n{self.product.id},7\n')
+        product = Product.objects.get()
+        self.assertEqual((product.name, str(product.price), str(product.discount), product.stock_quantity), ('Vase', '12.50', '10.00', 7))
+
+        self.import_file('users.jsonl', '{"username": "admin", "email": "new@example.com"}\n')
+        user = User.objects.get()
+        self.assertEqual(user.email, 'new@example.com')
+        self.assertTrue(user.is_staff and user.is_active and user.check_password('secret'))
+
+        # a new row must still come with the columns it can not do without
+        errors = self.import_file('products.csv', 'name,price,stock_quantity\nJug,4.00,2\n')
+        self.assertIn('category', errors)
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_rows_without_ids_are_matched_by_their_natural_key(self):
+        content = 'name,category_title,price,stock_quantity\nVase,Vases,14.00,5\nJug,Vases,4.00,2\n'
+        self.assertEqual(self.import_file('products.csv', content), '')
+        self.assertEqual(self.import_file('products.csv', content), '')
+        self.assertEqual(
+            list(Product.objects.order_by('id').values_list('id', 'name', 'price', 'stock_quantity')),
+            [(self.product.id, 'Vase', Decimal('14.00'), 5), (self.product.id + 1, 'Jug', Decimal('4.00'), 2)]
+        )
+
+
+# PricingTests class, that checks the effective prices computed in SQL against the Python reference, and their use by the
+# catalog, the carts and the checkout for every membership tier
+class PricingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('gold', 'gold@example.com')
+        Customer.objects.create(user=cls.user, membership=Customer.MEMBERSHIP_GOLD)
+        category = Category.objects.create(title='Rugs')
+        prices = ['0.05', '0.15', '1.00', '9.99', '10.05', '19.95', '333.33', '9999.99']
+        discounts = [None, '0', '0.50', '2.50', '12.50', '33.33', '99.99', '100']
+        cls.products = [
+            Product.objects.create(name=f'Rug {index}', price=price, discount=discount, stock_quantity=10, category=category)
+            for index, (price, discount) in enumerate((price, discount) for price in prices for discount in discounts)
+        ]
+        cls.cart = Cart.objects.create()
+
+    def get_client(self, user=None):
+        caches['catalog'].clear()
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+    def test_sql_prices_equal_the_python_reference(self):
+        for membership in [None, *dict(Customer.MEMBERSHIP_CHOICES)]:
+            rows = Product.objects.annotate(effective_price=get_effective_price_expression(membership))\
+                .values_list('price', 'discount', 'effective_price')
+            for price, discount, effective_price in rows:
+                with self.subTest(membership=membership, price=price, discount=discount):
+                    self.assertEqual(effective_price, get_effective_price(price, discount, membership))
+
+    def test_catalog_prices_depend_on_the_membership(self):
+        product = self.products[12]
+        url = f'/store/products/{product.id}/'
+        response = self.get_client(self.user).get(url)
+        self.assertEqual(response.json()['effective_price'], float(get_effective_price(product.price, product.discount, 'G')))
+        self.assertIn('Authorization', response['Vary'])
+        # the gold price is cached apart from the public one
+        self.assertEqual(APIClient().get(url).json()['effective_price'], float(product.discounted_price))
+
+        response = self.get_client().get('/store/products/?ordering=effective_price&effective_price__gte=5&effective_price__lte=100')
+        prices = [item['effective_price'] for item in response.json()['results']]
+        self.assertEqual(prices, sorted(prices))
+        self.assertTrue(prices and all(5 <= price <= 100 for price in prices))
+
+    def test_membership_changes_reach_the_cached_user_once_committed(self):
+        product = self.products[12]
+        url = f'/store/products/{product.id}/'
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'JWT {RefreshToken.for_user(self.user).access_token}')
+        gold_price = float(get_effective_price(product.price, product.discount, 'G'))
+        self.assertEqual(client.get(url).json()['effective_price'], gold_price)
+
+        customer = Customer.objects.get(user=self.user)
+        customer.membership = Customer.MEMBERSHIP_BRONZE
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.save()
+            # the cached user is only dropped once the change is committed
+            caches['catalog'].clear()
+            self.assertEqual(client.get(url).json()['effective_price'], gold_price)
+        caches['catalog'].clear()
+        self.assertEqual(client.get(url).json()['effective_price'], float(product.discounted_price))
+
+    def test_carts_and_orders_use_the_effective_prices(self):
+        rug = self.products[13]
+        APIClient().post(f'/store/carts/{self.cart.id}/items/', {'product_id': rug.id, 'quantity': 3}, format='json')
+        unit_price = get_effective_price(rug.price, rug.discount, 'G')
+
+        client = self.get_client(self.user)
+        cart = client.get(f'/store/carts/{self.cart.id}/').json()
+        self.assertEqual((cart['items'][0]['unit_price'], cart['total_price']), (float(unit_price), float(unit_price * 3)))
+        self.assertEqual(APIClient().get(f'/store/carts/{self.cart.id}/').json()['total_price'], float(rug.discounted_price * 3))
+        self.assertEqual(client.get(f'/store/carts/{self.cart.id}/summary/').json()['total_price'], float(unit_price * 3))
+
+        self.assertEqual(client.post('/store/orders/', {'cart_id': str(self.cart.id)}, format='json').status_code, 201)
+        self.assertEqual(OrderItem.objects.get().unit_price, unit_price)
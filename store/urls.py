@@ -1,7 +1,7 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework_nested import routers
 from rest_framework_simplejwt import views as jwt_views
-from . import views
+from . import async_views, views
 
 
 router = routers.DefaultRouter()
@@ -9,8 +9,8 @@ router.register('products', views.ProductViewSet, basename='products')
 router.register('categories', views.CategoryViewSet, basename='categories')
 router.register('reviews', views.ReviewViewSet, basename='reviews')
 router.register('carts', views.CartViewSet, basename='carts')
-router.register('cartitems', views.CartItemViewSet, basename='cartitems')
 router.register('customers', views.CustomerViewSet, basename='customer')
+router.register('orders', views.OrderViewSet, basename='orders')
 
 
 products_router = routers.NestedDefaultRouter(router, 'products', lookup='product')
@@ -24,4 +24,14 @@ urlpatterns = [
     path('', include(router.urls)),
     path('', include(products_router.urls)),
     path('', include(carts_router.urls)),
+    path('cache/stats/', views.CacheStatsView.as_view(), name='cache-stats'),
+    path('jobs/stats/', views.JobStatsView.as_view(), name='job-stats'),
+    re_path(r'^export/products\.(?P<file_format>csv|jsonl)$', views.ProductExportView.as_view(), name='export-products'),
+    re_path(r'^export/customers\.(?P<file_format>csv|jsonl)$', views.CustomerExportView.as_view(), name='export-customers'),
+    re_path(r'^export/orders\.(?P<file_format>csv|jsonl)$', views.OrderExportView.as_view(), name='export-orders'),
+    # async variants of the hot read endpoints, for the ASGI server (see store/async_views.py)
+    path('async/products/', async_views.product_list, name='async-products-list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async-products-detail'),
+    path('async/categories/', async_views.category_list, name='async-categories-list'),
+    path('async/carts/<uuid:pk>/', async_views.cart_detail, name='async-carts-detail'),
 ]
\ No newline at end of file
@@ -0,0 +1,211 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+from rest_framework.response import Response
+from .images import get_url_builder, get_variants_srcset
+from .models import CartItem, ProductImage
+from .pricing import get_membership
+from .serializers import CartItemProductSerializer, CartItemSerializer, CartSerializer, CategorySerializer, ProductSerializer
+
+
+# DRF fields whose representation of a database value is the value itself (int, str, bool), so it is copied as is
+PLAIN_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.BooleanField, serializers.PrimaryKeyRelatedField)
+
+
+# ValuesSerializer class, a read-only renderer of queryset.values() rows with the exact representation of `serializer_class`.
+# The fields of the serializer are compiled once into a list of (key, column, converter): plain columns are copied, other
+# model fields go through the DRF field's own to_representation(), and fields that are not a column of the model (nested
+# serializers, properties) must be rendered by a represent_<field>(rows) method of the subclass, which fills row[field]
+# for the whole page at once, or be named in `annotations`, the annotations of the viewset's queryset fetched as columns. Model instances and the per-field machinery of DRF are skipped.
+class ValuesSerializer:
+    serializer_class = None
+    annotations = ()
+    _compiled = None
+
+    # `names`, when given, keeps only the named fields
+    def __init__(self, context=None, names=None):
+        self.context = context or {}
+        self.names = None if names is None else set(names)
+
+    @classmethod
+    def compile(cls):
+        if cls.__dict__.get('_compiled') is None:
+            model = cls.serializer_class.Meta.model
+            columns = {field.name: field.attname for field in model._meta.concrete_fields}
+            mapping = []
+            for name, field in cls.serializer_class().fields.items():
+                if hasattr(cls, f'represent_{name}'):
+                    mapping.append((name, name, None))
+                elif field.source in columns or field.source in cls.annotations:
+                    converter = None if isinstance(field, PLAIN_FIELDS) else field.to_representation
+                    mapping.append((name, columns.get(field.source, field.source), converter))
+                else:
+                    raise ImproperlyConfigured(f'{cls.__name__} cannot render the field "{name}": add a represent_{name}(rows) method.')
+            cls._compiled = mapping
+        return cls._compiled
+
+    def get_mapping(self):
+        return [item for item in self.compile() if self.names is None or item[0] in self.names]
+
+    # the columns to fetch with queryset.values(): those of the plain fields, and the Meta.field_sources of the represented ones
+    def get_columns(self):
+        sources = getattr(self.serializer_class.Meta, 'field_sources', {})
+        columns = []
+        for name, column, _ in self.get_mapping():
+            columns += sources.get(name, []) if hasattr(self, f'represent_{name}') else [column]
+        return list(dict.fromkeys(columns))
+
+    def to_representation(self, rows):
+        for name, _, _ in self.get_mapping():
+            method = getattr(self, f'represent_{name}', None)
+            if method is not None:
+                method(rows)
+        return self.build(rows)
+
+    # the same as to_representation(), using the arepresent_<field>(rows) coroutine of a field when the subclass has one
+    async def ato_representation(self, rows):
+        for name, _, _ in self.get_mapping():
+            method = getattr(self, f'arepresent_{name}', None)
+            if method is not None:
+                await method(rows)
+            elif hasattr(self, f'represent_{name}'):
+                getattr(self, f'represent_{name}')(rows)
+        return self.build(rows)
+
+    def build(self, rows):
+        mapping = self.get_mapping()
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, converter in mapping:
+                value = row[column]
+                item[name] = value if converter is None or value is None else converter(value)
+            data.append(item)
+        return data
+
+
+# ProductValuesSerializer class, that renders product rows exactly like ProductSerializer, with their images fetched in one query
+class ProductValuesSerializer(ValuesSerializer):
+    serializer_class = ProductSerializer
+    annotations = ['effective_price']
+
+    def represent_available_quantity(self, rows):
+        for row in rows:
+            row['available_quantity'] = max(row['stock_quantity'] - row['reserved_quantity'], 0)
+
+    def represent_rating_histogram(self, rows):
+        for row in rows:
+            row['rating_histogram'] = {str(star): row[f'rating_{star}'] for star in range(1, 6)}
+
+    def get_images_queryset(self, rows):
+        return ProductImage.objects.filter(product_id__in=[row['id'] for row in rows]).values('id', 'product_id', 'image', 'width', 'height', 'variants')
+
+    # group the image rows by product in one pass, in the order the prefetch of ProductSerializer would return them
+    def add_images(self, rows, image_rows):
+        images = {row['id']: [] for row in rows}
+        request = self.context.get('request')
+        build_image_url = get_url_builder(ProductImage._meta.get_field('image').storage, request)
+        build_variant_url = get_url_builder(default_storage, request)
+        for image in image_rows:
+            images[image['product_id']].append({
+                'id': image['id'],
+                'image': build_image_url(image['image']) if image['image'] else None,
+                'width': image['width'],
+                'height': image['height'],
+                'srcset': get_variants_srcset(image['variants'], build_variant_url),
+            })
+        for row in rows:
+            row['images'] = images[row['id']]
+
+    def represent_images(self, rows):
+        self.add_images(rows, self.get_images_queryset(rows) if rows else [])
+
+    async def arepresent_images(self, rows):
+        self.add_images(rows, [image async for image in self.get_images_queryset(rows)] if rows else [])
+
+
+# CategoryValuesSerializer class, that renders category rows exactly like CategorySerializer
+class CategoryValuesSerializer(ValuesSerializer):
+    serializer_class = CategorySerializer
+
+
+# CartValuesSerializer class, that renders cart rows exactly like CartSerializer, with their items and products fetched in one query
+class CartValuesSerializer(ValuesSerializer):
+    serializer_class = CartSerializer
+
+    # the items with their prices for the membership tier of the caller
+    def get_items_queryset(self, rows):
+        return CartItem.objects.with_prices(get_membership(self.context.get('request')))\
+            .filter(cart_id__in=[row['id'] for row in rows])\
+            .values('id', 'cart_id', 'quantity', 'product_id', 'product__name', 'product__price', 'unit_price', 'total_price')
+
+    # group the item rows by cart, and add up the total price of every cart from them
+    def add_items(self, rows, item_rows):
+        price = CartItemProductSerializer().fields['price']
+        fields = CartItemSerializer().fields
+        items = {row['id']: [] for row in rows}
+        totals = {row['id']: 0 for row in rows}
+        for item in item_rows:
+            totals[item['cart_id']] += item['total_price']
+            items[item['cart_id']].append({
+                'id': item['id'],
+                'product': {'id': item['product_id'], 'name': item['product__name'], 'price': price.to_representation(item['product__price'])},
+                'quantity': item['quantity'],
+                'unit_price': fields['unit_price'].to_representation(item['unit_price']),
+                'total_price': fields['total_price'].to_representation(item['total_price']),
+            })
+        for row in rows:
+            row['items'] = items[row['id']]
+            row['total_price'] = totals[row['id']]
+
+    def represent_items(self, rows):
+        self.add_items(rows, self.get_items_queryset(rows) if rows else [])
+
+    async def arepresent_items(self, rows):
+        self.add_items(rows, [item async for item in self.get_items_queryset(rows)] if rows else [])
+
+    # the total price comes with the items
+    def represent_total_price(self, rows):
+        if rows and 'items' not in rows[0]:
+            self.represent_items(rows)
+
+    async def arepresent_total_price(self, rows):
+        if rows and 'items' not in rows[0]:
+            await self.arepresent_items(rows)
+
+
+# ValuesListMixin class, the opt-in fast path of a viewset's list(): set `values_serializer_class` to a ValuesSerializer
+# rendering the same representation as the viewset's serializer. The filtered (and annotated, e.g. search_rank) queryset is
+# fetched with values(), paginated as dicts and rendered by the values serializer. Leave it None to use the regular serializer.
+# With a FieldsetMixin, ?fields= is honoured; nested fieldsets and ?expand= go through the regular serializer.
+class ValuesListMixin:
+    values_serializer_class = None
+
+    # the values serializer of the request, or None when it needs the regular serializer
+    def get_values_serializer(self):
+        fields, expand = self.get_fieldset() if hasattr(self, 'get_fieldset') else (None, {})
+        if self.values_serializer_class is None or expand or any((fields or {}).values()):
+            return None
+        names = None if fields is None else self.get_fieldset_serializer().fields
+        return self.values_serializer_class(context=self.get_serializer_context(), names=names)
+
+    # the filtered queryset as values() rows. The annotations (e.g. search_rank) and ordering columns are fetched too, as
+    # the paginator reads the position of the last row from them.
+    def get_values_queryset(self, serializer):
+        queryset = self.filter_queryset(self.get_queryset())
+        columns = serializer.get_columns()
+        model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        ordering = [name.lstrip('-') for name in [*queryset.query.order_by, *queryset.model._meta.ordering, 'id'] if isinstance(name, str)]
+        extra = dict.fromkeys(name for name in [*queryset.query.annotations, *ordering] if name in model_fields or name in queryset.query.annotations)
+        return queryset.prefetch_related(None).values(*columns, *[name for name in extra if name not in columns])
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_values_serializer()
+        if serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = self.get_values_queryset(serializer)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(list(rows)))
@@ -1,39 +1,92 @@
+import hashlib
+import uuid
+from decimal import Decimal
 from django.db import transaction
-from django.db.models import Count
+from django.db.models import F, Prefetch
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
 from django.shortcuts import render, get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework import status
-from .models import Category, Product, ProductImage, Review, Cart, CartItem, Customer
+from .models import Category, Product, ProductImage, Review, Cart, CartItem, Customer, Order, OrderItem
 from .filters import ProductFilter
-from .paginations import DefaultPagination
-from .serializers import ProductSerializer, ProductImageSerializer, CreateProductSerializer, UpdateProductSerializer, CategorySerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, CustomerSerializer
+from .paginations import DefaultPagination, KeysetPagination
+from .search import ProductSearchFilter
+from .caching import CachedResponseMixin, get_cache_stats
+from .jobs import get_job_stats
+from .pricing import PricingMixin, get_effective_price_expression, get_membership
+from .reservations import delete_items
+from .conditional import ConditionalGetMixin
+from .fieldsets import FieldsetMixin
+from .valueserializers import CategoryValuesSerializer, ProductValuesSerializer, ValuesListMixin
+from .exports import ExportView, get_batches
+from .metrics import render_metrics
+from .aggregates import update_product_rating
+from .serializers import ProductSerializer, BulkUpdateProductSerializer, ProductImageSerializer, CreateProductSerializer, UpdateProductSerializer, CategorySerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, CustomerSerializer, OrderSerializer, CreateOrderSerializer
 from authsys.models import User
 
 # Create your views here.
 
 # ProductViewSet that supports all request methods inheritting from ModelViewset
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(PricingMixin, ConditionalGetMixin, CachedResponseMixin, FieldsetMixin, ValuesListMixin, ModelViewSet):
     http_method_names = ['get', 'patch', 'post', 'delete']
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # list pages are rendered from values() rows, with the same output as ProductSerializer (see store/valueserializers.py)
+    values_serializer_class = ProductValuesSerializer
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
-    pagination_class = DefaultPagination
+    pagination_class = KeysetPagination
     search_fields = ['name', 'category__title']
-    ordering_fields = ['price', 'stock_quantity']
-    queryset = Product.objects.prefetch_related('images').all()
+    ordering_fields = ['price', 'effective_price', 'stock_quantity', 'rating_avg', 'rating_count']
+    queryset = Product.objects.all()
+    # reservations change the available stock on every cart action without invalidating the catalog cache (see store/reservations.py)
+    live_fields = ['available_quantity']
+
+    # read the available stock of the products of a cached response from their rows
+    def refresh_live_fields(self, items):
+        products = Product.objects.filter(pk__in=[item['id'] for item in items]).values_list('id', 'stock_quantity', 'reserved_quantity')
+        available = {product_id: max(stock_quantity - reserved_quantity, 0) for product_id, stock_quantity, reserved_quantity in products}
+        for item in items:
+            item['available_quantity'] = available.get(item['id'], 0)
+
+    # override the get_queryset method to annotate the effective price of the caller's membership tier, which the filters and
+    # the ordering can use too, and to prefetch the images and join the category only when the response renders them
+    def get_queryset(self):
+        queryset = super().get_queryset().annotate(effective_price=get_effective_price_expression(self.get_membership()))
+        if self.is_requested('images'):
+            queryset = queryset.prefetch_related('images')
+        if self.is_expanded('category'):
+            queryset = queryset.select_related('category')
+        return queryset
 
     # override the destroy() method to check for some condition before deleting a product. (Checks if the product is included in an order to prevent deletion)
     def destroy(self, request, *args, **kwargs):
-        product = Product.objects.get(pk=self.kwargs['pk'])
-        if product.ordered.count() > 0:
+        product = get_object_or_404(Product, pk=self.kwargs['pk'])
+        if product.ordered.exists():
             return Response({'error': 'Cannot delete this product because it is associated with an existing order'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
-        return super().destroy(request, *args, **kwargs)
+        product.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
     
+    # bulk price/stock update for feeds: PATCH store/products/bulk/ with a list of {id, stock_quantity, price} records.
+    # Valid rows are applied in one transaction, invalid ones are reported with their index in the list.
+    @action(detail=False, methods=['patch'], url_path='bulk')
+    def bulk_update(self, request):
+        serializer = BulkUpdateProductSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        updated = serializer.save()
+        return Response({'updated': updated, 'errors': serializer.row_errors})
+
     # override the get_serializer_class method to return different serializers on different requests
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -64,51 +117,100 @@ class ProductImageViewSet(ModelViewSet):
 
 
 # CategoryViewSet that supports all request methods inheritting fro ModelViewset
-class CategoryViewSet(ModelViewSet):
-    queryset = Category.objects.all().annotate(products_count=Count('products'))
+class CategoryViewSet(ConditionalGetMixin, CachedResponseMixin, ValuesListMixin, ModelViewSet):
+    queryset = Category.objects.all()
     serializer_class = CategorySerializer
-    pagination_class = DefaultPagination
+    values_serializer_class = CategoryValuesSerializer
+    pagination_class = KeysetPagination
 
     # override the destroy method to check for some conditions before deleting a category. (Checks if the category has existing products to prevent deletion)
     def destroy(self, request, *args, **kwargs):
-        category = get_object_or_404(
-            Category.objects.all().\
-            annotate(products_count=Count('products')), pk=self.kwargs['pk'])
-        if category.products.count() > 0:
+        category = get_object_or_404(Category, pk=self.kwargs['pk'])
+        if category.products_count > 0:
             return Response({'error':'Can not delete category because it has one or more products'})
         return super().destroy(request, *args, **kwargs)
     
 
 # ReviewViewSet that supports all request methods inheritting from ModelViewset
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(FieldsetMixin, ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
 
     # override the get_queryset method to return only reviews specific to a product instance
     def get_queryset(self):
         product_pk = self.kwargs.get('product_pk', None)
         reviews_list = Review.objects.all()
+        if self.is_expanded('customer'):
+            reviews_list = reviews_list.select_related('customer__user')
         if product_pk:
-            reviews = Review.objects.filter(product_id=product_pk)
+            reviews = reviews_list.filter(product_id=product_pk)
             return reviews
         return reviews_list
 
     # method get a serializer context (url kwargs) and pass it to the serializer
     def get_serializer_context(self):
         return {'product_id': self.kwargs.get('product_pk', None)}
+
+    # override the perform_create, perform_update and perform_destroy methods to keep the product's rating aggregates in step with its reviews
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            review = serializer.save()
+            update_product_rating(review.product_id, new_rating=review.rating)
+
+    def perform_update(self, serializer):
+        old_rating = serializer.instance.rating
+        with transaction.atomic():
+            review = serializer.save()
+            update_product_rating(review.product_id, old_rating=old_rating, new_rating=review.rating)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            update_product_rating(instance.product_id, old_rating=instance.rating)
     
 
 
-class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+class CartViewSet(FieldsetMixin, CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
+    queryset = Cart.objects.all()
     serializer_class = CartSerializer
 
+    # override the get_queryset method to prefetch the items, with only the product columns they render and their prices for the
+    # caller's membership tier, when the response needs them
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.is_requested('items') or self.is_requested('total_price'):
+            items = CartItem.objects.with_prices(get_membership(self.request)).select_related('product')\
+                .only('id', 'cart_id', 'quantity', 'product__id', 'product__name', 'product__price')
+            queryset = queryset.prefetch_related(Prefetch('items', queryset=items))
+        return queryset
+
     def destroy(self, request, pk):
-        cart = Cart.objects.get(pk=pk)
-        if cart.items.count() > 0:
+        cart = get_object_or_404(Cart, pk=pk)
+        if cart.items.exists():
             return Response({'error': 'Can not delete this cart because it contains some items'})
         cart.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    # summary action (GET store/carts/id/summary) that returns only the item count and total price of a cart, computed in one
+    # query without loading the items. The ETag lets a mini-cart badge poll it and get a 304 while nothing changed.
+    @action(detail=True)
+    def summary(self, request, pk=None):
+        try:
+            uuid.UUID(pk)
+        except ValueError:
+            raise Http404
+        cart = Cart.objects.with_totals(get_membership(request)).filter(pk=pk).values('id', 'item_count', 'total_price').first()
+        if cart is None:
+            raise Http404
+        cart['total_price'] = Decimal(cart['total_price']).quantize(Decimal('0.01'))
+
+        etag = quote_etag(hashlib.md5(f"{cart['item_count']}:{cart['total_price']}".encode()).hexdigest())
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+        return Response(cart, headers={'ETag': etag})
+
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
@@ -124,28 +226,194 @@ class CartItemViewSet(ModelViewSet):
 
     def get_queryset(self):
         cart_id = self.kwargs['cart_pk']
-        return CartItem.objects.select_related('product').filter(cart_id=cart_id)
+        return CartItem.objects.with_prices(get_membership(self.request)).select_related('product').filter(cart_id=cart_id)
     
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
+
+    # override the perform_create, perform_update and perform_destroy methods to record activity on the cart, which keeps it from expiring
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        Cart.objects.filter(pk=self.kwargs['cart_pk']).touch()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        Cart.objects.filter(pk=self.kwargs['cart_pk']).touch()
+
+    # the stock reserved for a deleted item is released with it
+    def perform_destroy(self, instance):
+        delete_items(CartItem.objects.filter(pk=instance.pk))
+        Cart.objects.filter(pk=self.kwargs['cart_pk']).touch()
+
+    # override the get_serializer method to accept a list of {product_id, quantity} in one POST request
+    def get_serializer(self, *args, **kwargs):
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+        return super().get_serializer(*args, **kwargs)
     
 
 # CustomerViewSet that supports all request methods inheritting from ModelViewset
-class CustomerViewSet(ModelViewSet):
+class CustomerViewSet(FieldsetMixin, ModelViewSet):
     serializer_class = CustomerSerializer
     permission_classes = [IsAuthenticated] # A user must be authenticated in order to create a customer record
 
-    # override the get_queryset method to return only the customer record specific to the logged in user
+    # override the get_queryset method to return only the customer record specific to the logged in user.
+    # The user is joined only when the response renders its names.
     def get_queryset(self):
         user = self.request.user
+        customers = Customer.objects.all()
+        if self.is_requested('first_name') or self.is_requested('last_name'):
+            customers = customers.select_related('user')
         if user.is_staff:
-            return Customer.objects.all()
+            return customers
         else:
-            return Customer.objects.filter(user=self.request.user)
+            return customers.filter(user=self.request.user)
 
     # override the perform_create method to get the user from the request and associate it with the customer serializer
     def perform_create(self, serializer):
         user = self.request.user
         serializer.save(user=user)
-    
-    
\ No newline at end of file
+
+
+# OrderViewSet that lists and retrieves the orders of the logged in customer (all orders for admins), and converts a cart into an order on POST
+class OrderViewSet(ModelViewSet):
+    http_method_names = ['get', 'post']
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = Order.objects.with_totals().prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+        if self.request.user.is_staff:
+            return queryset.all()
+        return queryset.filter(customer__user_id=self.request.user.id)
+
+    def get_serializer_class(self):
+        if self.request.method == 'POST':
+            return CreateOrderSerializer
+        return OrderSerializer
+
+    # override the create() method to run the checkout and respond with the created order
+    def create(self, request, *args, **kwargs):
+        # the customer profile comes with the cached user of the request (see authsys/authentication.py), when it has one
+        customer = getattr(request.user, 'customer', None)
+        context = {
+            'user_id': request.user.id,
+            'customer_id': customer.id if customer is not None else None,
+            'membership': customer.membership if customer is not None else None,
+        }
+        serializer = CreateOrderSerializer(data=request.data, context=context)
+        serializer.is_valid(raise_exception=True)
+        order = serializer.save()
+        order = self.get_queryset().get(pk=order.pk)
+        return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
+
+
+# CacheStatsView that returns the hit/miss/eviction counters of the catalog response cache (admin only)
+class CacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_cache_stats())
+
+
+# JobStatsView, that reports the background job queue (admin only): jobs per status and task, the age of the oldest due
+# job and the latest failures with their errors
+class JobStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_job_stats())
+
+
+# metrics view that serves the request metrics of every worker process in the Prometheus text format, for scrapers.
+# A plain django view rather than an APIView, so a scrape runs no authentication query. Scrapers authenticate with the
+# METRICS_TOKEN bearer token; without a token, only clients in INTERNAL_IPS are served.
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# ProductExportView that streams every product with its category as CSV or JSON lines (admin only).
+# Accepts the same filter params as the product list, e.g. /store/export/products.csv?category_id=3&price__gte=10
+class ProductExportView(ExportView):
+    filename = 'products'
+    columns = [
+        'id', 'name', 'description', 'price', 'discount', 'stock_quantity', 'category_id', 'category_title',
+        'rating_avg', 'rating_count', 'updated_at'
+    ]
+
+    def get_queryset(self):
+        filterset = ProductFilter(self.request.query_params, queryset=Product.objects.order_by('id'))
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        fields = [column for column in self.columns if column != 'category_title']
+        return filterset.qs.values(*fields, category_title=F('category__title'))
+
+
+# CustomerExportView that streams every customer with the names and email of its user (admin only)
+class CustomerExportView(ExportView):
+    filename = 'customers'
+    columns = ['id', 'user_id', 'username', 'email', 'first_name', 'last_name', 'phone', 'birth_date', 'membership']
+
+    def get_queryset(self):
+        return Customer.objects.order_by('id').values(
+            'id', 'user_id', 'phone', 'birth_date', 'membership',
+            username=F('user__username'), email=F('user__email'),
+            first_name=F('user__first_name'), last_name=F('user__last_name')
+        )
+
+
+# OrderExportView that streams every order with its line items and total (admin only).
+# JSON lines hold one order per line with an `items` list; CSV has one line per item, repeating the order columns.
+class OrderExportView(ExportView):
+    filename = 'orders'
+    columns = [
+        'id', 'placed_at', 'payment_status', 'customer_id', 'total',
+        'item_id', 'product_id', 'product_name', 'quantity', 'unit_price'
+    ]
+
+    # one row per order item, in order, so the items of an order are consecutive and the order can be built in a single pass
+    def get_queryset(self):
+        return Order.objects.order_by('id', 'items__id').values(
+            'id', 'placed_at', 'payment_status', 'customer_id',
+            item_id=F('items__id'), product_id=F('items__product_id'), product_name=F('items__product__name'),
+            quantity=F('items__quantity'), unit_price=F('items__unit_price')
+        )
+
+    # the item rows are read for batches of EXPORT_CHUNK_SIZE orders, found by keyset on the order id
+    def get_rows(self, queryset):
+        for orders in get_batches(Order.objects.order_by('id').values('id')):
+            yield from queryset.filter(id__in=[order['id'] for order in orders])
+
+    def get_records(self, queryset):
+        order = None
+        for row in self.get_rows(queryset):
+            if order is None or order['id'] != row['id']:
+                if order is not None:
+                    yield order
+                order = {
+                    'id': row['id'], 'placed_at': row['placed_at'], 'payment_status': row['payment_status'],
+                    'customer_id': row['customer_id'], 'total': Decimal('0.00'), 'items': []
+                }
+            if row['item_id'] is not None:
+                order['items'].append({
+                    'id': row['item_id'], 'product_id': row['product_id'], 'product_name': row['product_name'],
+                    'quantity': row['quantity'], 'unit_price': row['unit_price']
+                })
+                order['total'] = (order['total'] + row['quantity'] * row['unit_price']).quantize(Decimal('0.01'))
+        if order is not None:
+            yield order
+
+    def get_csv_records(self, queryset):
+        for order in self.get_records(queryset):
+            items = order.pop('items') or [{}]
+            for item in items:
+                yield {
+                    **order, 'item_id': item.get('id'), 'product_id': item.get('product_id'),
+                    'product_name': item.get('product_name'), 'quantity': item.get('quantity'), 'unit_price': item.get('unit_price')
+                }